@@ -0,0 +1,107 @@
+"""
+Compares the throughput of AvroEncoder.encode_batch, which uses avro's DatumWriter,
+against FastAvroEncoder on LocationVisits rows parsed from a synthetic allsites
+response. Run from the repository root with:
+
+    python -m benchmarks.bench_avro_encode
+"""
+
+import argparse
+import avro.schema
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from benchmarks.synthetic import (
+    BENCHMARK_ENV_VARS,
+    LOCATION_VISITS_SCHEMA,
+    build_allsites_response,
+    build_location_hours_dict,
+    build_site_ids,
+)
+from datetime import date
+from nypl_py_utils.classes.avro_client import AvroEncoder
+from nypl_py_utils.functions.log_helper import create_log
+
+
+def _time_best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # 174 sites with 3 orbits is just over 50,000 rows
+    parser.add_argument("--sites", type=int, default=174)
+    parser.add_argument("--orbits", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for key, value in BENCHMARK_ENV_VARS.items():
+        os.environ.setdefault(key, value)
+    from lib import LocationVisitsRow, ShopperTrakApiClient
+    from lib.fast_avro_encoder import FastAvroEncoder
+
+    query_date = date(2024, 1, 1)
+    site_ids = build_site_ids(args.sites)
+    client = ShopperTrakApiClient(
+        "user", "password", build_location_hours_dict(site_ids), []
+    )
+    rows = client.parse_response(
+        ET.fromstring(
+            build_allsites_response(site_ids, query_date, num_orbits=args.orbits)
+        ),
+        query_date,
+    )
+    schema = avro.schema.parse(json.dumps(LOCATION_VISITS_SCHEMA))
+
+    # AvroClient.__init__ fetches the schema from the Platform API, so it is skipped
+    avro_encoder = AvroEncoder.__new__(AvroEncoder)
+    avro_encoder.logger = create_log("avro_client")
+    avro_encoder.schema = schema
+    fast_encoder = FastAvroEncoder(schema)
+
+    # Parsed rows are LocationVisitsRow named tuples, while encode_batch and avro's
+    # DatumWriter take dictionaries
+    records = [row._asdict() for row in rows]
+    # The same constants the PipelineController passes for every row of a run
+    constants = {"is_fresh": True, "poll_date": client.today_str}
+
+    expected, avro_time = _time_best(lambda: avro_encoder.encode_batch(records), 1)
+    results = [
+        ("AvroEncoder.encode_batch", avro_time),
+    ]
+    for name, func in (
+        ("FastAvroEncoder.encode_batch", lambda: fast_encoder.encode_batch(records)),
+        (
+            "FastAvroEncoder.encode_rows",
+            lambda: fast_encoder.encode_rows(rows, LocationVisitsRow._fields),
+        ),
+        (
+            "FastAvroEncoder.encode_rows with constants",
+            lambda: fast_encoder.encode_rows(
+                rows, LocationVisitsRow._fields, constants
+            ),
+        ),
+    ):
+        encoded, elapsed = _time_best(func, args.repeat)
+        if encoded != expected:
+            raise AssertionError(f"{name} output differs from AvroEncoder")
+        results.append((name, elapsed))
+
+    print(f"{len(rows):,} rows")
+    for name, elapsed in results:
+        print(
+            f"{name}: {elapsed:.3f}s ({len(rows) / elapsed:,.0f} rows/sec, "
+            f"{avro_time / elapsed:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
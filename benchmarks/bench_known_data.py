@@ -0,0 +1,98 @@
+"""
+Compares the memory use and lookup time of KnownDataIndex against a dictionary of
+tuples keyed by (site ID, orbit, datetime) that is looked up with strptime, as was
+done before. Run from the repository root with:
+
+    python -m benchmarks.bench_known_data
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.synthetic import build_site_ids
+from datetime import date, datetime, timedelta
+from lib.known_data_index import KnownDataIndex
+
+
+def _build_known_rows(site_ids, num_orbits, num_days):
+    start = datetime.combine(date(2024, 1, 1), datetime.min.time())
+    redshift_id = 0
+    for day in range(num_days):
+        for site_id in site_ids:
+            for orbit in range(1, num_orbits + 1):
+                for increment in range(96):
+                    redshift_id += 1
+                    yield (
+                        site_id,
+                        orbit,
+                        start + timedelta(days=day, minutes=15 * increment),
+                        redshift_id,
+                        redshift_id % 10 != 0,
+                        redshift_id % 50,
+                        redshift_id % 40,
+                    )
+
+
+def _measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--orbits", type=int, default=3)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    site_ids = build_site_ids(args.sites)
+    lookups = [
+        (row[0], row[1], row[2].strftime("%Y-%m-%d %H:%M:%S"))
+        for row in _build_known_rows(site_ids, args.orbits, args.days)
+    ]
+
+    known_dict, dict_size, dict_build = _measure(
+        lambda: {
+            (site_id, orbit, inc_start): (redshift_id, is_healthy, enters, exits)
+            for site_id, orbit, inc_start, redshift_id, is_healthy, enters, exits in (
+                _build_known_rows(site_ids, args.orbits, args.days)
+            )
+        }
+    )
+    known_index, index_size, index_build = _measure(
+        lambda: KnownDataIndex.from_rows(
+            _build_known_rows(site_ids, args.orbits, args.days)
+        )
+    )
+
+    start = time.perf_counter()
+    for site_id, orbit, increment_start in lookups:
+        known_dict.get(
+            (site_id, orbit, datetime.strptime(increment_start, "%Y-%m-%d %H:%M:%S"))
+        )
+    dict_lookup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for site_id, orbit, increment_start in lookups:
+        known_index.get(site_id, orbit, increment_start)
+    index_lookup = time.perf_counter() - start
+
+    print(f"{len(lookups):,} known rows")
+    for name, size, build, lookup in (
+        ("dict + strptime", dict_size, dict_build, dict_lookup),
+        ("KnownDataIndex", index_size, index_build, index_lookup),
+    ):
+        print(
+            f"{name}: {size / 2**20:.1f} MiB, built in {build:.3f}s, "
+            f"{len(lookups) / lookup:,.0f} lookups/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
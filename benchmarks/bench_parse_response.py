@@ -0,0 +1,56 @@
+"""
+Measures ShopperTrakApiClient.parse_response throughput in rows/sec on a synthetic
+allsites response. Run from the repository root with:
+
+    python -m benchmarks.bench_parse_response
+"""
+
+import argparse
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from benchmarks.synthetic import (
+    BENCHMARK_ENV_VARS,
+    build_allsites_response,
+    build_location_hours_dict,
+    build_site_ids,
+)
+from datetime import date
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=200)
+    parser.add_argument("--orbits", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for key, value in BENCHMARK_ENV_VARS.items():
+        os.environ.setdefault(key, value)
+    from lib import ShopperTrakApiClient
+
+    query_date = date(2024, 1, 1)
+    site_ids = build_site_ids(args.sites)
+    client = ShopperTrakApiClient(
+        "user", "password", build_location_hours_dict(site_ids), []
+    )
+    xml_root = ET.fromstring(
+        build_allsites_response(site_ids, query_date, num_orbits=args.orbits)
+    )
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        rows = client.parse_response(xml_root, query_date)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(
+        f"parse_response: {len(rows)} rows from {args.sites} sites in {best:.3f}s "
+        f"({len(rows) / best:,.0f} rows/sec)"
+    )
+
+
+if __name__ == "__main__":
+    main()
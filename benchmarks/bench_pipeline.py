@@ -0,0 +1,270 @@
+"""
+Runs PipelineController.run end to end against a local ShopperTrak stub server and
+in-memory stand-ins for Redshift, S3, and Kinesis, and reports each scenario's wall
+time, API calls, rows sent per second, and peak RSS. Run from the repository root
+with:
+
+    python -m benchmarks.bench_pipeline
+
+The scenarios are:
+
+- catch-up: a few days of all sites data after a missed run
+- backfill: 30 days of all sites data
+- recovery: no new all sites data, but some of the last 30 days are unhealthy or
+  missing and are re-queried site by site
+
+Results are saved as JSON under benchmarks/results, named after the current commit,
+and can be compared with an earlier run using --compare. Extra poller environment
+variables, such as ASYNC_CLIENT=True or BACKFILL_CONCURRENCY=4, can be set with --env.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import pytz
+import resource
+import subprocess
+import time
+import urllib.request
+
+from benchmarks.synthetic import build_site_ids
+from datetime import datetime, timedelta
+from unittest import mock
+
+_SCENARIOS = {
+    "catch-up": {"days_behind": 3, "unhealthy": 0, "missing": 0},
+    "backfill": {"days_behind": 30, "unhealthy": 0, "missing": 0},
+    "recovery": {"days_behind": 0, "unhealthy": 0.1, "missing": 0.02},
+}
+
+
+def _build_env(port, extra_env):
+    base_url = f"http://127.0.0.1:{port}/"
+    return {
+        "LOG_LEVEL": "warning",
+        "SHOPPERTRAK_API_BASE_URL": base_url,
+        "SHOPPERTRAK_USERNAME": "benchmark",
+        "SHOPPERTRAK_PASSWORD": "benchmark",
+        "MAX_RETRIES": "5",
+        "SHOPPERTRAK_RETRY_MIN_SECONDS": "0.05",
+        "SHOPPERTRAK_RETRY_MAX_SECONDS": "0.5",
+        "LOCATION_VISITS_SCHEMA_URL": base_url + "schema",
+        "REDSHIFT_DB_HOST": "benchmark",
+        "REDSHIFT_DB_NAME": "benchmark",
+        "REDSHIFT_DB_USER": "benchmark",
+        "REDSHIFT_DB_PASSWORD": "benchmark",
+        "ALL_SITES_S3_BUCKET": "benchmark",
+        "ALL_SITES_S3_RESOURCE": "all_sites.json",
+        "DATA_LAKE_S3_BUCKET": "benchmark",
+        "DATA_LAKE_S3_PATH": "benchmark/",
+        "S3_BUCKET": "benchmark",
+        "S3_RESOURCE": "state.json",
+        "KINESIS_STREAM_ARN": "benchmark",
+        "KINESIS_BATCH_SIZE": "500",
+        **extra_env,
+    }
+
+
+def _run_scenario(scenario, site_ids, num_orbits, env):
+    """Runs the poller once in this process and returns its measurements"""
+    os.environ.update(env)
+    from benchmarks.stand_ins import (
+        FakeBucket,
+        FakeKinesisClient,
+        FakeRedshiftClient,
+        FakeS3Client,
+        build_discovery_rows,
+    )
+    from lib.pipeline_controller import PipelineController
+
+    yesterday = datetime.now(pytz.timezone("US/Eastern")).date() - timedelta(days=1)
+    last_poll_date = yesterday - timedelta(days=scenario["days_behind"])
+    redshift_client = FakeRedshiftClient(
+        site_ids,
+        build_discovery_rows(
+            site_ids,
+            yesterday - timedelta(days=29),
+            last_poll_date + timedelta(days=1),
+            scenario["unhealthy"],
+            scenario["missing"],
+            num_orbits,
+        ),
+    )
+    s3_clients = {
+        "all_sites.json": FakeS3Client(site_ids),
+        "state.json": FakeS3Client({"last_poll_date": last_poll_date.isoformat()}),
+    }
+    data_lake = FakeBucket()
+    kinesis_clients = []
+
+    def build_kinesis_client(*args):
+        kinesis_clients.append(FakeKinesisClient(*args))
+        return kinesis_clients[-1]
+
+    with mock.patch(
+        "nypl_py_utils.classes.redshift_client.RedshiftClient",
+        return_value=redshift_client,
+    ), mock.patch(
+        "lib.pipeline_controller.S3Client",
+        side_effect=lambda bucket, resource: s3_clients[resource],
+    ), mock.patch(
+        "lib.pipeline_controller.KinesisClient", side_effect=build_kinesis_client
+    ), mock.patch(
+        "lib.pipeline_controller.boto3.resource"
+    ) as mock_resource:
+        mock_resource.return_value.Bucket.return_value = data_lake
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        start = time.perf_counter()
+        controller = PipelineController()
+        controller.run()
+        wall_seconds = time.perf_counter() - start
+
+    rows_sent = sum(client.records for client in kinesis_clients)
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "api_requests": controller.shoppertrak_api_client.request_count,
+        "rows_sent": rows_sent,
+        "rows_per_second": round(rows_sent / wall_seconds, 1),
+        "peak_rss_mib": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "baseline_rss_mib": round(baseline_rss, 1),
+        "data_lake_objects": data_lake.objects,
+        "stale_updates": redshift_client.updated_queries,
+        "last_poll_date": s3_clients["state.json"].cache["last_poll_date"],
+        "metrics": controller.metrics.summary(),
+    }
+
+
+def _call_stub(port, path):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/{path}") as response:
+        return response.read()
+
+
+def _get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _print_comparison(previous, current):
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}):")
+    for name, result in current["scenarios"].items():
+        old = previous["scenarios"].get(name)
+        if old is None:
+            continue
+        print(
+            f"{name}: wall time {old['wall_seconds']:.2f}s -> "
+            f"{result['wall_seconds']:.2f}s "
+            f"({old['wall_seconds'] / result['wall_seconds']:.2f}x), peak RSS "
+            f"{old['peak_rss_mib']:.0f} -> {result['peak_rss_mib']:.0f} MiB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(_SCENARIOS), default=list(_SCENARIOS)
+    )
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--orbits", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds per API request"
+    )
+    parser.add_argument("--busy-rate", type=float, default=0, help="Fraction of E108")
+    parser.add_argument("--down-rate", type=float, default=0, help="Fraction of E000")
+    parser.add_argument(
+        "--quota-limit", type=int, help="Requests served before returning E107"
+    )
+    parser.add_argument(
+        "--env", nargs="*", default=[], help="Extra poller variables as KEY=VALUE"
+    )
+    parser.add_argument("--output", help="Where to save the results as JSON")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    if args.quota_limit is not None:
+        # Stop cleanly on E107 rather than failing the run
+        extra_env.setdefault("SHOPPERTRAK_DAILY_LIMIT", "1000000")
+    site_ids = build_site_ids(args.sites)
+    context = multiprocessing.get_context("spawn")
+
+    from benchmarks.stub_server import serve
+
+    receiver, sender = context.Pipe(duplex=False)
+    server_process = context.Process(
+        target=serve,
+        args=(
+            {
+                "site_ids": site_ids,
+                "num_orbits": args.orbits,
+                "latency": args.latency,
+                "busy_rate": args.busy_rate,
+                "down_rate": args.down_rate,
+                "quota_limit": args.quota_limit,
+            },
+            sender,
+        ),
+        daemon=True,
+    )
+    server_process.start()
+    port = receiver.recv()
+
+    results = {
+        "commit": _get_commit(),
+        "timestamp": datetime.now(pytz.utc).isoformat(timespec="seconds"),
+        "args": vars(args),
+        "scenarios": dict(),
+    }
+    try:
+        for name in args.scenarios:
+            _call_stub(port, "reset")
+            # Each scenario runs in its own process so that peak RSS isn't shared
+            with context.Pool(1) as pool:
+                result = pool.apply(
+                    _run_scenario,
+                    (
+                        _SCENARIOS[name],
+                        site_ids,
+                        args.orbits,
+                        _build_env(port, extra_env),
+                    ),
+                )
+            result["stub_requests"] = json.loads(_call_stub(port, "stats"))
+            results["scenarios"][name] = result
+            print(
+                f"{name}: {result['wall_seconds']:.2f}s, "
+                f"{result['api_requests']} API requests "
+                f"({result['stub_requests']['E108']} E108, "
+                f"{result['stub_requests']['E000']} E000, "
+                f"{result['stub_requests']['E107']} E107), "
+                f"{result['rows_sent']:,} rows sent "
+                f"({result['rows_per_second']:,.0f} rows/sec), "
+                f"peak RSS {result['peak_rss_mib']:.0f} MiB"
+            )
+    finally:
+        server_process.terminate()
+
+    output = args.output or os.path.join(
+        "benchmarks", "results", f"bench_pipeline_{results['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            _print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Measures the peak RSS of parsing and holding a 30-day allsites backfill as
+LocationVisitsRows, compared with the per-row dictionaries that were used before.
+Each row model is measured in its own process so that their peaks don't overlap. Run
+from the repository root with:
+
+    python -m benchmarks.bench_row_memory
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+import xml.etree.ElementTree as ET
+
+from benchmarks.synthetic import (
+    BENCHMARK_ENV_VARS,
+    build_allsites_response,
+    build_location_hours_dict,
+    build_site_ids,
+)
+from datetime import date, timedelta
+
+
+def _peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_backfill(row_model, num_sites, num_orbits, num_days):
+    for key, value in BENCHMARK_ENV_VARS.items():
+        os.environ.setdefault(key, value)
+    from lib import ShopperTrakApiClient
+
+    site_ids = build_site_ids(num_sites)
+    client = ShopperTrakApiClient(
+        "user", "password", build_location_hours_dict(site_ids), []
+    )
+    baseline = _peak_rss_mib()
+
+    start = time.perf_counter()
+    all_rows = []
+    for day in range(num_days):
+        query_date = date(2024, 1, 1) + timedelta(days=day)
+        rows = client.parse_response(
+            ET.fromstring(
+                build_allsites_response(
+                    site_ids, query_date, num_orbits=num_orbits, seed=day
+                )
+            ),
+            query_date,
+        )
+        if row_model == "dict":
+            rows = [row._asdict() for row in rows]
+        all_rows.extend(rows)
+    elapsed = time.perf_counter() - start
+    return len(all_rows), baseline, _peak_rss_mib(), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--orbits", type=int, default=3)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    for row_model in ("dict", "LocationVisitsRow"):
+        with context.Pool(1) as pool:
+            num_rows, baseline, peak, elapsed = pool.apply(
+                _run_backfill, (row_model, args.sites, args.orbits, args.days)
+            )
+        print(
+            f"{row_model}: {num_rows:,} rows over {args.days} days, peak RSS "
+            f"{peak:.0f} MiB ({peak - baseline:.0f} MiB above baseline), parsed in "
+            f"{elapsed:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
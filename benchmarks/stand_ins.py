@@ -0,0 +1,144 @@
+"""
+In-memory stand-ins for the Redshift, S3, and Kinesis clients used by
+PipelineController, for benchmarking the poller end to end
+"""
+
+import copy
+
+from datetime import datetime, time, timedelta
+
+_WEEKDAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+
+class FakeRedshiftClient:
+    """
+    Answers the hours query with 10am-6pm hours for every branch and the discovery
+    query with the given found, unhealthy, and known rows
+    """
+
+    def __init__(self, site_ids, discovery_rows=()):
+        self.hours_rows = [
+            (branch_code, weekday, time(10), time(18))
+            for branch_code in sorted({site_id[:2] for site_id in site_ids})
+            for weekday in _WEEKDAYS
+        ]
+        self.discovery_rows = list(discovery_rows)
+        self.queries = 0
+        self.updated_queries = 0
+
+    def connect(self):
+        pass
+
+    def execute_query(self, query):
+        self.queries += 1
+        if "regular_open" in query:
+            return self.hours_rows
+        return self.discovery_rows
+
+    def execute_transaction(self, queries):
+        self.updated_queries += len(queries)
+
+    def close_connection(self):
+        pass
+
+
+class FakeS3Client:
+    """Keeps a single cached JSON object in memory"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.writes = 0
+
+    def fetch_cache(self):
+        return copy.deepcopy(self.cache)
+
+    def set_cache(self, cache):
+        self.cache = copy.deepcopy(cache)
+        self.writes += 1
+
+    def close(self):
+        pass
+
+
+class FakeBucket:
+    """Counts the objects put into the data lake bucket without keeping them"""
+
+    def __init__(self):
+        self.objects = 0
+        self.bytes = 0
+
+    def put_object(self, Key, Body):
+        self.objects += 1
+        self.bytes += len(Body)
+
+
+class FakeKinesisClient:
+    """Accepts every record sent to it, counting records and PutRecords calls"""
+
+    def __init__(self, stream_arn, batch_size, max_retries=5):
+        self.stream_arn = stream_arn
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.kinesis_client = self
+        self.records = 0
+        self.calls = 0
+
+    def put_records(self, Records, StreamARN):
+        self.records += len(Records)
+        self.calls += 1
+        return {
+            "FailedRecordCount": 0,
+            "Records": [{"SequenceNumber": "1"} for _ in Records],
+        }
+
+    def close(self):
+        pass
+
+
+def build_discovery_rows(
+    site_ids, start_date, end_date, unhealthy_fraction, missing_fraction, num_orbits=3
+):
+    """
+    Returns discovery query rows for the site/dates from start_date up to end_date in
+    which roughly unhealthy_fraction of them have unhealthy data and missing_fraction
+    of them are missing from Redshift entirely
+    """
+    rows = []
+    redshift_id = 0
+    num_days = (end_date - start_date).days
+    for day in range(num_days):
+        visits_date = start_date + timedelta(days=day)
+        for i, site_id in enumerate(site_ids):
+            position = ((day * len(site_ids) + i) * 7919 % 1000) / 1000
+            if position < missing_fraction:
+                continue
+            rows.append(("found", site_id, visits_date) + (None,) * 6)
+            if position >= missing_fraction + unhealthy_fraction:
+                continue
+            rows.append(("unhealthy", site_id, visits_date) + (None,) * 6)
+            day_start = datetime.combine(visits_date, time())
+            for orbit in range(1, num_orbits + 1):
+                for increment in range(96):
+                    redshift_id += 1
+                    rows.append(
+                        (
+                            "known",
+                            site_id,
+                            visits_date,
+                            orbit,
+                            day_start + timedelta(minutes=15 * increment),
+                            redshift_id,
+                            False,
+                            0,
+                            0,
+                        )
+                    )
+    return rows
@@ -0,0 +1,148 @@
+"""
+Local stand-in for the ShopperTrak API and the Platform API schema endpoint, for
+running the poller end to end without using any ShopperTrak API quota
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+
+from benchmarks.synthetic import LOCATION_VISITS_SCHEMA, build_allsites_response
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+_ERROR_RESPONSE = '<?xml version="1.0" ?><message><error>{}</error></message>'
+
+
+class StubShopperTrakServer(ThreadingHTTPServer):
+    """
+    HTTP server that serves synthetic ShopperTrak responses for the given sites:
+
+    - /service/allsites and /service/site/<site ID> return XML for the requested date
+    - /schema returns the LocationVisits Avro schema as the Platform API does
+    - /stats returns the number of requests served since the last /reset
+
+    Every ShopperTrak request waits latency seconds. A busy_rate fraction of them
+    return E108 and a down_rate fraction E000, and every request after the first
+    quota_limit returns E107.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        site_ids,
+        num_orbits=3,
+        latency=0,
+        busy_rate=0,
+        down_rate=0,
+        quota_limit=None,
+        seed=0,
+    ):
+        super().__init__(("127.0.0.1", 0), _StubShopperTrakHandler)
+        self.site_ids = site_ids
+        self.known_site_ids = set(site_ids)
+        self.num_orbits = num_orbits
+        self.latency = latency
+        self.busy_rate = busy_rate
+        self.down_rate = down_rate
+        self.quota_limit = quota_limit
+        self.stats = None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears the request counts, which also resets the quota"""
+        with self._lock:
+            self.stats = {
+                "requests": 0,
+                "allsites": 0,
+                "site": 0,
+                "E000": 0,
+                "E107": 0,
+                "E108": 0,
+            }
+
+    def next_error(self, endpoint):
+        """Counts a ShopperTrak request and returns the error code to inject, if any"""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats[endpoint] += 1
+            roll = self._rng.random()
+            if (
+                self.quota_limit is not None
+                and self.stats["requests"] > self.quota_limit
+            ):
+                error_code = "E107"
+            elif roll < self.down_rate:
+                error_code = "E000"
+            elif roll < self.down_rate + self.busy_rate:
+                error_code = "E108"
+            else:
+                return None
+            self.stats[error_code] += 1
+            return error_code
+
+
+class _StubShopperTrakHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/schema":
+            return self._reply(
+                json.dumps({"data": {"schema": json.dumps(LOCATION_VISITS_SCHEMA)}})
+            )
+        if url.path == "/stats":
+            return self._reply(json.dumps(server.stats))
+        if url.path == "/reset":
+            server.reset()
+            return self._reply("")
+
+        if url.path == "/service/allsites":
+            endpoint, site_ids = "allsites", server.site_ids
+        elif url.path.startswith("/service/site/"):
+            endpoint = "site"
+            site_ids = [unquote(url.path[len("/service/site/") :])]
+        else:
+            return self._reply("", 404)
+
+        time.sleep(server.latency)
+        error_code = server.next_error(endpoint)
+        if error_code is not None:
+            return self._reply(_ERROR_RESPONSE.format(error_code))
+        if not server.known_site_ids.issuperset(site_ids):
+            return self._reply(_ERROR_RESPONSE.format("E104"))
+
+        query_date = datetime.strptime(params["date"][0], "%Y%m%d").date()
+        # Seeded so the same site and date always get the same data
+        seed = zlib.crc32(f"{','.join(site_ids)}|{query_date}".encode())
+        return self._reply(
+            build_allsites_response(
+                site_ids, query_date, num_orbits=server.num_orbits, seed=seed
+            )
+        )
+
+    def _reply(self, body, status=200):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(config, connection):
+    """
+    Runs a StubShopperTrakServer built from the config dictionary until the process
+    is stopped, first sending its port through the multiprocessing connection
+    """
+    server = StubShopperTrakServer(**config)
+    connection.send(server.server_port)
+    server.serve_forever(0.05)
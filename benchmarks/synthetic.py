@@ -0,0 +1,83 @@
+"""
+Helpers for building synthetic ShopperTrak API responses for benchmarking
+"""
+
+import random
+
+from datetime import time
+
+_BRANCH_CODES = [chr(i) + chr(j) for i in range(97, 123) for j in range(97, 123)]
+_WEEKDAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+BENCHMARK_ENV_VARS = {
+    "SHOPPERTRAK_API_BASE_URL": "https://benchmark_shoppertrak_url/",
+    "MAX_RETRIES": "3",
+}
+
+# Matches the fields of the rows produced by ShopperTrakApiClient.parse_response
+LOCATION_VISITS_SCHEMA = {
+    "type": "record",
+    "name": "LocationVisits",
+    "fields": [
+        {"name": "shoppertrak_site_id", "type": "string"},
+        {"name": "orbit", "type": ["null", "int"]},
+        {"name": "increment_start", "type": "string"},
+        {"name": "enters", "type": ["null", "int"]},
+        {"name": "exits", "type": ["null", "int"]},
+        {"name": "is_healthy_data", "type": "boolean"},
+        {"name": "is_missing_data", "type": "boolean"},
+        {"name": "is_fresh", "type": "boolean"},
+        {"name": "poll_date", "type": "string"},
+    ],
+}
+
+
+def build_site_ids(num_sites):
+    """Returns a list of site IDs whose first two characters are the branch code"""
+    return [
+        f"{_BRANCH_CODES[i % len(_BRANCH_CODES)]} site {i}" for i in range(num_sites)
+    ]
+
+
+def build_location_hours_dict(site_ids):
+    """Returns a location hours dictionary covering every branch in site_ids"""
+    return {
+        (site_id[:2], weekday): (time(10), time(18))
+        for site_id in site_ids
+        for weekday in _WEEKDAYS
+    }
+
+
+def build_allsites_response(site_ids, query_date, num_orbits=3, seed=0):
+    """
+    Returns an XML response in the format of the allsites endpoint containing 96
+    15-minute increments per orbit for each of the given sites
+    """
+    rng = random.Random(seed)
+    date_str = query_date.strftime("%Y%m%d")
+    parts = ['<?xml version="1.0" ?><sites>']
+    for site_id in site_ids:
+        parts.append(f'<site siteID="{site_id}"><date dateValue="{date_str}">')
+        for orbit in range(1, num_orbits + 1):
+            parts.append(f'<entrance entranceName="EP {orbit:02}">')
+            for increment in range(96):
+                start_time = f"{increment // 4:02}{increment % 4 * 15:02}00"
+                code = "01" if rng.random() < 0.9 else "02"
+                enters = rng.randint(0, 50) if code == "01" else 0
+                exits = rng.randint(0, 50) if code == "01" else 0
+                parts.append(
+                    f'<traffic code="{code}" exits="{exits}" enters="{enters}" '
+                    f'startTime="{start_time}"/>'
+                )
+            parts.append("</entrance>")
+        parts.append("</date></site>")
+    parts.append("</sites>")
+    return "".join(parts)
@@ -1,74 +1,164 @@
+from datetime import timedelta
+
 _REDSHIFT_HOURS_QUERY = """
     SELECT location_id, weekday, regular_open, regular_close
     FROM {}
     WHERE is_current;"""
 
-_REDSHIFT_CLOSURES_QUERY = """
-    SELECT location_id, closure_date
-    FROM {closures_table}
-    WHERE closure_date >= '{start_date}' AND is_full_day;"""
+_REDSHIFT_DISCOVERY_QUERY = """
+    WITH closures AS (
+        SELECT location_id, closure_date
+        FROM {closures_table}
+        WHERE closure_date >= '{start_date}' AND is_full_day
+    ),
+    unhealthy_site_dates AS (
+        SELECT shoppertrak_site_id, increment_start::DATE AS increment_date
+        FROM {table}
+        WHERE NOT is_healthy_data
+            AND is_fresh
+            AND increment_start >= '{start_date}'
+            AND increment_start < '{end_date}'
+        GROUP BY shoppertrak_site_id, increment_date
+    ),
+    recoverable_site_dates AS (
+        SELECT unhealthy_site_dates.shoppertrak_site_id,
+            unhealthy_site_dates.increment_date
+        FROM unhealthy_site_dates LEFT JOIN closures
+            ON (closures.location_id IS NULL
+                OR closures.location_id = LEFT(unhealthy_site_dates.shoppertrak_site_id, 2))
+            AND closures.closure_date = unhealthy_site_dates.increment_date
+        WHERE closures.closure_date IS NULL
+        GROUP BY unhealthy_site_dates.shoppertrak_site_id,
+            unhealthy_site_dates.increment_date
+    ){missing_ctes}
+    {site_dates_query}
+    UNION ALL
+    SELECT 'unhealthy', shoppertrak_site_id, increment_date,
+        NULL, NULL, NULL, NULL, NULL, NULL
+    FROM recoverable_site_dates
+    UNION ALL
+    SELECT 'known', recoverable_site_dates.shoppertrak_site_id,
+        recoverable_site_dates.increment_date, orbit, increment_start, id,
+        is_healthy_data, enters, exits
+    FROM recoverable_site_dates JOIN {table}
+        ON recoverable_site_dates.shoppertrak_site_id = {table}.shoppertrak_site_id
+        AND recoverable_site_dates.increment_date = {table}.increment_start::DATE
+    WHERE is_fresh;"""
 
-_REDSHIFT_FOUND_SITES_QUERY = """
-    SELECT shoppertrak_site_id, increment_start::DATE AS visits_date
+# The first SELECT of the discovery query sets the types of the known data columns
+_REDSHIFT_KNOWN_COLUMNS = """NULL::INTEGER AS orbit,
+        NULL::TIMESTAMP AS increment_start, NULL::BIGINT AS id,
+        NULL::BOOLEAN AS is_healthy_data, NULL::INTEGER AS enters,
+        NULL::INTEGER AS exits"""
+
+_REDSHIFT_FOUND_SITES_QUERY = """SELECT 'closure' AS kind, location_id AS shoppertrak_site_id,
+        closure_date AS visits_date, {known_columns}
+    FROM closures
+    UNION ALL
+    SELECT 'found', shoppertrak_site_id, increment_start::DATE AS found_date,
+        NULL, NULL, NULL, NULL, NULL, NULL
     FROM {table}
-    WHERE visits_date >= '{start_date}' AND visits_date < '{end_date}'
-    GROUP BY shoppertrak_site_id, visits_date;"""
-
-_REDSHIFT_CREATE_TABLE_QUERY = """
-    CREATE TEMPORARY TABLE #recoverable_site_dates AS
-    SELECT shoppertrak_site_id, increment_start::DATE AS increment_date
-    FROM {table}
-    WHERE NOT is_healthy_data
-        AND is_fresh
-        AND increment_start >= '{start_date}'
-        AND increment_start < '{end_date}'
-    GROUP BY shoppertrak_site_id, increment_date;"""
-
-_REDSHIFT_KNOWN_QUERY = """
-    SELECT #recoverable_site_dates.shoppertrak_site_id, orbit, increment_start,
-        id, is_healthy_data, enters, exits
-    FROM #recoverable_site_dates LEFT JOIN {table}
-        ON #recoverable_site_dates.shoppertrak_site_id = {table}.shoppertrak_site_id
-        AND #recoverable_site_dates.increment_date = {table}.increment_start::DATE
-    WHERE is_fresh;"""
+    WHERE found_date >= '{start_date}' AND found_date < '{end_date}'
+    GROUP BY shoppertrak_site_id, found_date"""
+
+_REDSHIFT_MISSING_SITES_CTES = """,
+    site_ids AS (
+        {site_ids}
+    ),
+    all_dates AS (
+        {dates}
+    ),
+    found_site_dates AS (
+        SELECT shoppertrak_site_id, increment_start::DATE AS found_date
+        FROM {table}
+        WHERE found_date >= '{start_date}' AND found_date < '{end_date}'
+        GROUP BY shoppertrak_site_id, found_date
+    )"""
+
+_REDSHIFT_MISSING_SITES_QUERY = """SELECT 'missing' AS kind, site_ids.shoppertrak_site_id,
+        all_dates.visits_date, {known_columns}
+    FROM site_ids CROSS JOIN all_dates
+        LEFT JOIN found_site_dates
+            ON found_site_dates.shoppertrak_site_id = site_ids.shoppertrak_site_id
+            AND found_site_dates.found_date = all_dates.visits_date
+        LEFT JOIN closures
+            ON (closures.location_id IS NULL
+                OR closures.location_id = LEFT(site_ids.shoppertrak_site_id, 2))
+            AND closures.closure_date = all_dates.visits_date
+    WHERE found_site_dates.found_date IS NULL AND closures.closure_date IS NULL"""
 
 _REDSHIFT_UPDATE_QUERY = """
     UPDATE {table} SET is_fresh = False
     WHERE id IN ({ids});"""
 
-REDSHIFT_DROP_QUERY = "DROP TABLE #recoverable_site_dates;"
-
-REDSHIFT_RECOVERABLE_QUERY = """
-    SELECT *
-    FROM #recoverable_site_dates
-    ORDER BY increment_date, shoppertrak_site_id;"""
-
 
 def build_redshift_hours_query(hours_table):
     return _REDSHIFT_HOURS_QUERY.format(hours_table)
 
 
-def build_redshift_closures_query(closures_table, start_date):
-    return _REDSHIFT_CLOSURES_QUERY.format(
-        closures_table=closures_table, start_date=start_date
+def build_redshift_discovery_query(
+    table, closures_table, start_date, end_date, site_ids=None
+):
+    """
+    Without site_ids, the query returns the closures and the found site/dates for
+    the missing site/dates to be computed by the caller. With site_ids, it returns
+    the missing site/dates themselves, with closures already excluded.
+    """
+    if site_ids is None:
+        missing_ctes = ""
+        site_dates_query = _REDSHIFT_FOUND_SITES_QUERY
+    else:
+        dates = [
+            start_date + timedelta(days=n) for n in range((end_date - start_date).days)
+        ]
+        missing_ctes = _REDSHIFT_MISSING_SITES_CTES.format(
+            site_ids=_build_values_query(
+                [_quote(site_id) for site_id in sorted(site_ids)],
+                "VARCHAR",
+                "shoppertrak_site_id",
+            ),
+            dates=_build_values_query(
+                [f"'{day.isoformat()}'::DATE" for day in dates],
+                "DATE",
+                "visits_date",
+            ),
+            table=table,
+            start_date=start_date,
+            end_date=end_date,
+        )
+        site_dates_query = _REDSHIFT_MISSING_SITES_QUERY
+
+    return _REDSHIFT_DISCOVERY_QUERY.format(
+        table=table,
+        closures_table=closures_table,
+        start_date=start_date,
+        end_date=end_date,
+        missing_ctes=missing_ctes,
+        site_dates_query=site_dates_query.format(
+            known_columns=_REDSHIFT_KNOWN_COLUMNS,
+            table=table,
+            start_date=start_date,
+            end_date=end_date,
+        ),
     )
 
 
-def build_redshift_found_sites_query(table, start_date, end_date):
-    return _REDSHIFT_FOUND_SITES_QUERY.format(
-        table=table, start_date=start_date, end_date=end_date
-    )
+def build_redshift_update_query(table, ids):
+    return _REDSHIFT_UPDATE_QUERY.format(table=table, ids=ids)
 
 
-def build_redshift_create_table_query(table, start_date, end_date):
-    return _REDSHIFT_CREATE_TABLE_QUERY.format(
-        table=table, start_date=start_date, end_date=end_date
+def _build_values_query(values, value_type, column):
+    """
+    Redshift supports neither VALUES lists in FROM clauses nor generate_series on
+    compute nodes, so literal lists are built as SELECTs joined by UNION ALL
+    """
+    if not values:
+        return f"SELECT NULL::{value_type} AS {column} WHERE FALSE"
+    return "\n        UNION ALL ".join(
+        [f"SELECT {values[0]} AS {column}"]
+        + [f"SELECT {value}" for value in values[1:]]
     )
 
 
-def build_redshift_known_query(table):
-    return _REDSHIFT_KNOWN_QUERY.format(table=table)
-
-
-def build_redshift_update_query(table, ids):
-    return _REDSHIFT_UPDATE_QUERY.format(table=table, ids=ids)
+def _quote(value):
+    return "'" + value.replace("'", "''") + "'"
@@ -2,6 +2,11 @@
 This file contains useful functions leveraged across the codebase.
 """
 
+import asyncio
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 
 def log_based_on_poll_date(logger, message, is_bad_poll_date, is_warning=False):
     # Log as normal message if it's a known issue, otherwise
@@ -12,3 +17,49 @@ def log_based_on_poll_date(logger, message, is_bad_poll_date, is_warning=False):
         logger.warning(message)
     else:
         logger.error(message)
+
+
+def map_in_order(func, items, max_workers):
+    """
+    Lazily applies func to each item using up to max_workers threads and yields the
+    results in the same order as the input. At most twice as many items as there are
+    workers are in flight at once so that finished results don't pile up in memory.
+    Any exception is raised when its item is reached, after which no new work starts.
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def map_in_order_async(func, items, max_concurrency):
+    """
+    Same as map_in_order, but for a coroutine function: lazily runs func on each item
+    as a task on the current event loop, with at most twice max_concurrency tasks in
+    flight at once, and yields the results in the same order as the input. Any tasks
+    still running when the generator is closed are cancelled.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(func(item)))
+            if len(pending) >= 2 * max_concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
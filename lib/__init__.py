@@ -1,7 +1,9 @@
 from .shoppertrak_api_client import (
     APIStatus,
+    LocationVisitsRow,
     ShopperTrakApiClient,
     ShopperTrakApiClientError,
     ALL_SITES_ENDPOINT,
     SINGLE_SITE_ENDPOINT,
+    XMLResponseStream,
 )
@@ -0,0 +1,100 @@
+import asyncio
+import httpx
+import os
+
+from lib.shoppertrak_api_client import APIStatus, ShopperTrakApiClient
+from urllib.parse import quote
+
+
+class AsyncShopperTrakApiClient(ShopperTrakApiClient):
+    """
+    Class for querying the ShopperTrak API for location visits data from an asyncio
+    event loop. It has the same interface as ShopperTrakApiClient except that query
+    is a coroutine, and it must be entered with "async with" on the event loop that
+    uses it so that its connections are closed on that loop.
+
+    At most SHOPPERTRAK_POOL_SIZE connections are opened and at most ASYNC_CONCURRENCY
+    requests are sent at once, across every coroutine using the client. Responses are
+    checked, parsed, and cached in worker threads so the event loop is never blocked.
+    """
+
+    def __init__(self, username, password, location_hours_dict, bad_poll_dates):
+        super().__init__(username, password, location_hours_dict, bad_poll_dates)
+        self.concurrency = int(os.environ.get("ASYNC_CONCURRENCY", 10))
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.session.aclose()
+
+    def close(self):
+        if not self.session.is_closed:
+            asyncio.run(self.session.aclose())
+
+    async def query(self, endpoint, query_date, query_count=1, waited_seconds=0):
+        """
+        Sends query to ShopperTrak API and either a) returns the result as an XML root
+        (or as an XMLResponseStream when streaming is enabled) if the query was
+        successful, b) returns APIStatus.ERROR if the query failed but others should be
+        attempted, or c) waits and tries again if the API was busy.
+        """
+        path = "service/" + quote(endpoint)
+        params = self._build_query_params(query_date)
+
+        response_text = await asyncio.to_thread(
+            self._get_cached_response, path, query_date, params
+        )
+        is_cached = response_text is not None
+        if not is_cached:
+            await self.retry_scheduler.wait_for_breaker_async()
+            async with self._semaphore:
+                self._count_request()
+                self.logger.info(f"Querying {endpoint} for {params['date']} data")
+                try:
+                    with self.metrics.timed("shoppertrak.request"):
+                        response = await self.session.get(
+                            self.base_url + path,
+                            headers={"Content-Type": "application/xml"},
+                            params=params,
+                        )
+                        response.raise_for_status()
+                        response_text = response.text
+                except httpx.HTTPError as e:
+                    return self._handle_request_error(
+                        self.base_url + path, e, query_date
+                    )
+
+        with self.metrics.timed("shoppertrak.check_response"):
+            result = await asyncio.to_thread(
+                self._handle_query_response,
+                response_text,
+                path,
+                query_date,
+                params,
+                query_count,
+                waited_seconds,
+                is_cached,
+            )
+        if result == APIStatus.RETRY:
+            with self.metrics.timed("shoppertrak.back_off"):
+                delay = await self.retry_scheduler.back_off_async(query_count)
+            return await self.query(
+                endpoint, query_date, query_count + 1, waited_seconds + delay
+            )
+        return result
+
+    def _build_session(self, username, password, pool_size):
+        return httpx.AsyncClient(
+            auth=httpx.BasicAuth(username, password),
+            headers={
+                "Accept-Encoding": "gzip",
+                "Cache-Control": "no-cache",
+                "Pragma": "no-cache",
+            },
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+        )
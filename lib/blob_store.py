@@ -0,0 +1,91 @@
+import boto3
+import json
+import os
+import threading
+
+from botocore.exceptions import ClientError
+from nypl_py_utils.functions.log_helper import create_log
+
+
+def build_blob_store(location, logger_name):
+    """
+    Returns an S3BlobStore if the location is an s3://bucket/prefix URI and a
+    LocalBlobStore rooted at the location otherwise
+    """
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        return S3BlobStore(bucket, prefix, logger_name)
+    else:
+        return LocalBlobStore(location, logger_name)
+
+
+class LocalBlobStore:
+    """
+    JSON documents stored as files under a local directory. Each document is written
+    to a temporary file first, so a concurrent reader never sees a partial document.
+    """
+
+    def __init__(self, directory, logger_name):
+        self.logger = create_log(logger_name)
+        self.directory = directory
+
+    def read(self, key):
+        """Returns the document stored at the key or None if it can't be read"""
+        try:
+            with open(os.path.join(self.directory, key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, key, document):
+        path = os.path.join(self.directory, key)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(json.dumps(document))
+        os.replace(temp_path, path)
+
+
+class S3BlobStore:
+    """
+    JSON documents stored as objects under a prefix in an S3 bucket. Errors other
+    than a missing object are logged as warnings rather than thrown.
+    """
+
+    def __init__(self, bucket, prefix, logger_name):
+        self.logger = create_log(logger_name)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3_client = boto3.client(
+            "s3", region_name=os.environ.get("AWS_REGION", "us-east-1")
+        )
+
+    def read(self, key):
+        """Returns the document stored at the key or None if it can't be read"""
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket, Key=self.prefix + key
+            )
+            return json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+                self.logger.warning(
+                    f"Could not read {self.prefix + key} from {self.bucket}: {e}"
+                )
+            return None
+        except ValueError:
+            return None
+
+    def write(self, key, document):
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.prefix + key,
+                Body=json.dumps(document).encode("utf-8"),
+            )
+        except ClientError as e:
+            self.logger.warning(
+                f"Could not write {self.prefix + key} to {self.bucket}: {e}"
+            )
@@ -0,0 +1,77 @@
+import queue
+import threading
+import time
+
+from nypl_py_utils.functions.log_helper import create_log
+
+
+class Bootstrap:
+    """
+    Class for loading the poller's independent startup dependencies, such as the
+    Avro schema, the poller state, and the branch hours, at the same time rather than
+    one after another, so that startup takes about as long as the slowest of them.
+
+    Each dependency is loaded in its own daemon thread and has its own timeout. The
+    first dependency to fail or time out is raised as a BootstrapError straight away,
+    without waiting for the others to finish.
+    """
+
+    def __init__(self, timeouts=None, default_timeout=60):
+        self.logger = create_log("bootstrap")
+        self.timeouts = timeouts or dict()
+        self.default_timeout = default_timeout
+
+    def run(self, dependencies):
+        """
+        Calls each of the dependencies, a dictionary of names to functions, and
+        returns a dictionary of the same names to the functions' results
+        """
+        results = queue.Queue()
+        start = time.monotonic()
+        deadlines = {
+            name: start + self.timeouts.get(name, self.default_timeout)
+            for name in dependencies
+        }
+        for name, func in dependencies.items():
+            threading.Thread(
+                target=self._load,
+                args=(name, func, results),
+                name=f"bootstrap-{name}",
+                daemon=True,
+            ).start()
+
+        loaded = dict()
+        while len(loaded) < len(dependencies):
+            name = min(deadlines, key=deadlines.get)
+            try:
+                name, result, error = results.get(
+                    timeout=max(deadlines[name] - time.monotonic(), 0)
+                )
+            except queue.Empty:
+                self._fail(
+                    f"Timed out loading {name} after "
+                    f"{self.timeouts.get(name, self.default_timeout)} seconds"
+                )
+            if error is not None:
+                self._fail(f"Failed to load {name}: {error}", error)
+            loaded[name] = result
+            del deadlines[name]
+            self.logger.debug(
+                f"Loaded {name} after {time.monotonic() - start:.2f} seconds"
+            )
+        return loaded
+
+    def _load(self, name, func, results):
+        try:
+            results.put((name, func(), None))
+        except Exception as e:
+            results.put((name, None, e))
+
+    def _fail(self, message, error=None):
+        self.logger.error(message)
+        raise BootstrapError(message) from error
+
+
+class BootstrapError(Exception):
+    def __init__(self, message=None):
+        self.message = message
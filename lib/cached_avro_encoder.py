@@ -0,0 +1,149 @@
+import avro.schema
+import pytz
+import requests
+import time
+
+from avro.errors import AvroException
+from datetime import datetime, timedelta
+from lib.fast_avro_encoder import FastAvroEncoder, UnsupportedSchemaError
+from nypl_py_utils.classes.avro_client import AvroClientError, AvroEncoder
+from nypl_py_utils.functions.log_helper import create_log
+from requests.exceptions import RequestException
+
+
+class CachedAvroEncoder(AvroEncoder):
+    """
+    AvroEncoder that keeps the last known-good copy of its schema in a SchemaCache so
+    that a slow or unavailable Platform API doesn't block the poller from starting.
+
+    A cached schema fetched less than max_age_hours ago is used without contacting
+    the Platform API at all. Otherwise the schema is re-fetched within fetch_timeout
+    seconds, using the cached ETag so an unchanged schema isn't re-sent. If the fetch
+    fails or returns a malformed schema, the cached copy is used instead. Either way
+    the schema is parsed only once, and the time taken to load it is logged.
+
+    Without a schema cache, the schema is fetched exactly as AvroEncoder does.
+
+    If fast_encoding is set and the schema is flat enough, batches are encoded with a
+    FastAvroEncoder compiled from the schema rather than with avro's DatumWriter.
+    """
+
+    def __init__(
+        self,
+        platform_schema_url,
+        schema_cache=None,
+        fetch_timeout=10,
+        max_age_hours=0,
+        fast_encoding=False,
+    ):
+        start_time = time.monotonic()
+        if schema_cache is None:
+            super().__init__(platform_schema_url)
+            self.schema_source = "Platform API"
+        else:
+            # AvroClient.__init__ always fetches the schema, so it is not called here
+            self.logger = create_log("avro_client")
+            self.session = requests.Session()
+            self.schema_cache = schema_cache
+            self.fetch_timeout = fetch_timeout
+            self.max_age = timedelta(hours=max_age_hours)
+            self.schema, self.schema_source = self._load_schema(platform_schema_url)
+        self.load_seconds = time.monotonic() - start_time
+        self.logger.info(
+            f"Loaded {self.schema.name} Avro schema from {self.schema_source} in "
+            f"{self.load_seconds:.3f} seconds"
+        )
+        self.fast_encoder = self._build_fast_encoder() if fast_encoding else None
+
+    def encode_batch(self, record_list):
+        """
+        Encodes a list of record dictionaries using the given Avro schema.
+
+        Returns a list of byte strings where each string is an encoded record.
+        """
+        if self.fast_encoder is None:
+            return super().encode_batch(record_list)
+        self.logger.info(
+            f"Encoding ({len(record_list)}) records using {self.schema.name} schema"
+        )
+        return self.fast_encoder.encode_batch(record_list)
+
+    def encode_rows(self, rows, field_names, constants=None):
+        """
+        Encodes a list of tuples, such as LocationVisitsRows, whose values are in the
+        order of field_names. Fields in the constants dictionary take the same value
+        in every record. The FastAvroEncoder encodes the tuples directly, encoding the
+        constants only once; otherwise they are converted to dictionaries for avro's
+        DatumWriter.
+        """
+        constants = constants or dict()
+        if self.fast_encoder is None:
+            return super().encode_batch(
+                [{**dict(zip(field_names, row)), **constants} for row in rows]
+            )
+        self.logger.info(
+            f"Encoding ({len(rows)}) records using {self.schema.name} schema"
+        )
+        return self.fast_encoder.encode_rows(rows, field_names, constants)
+
+    def _build_fast_encoder(self):
+        try:
+            return FastAvroEncoder(self.schema)
+        except UnsupportedSchemaError as e:
+            self.logger.info(
+                f"Encoding with avro's DatumWriter instead of a FastAvroEncoder: "
+                f"{e.message}"
+            )
+            return None
+
+    def _load_schema(self, platform_schema_url):
+        """Returns the parsed schema and where it was loaded from"""
+        cached_entry = self.schema_cache.read()
+        if cached_entry is not None and (
+            datetime.fromisoformat(cached_entry["fetched_at"]) + self.max_age
+            > datetime.now(pytz.utc)
+        ):
+            return avro.schema.parse(cached_entry["schema"]), "cache"
+
+        try:
+            headers = dict()
+            if cached_entry is not None and cached_entry.get("etag"):
+                headers["If-None-Match"] = cached_entry["etag"]
+            self.logger.info(f"Fetching Avro schema from {platform_schema_url}")
+            response = self.session.get(
+                url=platform_schema_url, headers=headers, timeout=self.fetch_timeout
+            )
+            response.raise_for_status()
+            if response.status_code == 304 and cached_entry is not None:
+                self._write_cache(cached_entry["schema"], cached_entry.get("etag"))
+                return (
+                    avro.schema.parse(cached_entry["schema"]),
+                    "cache (not modified)",
+                )
+
+            json_schema = response.json()["data"]["schema"]
+            schema = avro.schema.parse(json_schema)
+        except (RequestException, ValueError, KeyError, TypeError, AvroException) as e:
+            message = f"Failed to retrieve schema from {platform_schema_url}: {e}"
+            if cached_entry is None:
+                self.logger.error(message)
+                raise AvroClientError(message) from None
+            self.logger.warning(
+                f"{message}. Falling back to the copy cached at "
+                f"{cached_entry['fetched_at']}"
+            )
+            return avro.schema.parse(cached_entry["schema"]), "cache (fallback)"
+
+        if cached_entry is not None and cached_entry["schema"] != json_schema:
+            self.logger.info("Avro schema has changed since it was last cached")
+        self._write_cache(json_schema, response.headers.get("ETag"))
+        return schema, "Platform API"
+
+    def _write_cache(self, json_schema, etag):
+        self.schema_cache.write(
+            {
+                "schema": json_schema,
+                "etag": etag,
+                "fetched_at": datetime.now(pytz.utc).isoformat(),
+            }
+        )
@@ -0,0 +1,219 @@
+import struct
+
+from nypl_py_utils.classes.avro_client import AvroClientError
+from nypl_py_utils.functions.log_helper import create_log
+
+# Encoded values of the integers most often found in LocationVisits records, such as
+# orbits and 15-minute enters/exits counts
+_SMALL_INT_RANGE = range(-64, 4096)
+
+# Repeated strings, such as site IDs and increment starts, are only encoded once
+# until this many different strings have been seen
+_MAX_CACHED_STRINGS = 65536
+
+
+def _encode_long(n):
+    """Returns the zig-zag varint encoding Avro uses for int and long values"""
+    n = (n << 1) ^ (n >> 63)
+    encoded = bytearray()
+    while n & ~0x7F:
+        encoded.append((n & 0x7F) | 0x80)
+        n >>= 7
+    encoded.append(n)
+    return bytes(encoded)
+
+
+_SMALL_INTS = {n: _encode_long(n) for n in _SMALL_INT_RANGE}
+_INT_BOUNDS = {"int": (-(2**31), 2**31 - 1), "long": (-(2**63), 2**63 - 1)}
+
+
+class FastAvroEncoder:
+    """
+    Class for encoding records of a flat Avro record schema, such as LocationVisits,
+    much faster than avro's DatumWriter while producing the same bytes. A writer for
+    each field is compiled from the schema once, common integers and repeated strings
+    are encoded once and reused, and every record in a batch is written into the same
+    buffer.
+
+    Only records whose fields are primitive types or unions of primitive types are
+    supported. An UnsupportedSchemaError is thrown for any other schema.
+    """
+
+    def __init__(self, schema):
+        self.logger = create_log("fast_avro_encoder")
+        if schema.type != "record":
+            raise UnsupportedSchemaError(f"{schema.type} schemas are not supported")
+        self.field_names = [field.name for field in schema.fields]
+        self._field_writers = [self._compile(field.type) for field in schema.fields]
+        self._string_cache = dict()
+
+    def encode_batch(self, record_list):
+        """
+        Encodes a list of record dictionaries. Returns a list of byte strings where
+        each string is an encoded record.
+        """
+        plan = [
+            (name, writer, None)
+            for name, writer in zip(self.field_names, self._field_writers)
+        ]
+        return self._encode(record_list, plan, dict.get)
+
+    def encode_rows(self, rows, field_names, constants=None):
+        """
+        Encodes records given as tuples of values in the order of field_names. Fields
+        in the constants dictionary have the same value in every record, so they are
+        encoded only once. They don't need to be in each tuple, and if they are, the
+        tuple's value is ignored.
+        """
+        constants = constants or dict()
+        positions = {name: i for i, name in enumerate(field_names)}
+        plan = []
+        for name, writer in zip(self.field_names, self._field_writers):
+            if name in positions and name not in constants:
+                plan.append((positions[name], writer, None))
+            else:
+                plan.append(
+                    (None, None, self._encode_value(writer, constants.get(name)))
+                )
+        return self._encode(rows, plan, tuple.__getitem__)
+
+    def _encode(self, records, plan, get_value):
+        buffer = bytearray()
+        encoded_records = []
+        try:
+            for record in records:
+                buffer.clear()
+                for key, writer, constant in plan:
+                    if writer is None:
+                        buffer += constant
+                    else:
+                        writer(buffer, get_value(record, key))
+                encoded_records.append(bytes(buffer))
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Failed to encode record: {e}")
+            raise AvroClientError(f"Failed to encode record: {e}") from None
+        return encoded_records
+
+    def _encode_value(self, writer, value):
+        try:
+            buffer = bytearray()
+            writer(buffer, value)
+            return bytes(buffer)
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Failed to encode record: {e}")
+            raise AvroClientError(f"Failed to encode record: {e}") from None
+
+    def _compile(self, schema):
+        """Returns a function that writes a value of the given schema to a buffer"""
+        if schema.type == "union":
+            return self._compile_union(schema)
+        if schema.props.get("logicalType") or schema.type not in _MATCHERS:
+            raise UnsupportedSchemaError(f"{schema.type} fields are not supported")
+        return getattr(self, f"_write_{schema.type}")
+
+    def _compile_union(self, schema):
+        branches = []
+        for index, branch_schema in enumerate(schema.schemas):
+            if branch_schema.type == "union":
+                raise UnsupportedSchemaError("Nested unions are not supported")
+            branches.append(
+                (
+                    _MATCHERS.get(branch_schema.type),
+                    _SMALL_INTS[index],
+                    self._compile(branch_schema),
+                )
+            )
+
+        # Like avro, values matching more than one branch are written as the last one
+        branches.reverse()
+
+        def write_union(buffer, value):
+            for matches, encoded_index, writer in branches:
+                if matches(value):
+                    buffer += encoded_index
+                    writer(buffer, value)
+                    return
+            raise TypeError(f"{value!r} does not match any type in the union")
+
+        return write_union
+
+    def _write_null(self, buffer, value):
+        if value is not None:
+            raise TypeError(f"{value!r} is not null")
+
+    def _write_boolean(self, buffer, value):
+        if value is True:
+            buffer.append(1)
+        elif value is False:
+            buffer.append(0)
+        else:
+            raise TypeError(f"{value!r} is not a boolean")
+
+    def _write_int(self, buffer, value):
+        encoded = _SMALL_INTS.get(value) if type(value) is int else None
+        if encoded is None:
+            encoded = _encode_bounded_long(value, "int")
+        buffer += encoded
+
+    def _write_long(self, buffer, value):
+        encoded = _SMALL_INTS.get(value) if type(value) is int else None
+        if encoded is None:
+            encoded = _encode_bounded_long(value, "long")
+        buffer += encoded
+
+    def _write_float(self, buffer, value):
+        if not isinstance(value, (int, float)):
+            raise TypeError(f"{value!r} is not a float")
+        buffer += struct.pack("<f", value)
+
+    def _write_double(self, buffer, value):
+        if not isinstance(value, (int, float)):
+            raise TypeError(f"{value!r} is not a double")
+        buffer += struct.pack("<d", value)
+
+    def _write_string(self, buffer, value):
+        encoded = self._string_cache.get(value)
+        if encoded is None:
+            if not isinstance(value, str):
+                raise TypeError(f"{value!r} is not a string")
+            utf8_value = value.encode("utf-8")
+            encoded = _encode_long(len(utf8_value)) + utf8_value
+            if len(self._string_cache) >= _MAX_CACHED_STRINGS:
+                self._string_cache.clear()
+            self._string_cache[value] = encoded
+        buffer += encoded
+
+    def _write_bytes(self, buffer, value):
+        if not isinstance(value, bytes):
+            raise TypeError(f"{value!r} is not bytes")
+        buffer += _encode_long(len(value))
+        buffer += value
+
+
+def _encode_bounded_long(value, avro_type):
+    if not isinstance(value, int):
+        raise TypeError(f"{value!r} is not an {avro_type}")
+    lower, upper = _INT_BOUNDS[avro_type]
+    if not lower <= value <= upper:
+        raise ValueError(f"{value} is out of range for an {avro_type}")
+    return _encode_long(value)
+
+
+# Decides which branch of a union a value is written as, in the same way as avro
+_MATCHERS = {
+    "null": lambda value: value is None,
+    "boolean": lambda value: isinstance(value, bool),
+    "int": lambda value: isinstance(value, int)
+    and _INT_BOUNDS["int"][0] <= value <= _INT_BOUNDS["int"][1],
+    "long": lambda value: isinstance(value, int)
+    and _INT_BOUNDS["long"][0] <= value <= _INT_BOUNDS["long"][1],
+    "float": lambda value: isinstance(value, (int, float)),
+    "double": lambda value: isinstance(value, (int, float)),
+    "string": lambda value: isinstance(value, str),
+    "bytes": lambda value: isinstance(value, bytes),
+}
+
+
+class UnsupportedSchemaError(Exception):
+    def __init__(self, message=None):
+        self.message = message
@@ -0,0 +1,187 @@
+import itertools
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from helpers.util import map_in_order
+from nypl_py_utils.functions.log_helper import create_log
+
+# Kinesis rejects PutRecords requests with more than 500 records or 5 MiB of data,
+# counting both the data and the partition key of each record
+_MAX_BATCH_RECORDS = 500
+_MAX_BATCH_BYTES = 5 * 2**20
+
+# Error codes for a whole PutRecords request that mean it should be sent again later
+_RETRYABLE_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "KMSThrottlingException",
+    "ThrottlingException",
+}
+_THROTTLE_ERROR_CODE = "ProvisionedThroughputExceededException"
+
+
+class KinesisSender:
+    """
+    Class for sending encoded records to the Kinesis stream of a KinesisClient.
+    Records are split into PutRecords requests of at most the client's batch size and
+    max_batch_bytes bytes, and up to max_in_flight requests are sent at once so that
+    several shards are written to in parallel.
+
+    Rather than pausing after every 1000 records, requests are sent as quickly as
+    Kinesis accepts them. When Kinesis only accepts part of a request, e.g. because a
+    shard is over its limit, just the records that failed are retried, each time
+    waiting exponentially longer from retry_min_seconds up to retry_max_seconds. An
+    error is thrown if any record still fails after the client's max_retries tries.
+    """
+
+    def __init__(
+        self,
+        kinesis_client,
+        max_batch_bytes=_MAX_BATCH_BYTES,
+        max_in_flight=1,
+        retry_min_seconds=0.5,
+        retry_max_seconds=10,
+    ):
+        self.logger = create_log("kinesis_sender")
+        self.kinesis_client = kinesis_client
+        self.max_batch_bytes = min(max_batch_bytes, _MAX_BATCH_BYTES)
+        self.max_in_flight = max_in_flight
+        self.retry_min_seconds = retry_min_seconds
+        self.retry_max_seconds = retry_max_seconds
+
+        self.records_sent = 0
+        self.put_records_calls = 0
+        self.retried_records = 0
+        self.throttled_records = 0
+        self.busy_seconds = 0.0
+        self._partition_keys = itertools.count(time.time_ns())
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.kinesis_client.close()
+
+    def send_records(self, records):
+        """
+        Sends a list of records (usually Avro-encoded byte strings) to Kinesis,
+        returning once every record has been accepted
+        """
+        start_time = time.monotonic()
+        try:
+            for _ in map_in_order(
+                self._send_batch, self._build_batches(records), self.max_in_flight
+            ):
+                pass
+        finally:
+            with self._lock:
+                self.busy_seconds += time.monotonic() - start_time
+
+    def metrics(self):
+        """Returns the number of records sent, requests, retries, and throttles"""
+        with self._lock:
+            return {
+                "records_sent": self.records_sent,
+                "put_records_calls": self.put_records_calls,
+                "retried_records": self.retried_records,
+                "throttled_records": self.throttled_records,
+                "records_per_second": (
+                    round(self.records_sent / self.busy_seconds, 1)
+                    if self.busy_seconds > 0
+                    else 0.0
+                ),
+            }
+
+    def _build_batches(self, records):
+        """Yields lists of Kinesis format records that fit in one PutRecords request"""
+        batch_size = min(self.kinesis_client.batch_size, _MAX_BATCH_RECORDS)
+        batch = []
+        batch_bytes = 0
+        for record in records:
+            partition_key = str(next(self._partition_keys))
+            record_bytes = len(record) + len(partition_key)
+            if batch and (
+                len(batch) >= batch_size
+                or batch_bytes + record_bytes > self.max_batch_bytes
+            ):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append({"Data": record, "PartitionKey": partition_key})
+            batch_bytes += record_bytes
+        if batch:
+            yield batch
+
+    def _send_batch(self, kinesis_records):
+        """
+        Sends a single batch of Kinesis format records, retrying only the records
+        that fail
+        """
+        for attempt in range(1, self.kinesis_client.max_retries + 1):
+            failed_records, throttled_records = self._put_records(kinesis_records)
+            with self._lock:
+                self.put_records_calls += 1
+                self.records_sent += len(kinesis_records) - len(failed_records)
+                self.throttled_records += throttled_records
+            if not failed_records:
+                return
+
+            self.logger.warning(
+                f"Failed to send {len(failed_records)} of {len(kinesis_records)} "
+                f"records to Kinesis"
+            )
+            kinesis_records = failed_records
+            if attempt < self.kinesis_client.max_retries:
+                with self._lock:
+                    self.retried_records += len(failed_records)
+                time.sleep(self._get_delay(attempt))
+
+        message = (
+            f"Failed to send records to Kinesis {self.kinesis_client.max_retries} "
+            f"times in a row"
+        )
+        self.logger.error(message)
+        raise KinesisSenderError(message)
+
+    def _put_records(self, kinesis_records):
+        """
+        Sends a single PutRecords request and returns the records that failed along
+        with how many of them were throttled
+        """
+        self.logger.info(
+            f"Sending ({len(kinesis_records)}) records to "
+            f"{self.kinesis_client.stream_arn} Kinesis stream"
+        )
+        try:
+            response = self.kinesis_client.kinesis_client.put_records(
+                Records=kinesis_records, StreamARN=self.kinesis_client.stream_arn
+            )
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code")
+            if error_code not in _RETRYABLE_ERROR_CODES:
+                message = f"Error sending records to Kinesis: {e}"
+                self.logger.error(message)
+                raise KinesisSenderError(message) from None
+            return kinesis_records, len(kinesis_records)
+
+        if response["FailedRecordCount"] == 0:
+            return [], 0
+        failed_records = []
+        throttled_records = 0
+        for kinesis_record, result in zip(kinesis_records, response["Records"]):
+            if "ErrorCode" in result:
+                failed_records.append(kinesis_record)
+                if result["ErrorCode"] == _THROTTLE_ERROR_CODE:
+                    throttled_records += 1
+        return failed_records, throttled_records
+
+    def _get_delay(self, attempt):
+        """Returns how many seconds to wait before the given retry attempt"""
+        ceiling = min(
+            self.retry_max_seconds, self.retry_min_seconds * 2 ** (attempt - 1)
+        )
+        return random.uniform(ceiling / 2, ceiling)
+
+
+class KinesisSenderError(Exception):
+    def __init__(self, message=None):
+        self.message = message
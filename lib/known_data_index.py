@@ -0,0 +1,173 @@
+from array import array
+from datetime import date, datetime, timedelta
+
+# Each key packs the increment's minute offset, the orbit, and the interned site
+# number into a single int
+_ORBIT_BITS = 16
+_SITE_BITS = 24
+# Orbits are NULL when ShopperTrak's entrance name can't be parsed, so the largest
+# orbit is kept back to stand for them
+_NULL_ORBIT = (1 << _ORBIT_BITS) - 1
+# Stored in the array columns in place of NULL is_healthy_data, enters, and exits
+_NULL_VALUE = -(2**63)
+_NULL_FLAG = -1
+
+
+class KnownDataIndex:
+    """
+    Compact index of the data currently stored in Redshift for the site/dates being
+    recovered. It maps (site ID, orbit, increment start) to (Redshift ID,
+    is_healthy_data, enters, exits) like a dictionary of tuples would, but site IDs
+    are interned to small ints, each key is packed into a single int, and the values
+    are stored in array columns. NULL orbits, is_healthy_data, enters, and exits are
+    kept as reserved values and returned as None.
+
+    Increment starts are looked up by the "YYYY-MM-DD HH:MM:SS" strings produced by
+    ShopperTrakApiClient.parse_response, so recovered rows are matched without
+    parsing them into datetimes.
+    """
+
+    __slots__ = (
+        "_site_numbers",
+        "_site_ids",
+        "_positions",
+        "_redshift_ids",
+        "_is_healthy",
+        "_enters",
+        "_exits",
+        "_day_minutes",
+        "_time_minutes",
+    )
+
+    def __init__(self):
+        self._site_numbers = dict()
+        self._site_ids = []
+        self._positions = dict()
+        self._redshift_ids = array("q")
+        self._is_healthy = array("b")
+        self._enters = array("q")
+        self._exits = array("q")
+        self._day_minutes = dict()
+        self._time_minutes = dict()
+
+    def add(
+        self, site_id, orbit, increment_start, redshift_id, is_healthy, enters, exits
+    ):
+        """
+        Adds a row where increment_start is a datetime, as returned by Redshift. Throws
+        a KnownDataIndexError if the orbit or the number of sites doesn't fit in a key.
+        """
+        if not self._is_packable_orbit(orbit):
+            raise KnownDataIndexError(
+                f"Orbit {orbit} for {site_id} is outside of [0, {_NULL_ORBIT})"
+            )
+        site_number = self._site_numbers.get(site_id)
+        if site_number is None:
+            site_number = len(self._site_ids)
+            if site_number >= 1 << _SITE_BITS:
+                raise KnownDataIndexError(
+                    f"Can't index more than {1 << _SITE_BITS} sites"
+                )
+            self._site_numbers[site_id] = site_number
+            self._site_ids.append(site_id)
+        minutes = (
+            increment_start.toordinal() * 1440
+            + increment_start.hour * 60
+            + increment_start.minute
+        )
+        self._positions[self._pack(site_number, orbit, minutes)] = len(
+            self._redshift_ids
+        )
+        self._redshift_ids.append(redshift_id)
+        self._is_healthy.append(_NULL_FLAG if is_healthy is None else is_healthy)
+        self._enters.append(_NULL_VALUE if enters is None else enters)
+        self._exits.append(_NULL_VALUE if exits is None else exits)
+
+    def get(self, site_id, orbit, increment_start):
+        """
+        Returns the (Redshift ID, is_healthy_data, enters, exits) tuple stored for the
+        site, orbit, and increment_start string, or None if there isn't one
+        """
+        site_number = self._site_numbers.get(site_id)
+        if site_number is None or not self._is_packable_orbit(orbit):
+            return None
+        position = self._positions.get(
+            self._pack(site_number, orbit, self._to_minutes(increment_start))
+        )
+        if position is None:
+            return None
+        return self._get_value(position)
+
+    def __len__(self):
+        return len(self._redshift_ids)
+
+    def __iter__(self):
+        """Yields each ((site ID, orbit, increment start), value) pair"""
+        for key, position in self._positions.items():
+            minutes = key >> (_ORBIT_BITS + _SITE_BITS)
+            orbit = (key >> _SITE_BITS) & ((1 << _ORBIT_BITS) - 1)
+            if orbit == _NULL_ORBIT:
+                orbit = None
+            site_id = self._site_ids[key & ((1 << _SITE_BITS) - 1)]
+            increment_start = datetime.fromordinal(minutes // 1440) + timedelta(
+                minutes=minutes % 1440
+            )
+            yield (site_id, orbit, increment_start), self._get_value(position)
+
+    def __eq__(self, other):
+        if not isinstance(other, KnownDataIndex):
+            return NotImplemented
+        return dict(self) == dict(other)
+
+    def _get_value(self, position):
+        is_healthy = self._is_healthy[position]
+        enters = self._enters[position]
+        exits = self._exits[position]
+        return (
+            self._redshift_ids[position],
+            None if is_healthy == _NULL_FLAG else bool(is_healthy),
+            None if enters == _NULL_VALUE else enters,
+            None if exits == _NULL_VALUE else exits,
+        )
+
+    def _to_minutes(self, increment_start):
+        day_minutes = self._day_minutes.get(increment_start[:10])
+        if day_minutes is None:
+            day_minutes = date.fromisoformat(increment_start[:10]).toordinal() * 1440
+            self._day_minutes[increment_start[:10]] = day_minutes
+        time_minutes = self._time_minutes.get(increment_start[11:])
+        if time_minutes is None:
+            time_minutes = int(increment_start[11:13]) * 60 + int(
+                increment_start[14:16]
+            )
+            self._time_minutes[increment_start[11:]] = time_minutes
+        return day_minutes + time_minutes
+
+    def _is_packable_orbit(self, orbit):
+        """Returns whether the orbit fits in a key without clashing with NULL orbits"""
+        return orbit is None or 0 <= orbit < _NULL_ORBIT
+
+    def _pack(self, site_number, orbit, minutes):
+        if orbit is None:
+            orbit = _NULL_ORBIT
+        return (
+            (minutes << (_ORBIT_BITS + _SITE_BITS))
+            | (orbit << _SITE_BITS)
+            | site_number
+        )
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds an index from (site ID, orbit, increment start, Redshift ID,
+        is_healthy_data, enters, exits) rows
+        """
+        index = cls()
+        for row in rows:
+            index.add(*row)
+        return index
+
+
+class KnownDataIndexError(Exception):
+    def __init__(self, message=None):
+        self.message = message
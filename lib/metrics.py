@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+# CloudWatch allows at most 100 metrics in each EMF directive
+_MAX_EMF_METRICS = 100
+
+
+class Metrics:
+    """
+    Class for collecting timers and counters from the poller's hot paths, such as
+    ShopperTrak API requests, parsing, Avro encoding, Kinesis sends, and Redshift and
+    S3 calls, so that a run's time can be attributed. Safe to use from several
+    threads and from coroutines.
+    """
+
+    def __init__(self):
+        self.timers = dict()
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timed(self, name):
+        """
+        Records the time spent in the with block under the named timer, including
+        whether the block threw an error
+        """
+        start = time.perf_counter()
+        is_error = False
+        try:
+            yield
+        except BaseException:
+            is_error = True
+            raise
+        finally:
+            self.record_time(name, time.perf_counter() - start, is_error)
+
+    def record_time(self, name, seconds, is_error=False):
+        with self._lock:
+            if name not in self.timers:
+                self.timers[name] = TimerStats()
+            self.timers[name].record(seconds, is_error)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Returns each timer's call count, errors, and total, mean, and max time"""
+        with self._lock:
+            return {
+                "timers": {
+                    name: stats.summary() for name, stats in sorted(self.timers.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def to_emf(self, namespace, dimensions=None):
+        """
+        Returns the summary as CloudWatch embedded metric format (EMF) JSON lines.
+        Each timer is reported as its total seconds, call count, and error count.
+        """
+        dimensions = dimensions or dict()
+        summary = self.summary()
+        values = dict()
+        units = dict()
+        for name, stats in summary["timers"].items():
+            values[f"{name}.seconds"] = stats["total_seconds"]
+            units[f"{name}.seconds"] = "Seconds"
+            values[f"{name}.calls"] = stats["calls"]
+            units[f"{name}.calls"] = "Count"
+            values[f"{name}.errors"] = stats["errors"]
+            units[f"{name}.errors"] = "Count"
+        for name, value in summary["counters"].items():
+            values[name] = value
+            units[name] = "Count"
+
+        names = list(values)
+        timestamp = int(time.time() * 1000)
+        lines = []
+        for i in range(0, len(names), _MAX_EMF_METRICS):
+            chunk = names[i : i + _MAX_EMF_METRICS]
+            lines.append(
+                json.dumps(
+                    {
+                        "_aws": {
+                            "Timestamp": timestamp,
+                            "CloudWatchMetrics": [
+                                {
+                                    "Namespace": namespace,
+                                    "Dimensions": [list(dimensions)],
+                                    "Metrics": [
+                                        {"Name": name, "Unit": units[name]}
+                                        for name in chunk
+                                    ],
+                                }
+                            ],
+                        },
+                        **dimensions,
+                        **{name: values[name] for name in chunk},
+                    }
+                )
+            )
+        return lines
+
+
+class TimerStats:
+    """Totals for a single timer of a Metrics instance"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds, is_error=False):
+        self.calls += 1
+        self.errors += is_error
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_seconds": round(self.total_seconds, 3),
+            "mean_seconds": (
+                round(self.total_seconds / self.calls, 3) if self.calls else None
+            ),
+            "max_seconds": round(self.max_seconds, 3),
+        }
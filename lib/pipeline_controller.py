@@ -1,30 +1,36 @@
+import asyncio
 import boto3
 import itertools
 import json
 import os
 import pytz
+import time
+import uuid
 
-from datetime import datetime, timedelta
+from contextlib import nullcontext
+from functools import cached_property
+from datetime import date, datetime, timedelta
 from helpers.query_helper import (
-    build_redshift_closures_query,
-    build_redshift_create_table_query,
-    build_redshift_found_sites_query,
+    build_redshift_discovery_query,
     build_redshift_hours_query,
-    build_redshift_known_query,
     build_redshift_update_query,
-    REDSHIFT_DROP_QUERY,
-    REDSHIFT_RECOVERABLE_QUERY,
 )
-from helpers.util import log_based_on_poll_date
+from helpers.util import log_based_on_poll_date, map_in_order, map_in_order_async
 from lib import (
     APIStatus,
+    LocationVisitsRow,
     ShopperTrakApiClient,
     ALL_SITES_ENDPOINT,
     SINGLE_SITE_ENDPOINT,
 )
-from nypl_py_utils.classes.avro_client import AvroEncoder
+from lib.bootstrap import Bootstrap, BootstrapError
+from lib.kinesis_sender import KinesisSender
+from lib.metrics import Metrics
+from lib.known_data_index import KnownDataIndex
+from lib.quota_budget import QuotaBudget, QuotaExhaustedError
+from lib.schema_cache import build_schema_cache
+from lib.staged_pipeline import StagedPipeline
 from nypl_py_utils.classes.kinesis_client import KinesisClient
-from nypl_py_utils.classes.redshift_client import RedshiftClient
 from nypl_py_utils.classes.s3_client import S3Client
 from nypl_py_utils.functions.log_helper import create_log
 
@@ -34,6 +40,10 @@ class PipelineController:
 
     def __init__(self):
         self.logger = create_log("pipeline_controller")
+        self.metrics = Metrics()
+        self.emit_emf_metrics = os.environ.get("EMIT_EMF_METRICS", False) == "True"
+        # Set to a RunProfiler by main.py when PROFILE is set
+        self.profiler = None
 
         self.bad_poll_dates = os.environ.get("BAD_POLL_DATES", "[]")
         self.bad_poll_dates = [
@@ -41,19 +51,22 @@ class PipelineController:
             for day in json.loads(self.bad_poll_dates)
         ]
 
-        self.shoppertrak_api_client = ShopperTrakApiClient(
+        # The async client lets all sites data be polled while individual sites are
+        # recovered, both on one event loop
+        self.use_async_client = os.environ.get("ASYNC_CLIENT", False) == "True"
+        if self.use_async_client:
+            from lib.async_shoppertrak_api_client import AsyncShopperTrakApiClient
+
+            shoppertrak_api_client_class = AsyncShopperTrakApiClient
+        else:
+            shoppertrak_api_client_class = ShopperTrakApiClient
+        self.shoppertrak_api_client = shoppertrak_api_client_class(
             os.environ["SHOPPERTRAK_USERNAME"],
             os.environ["SHOPPERTRAK_PASSWORD"],
             dict(),
             self.bad_poll_dates,
         )
-        self.redshift_client = RedshiftClient(
-            os.environ["REDSHIFT_DB_HOST"],
-            os.environ["REDSHIFT_DB_NAME"],
-            os.environ["REDSHIFT_DB_USER"],
-            os.environ["REDSHIFT_DB_PASSWORD"],
-        )
-        self.avro_encoder = AvroEncoder(os.environ["LOCATION_VISITS_SCHEMA_URL"])
+        self.shoppertrak_api_client.metrics = self.metrics
 
         self.yesterday = datetime.now(pytz.timezone("US/Eastern")).date() - timedelta(
             days=1
@@ -65,129 +78,576 @@ class PipelineController:
         self.redshift_hours_table = "location_hours_v2" + redshift_suffix
         self.redshift_closures_table = "location_closures_v2" + redshift_suffix
 
-        all_sites_s3_client = S3Client(
-            os.environ["ALL_SITES_S3_BUCKET"], os.environ["ALL_SITES_S3_RESOURCE"]
+        self.recovery_workers = int(os.environ.get("RECOVERY_WORKERS", 1))
+        self.backfill_concurrency = int(os.environ.get("BACKFILL_CONCURRENCY", 1))
+        self.pipeline_queue_size = int(os.environ.get("PIPELINE_QUEUE_SIZE", 2))
+        self.stale_update_batch_size = int(
+            os.environ.get("STALE_UPDATE_BATCH_SIZE", 1000)
         )
-        self.all_site_ids = set(all_sites_s3_client.fetch_cache())
-        all_sites_s3_client.close()
+        self.checkpoint_days = int(os.environ.get("CHECKPOINT_DAYS", 1))
+        self.checkpoint_seconds = float(os.environ.get("CHECKPOINT_SECONDS", 300))
+        self.poller_state = dict()
 
-        # Temp addition while testing out Snowflake data lake
-        self.data_lake_s3_client = boto3.resource("s3").Bucket(
-            os.environ["DATA_LAKE_S3_BUCKET"]
+        self.compute_missing_in_redshift = (
+            os.environ.get("COMPUTE_MISSING_IN_REDSHIFT", False) == "True"
         )
-
         self.ignore_update = os.environ.get("IGNORE_UPDATE", False) == "True"
         self.ignore_cache = os.environ.get("IGNORE_CACHE", False) == "True"
-        if not self.ignore_cache:
-            self.s3_client = S3Client(
-                os.environ["S3_BUCKET"], os.environ["S3_RESOURCE"]
+        self.skip_recovery = os.environ.get("SKIP_RECOVERY", False) == "True"
+
+        self.quota_budget = None
+        if os.environ.get("SHOPPERTRAK_DAILY_LIMIT"):
+            self.quota_budget = QuotaBudget(
+                int(os.environ["SHOPPERTRAK_DAILY_LIMIT"]),
+                int(os.environ.get("SHOPPERTRAK_QUOTA_RESERVE", 0)),
             )
+            self.shoppertrak_api_client.quota_budget = self.quota_budget
 
         self.ignore_kinesis = os.environ.get("IGNORE_KINESIS", False) == "True"
-        if not self.ignore_kinesis:
-            self.kinesis_client = KinesisClient(
-                os.environ["KINESIS_STREAM_ARN"], int(os.environ["KINESIS_BATCH_SIZE"])
+        self.bootstrap_timeout = float(os.environ.get("BOOTSTRAP_TIMEOUT", 60))
+        self.bootstrap_timeouts = json.loads(os.environ.get("BOOTSTRAP_TIMEOUTS", "{}"))
+
+    # The clients below are only built when first used, so that a run with nothing
+    # to do, or with IGNORE_CACHE or IGNORE_KINESIS set, never connects to the
+    # services it doesn't need. The Redshift and Avro libraries are only imported
+    # then too.
+
+    @cached_property
+    def redshift_client(self):
+        from nypl_py_utils.classes.redshift_client import RedshiftClient
+
+        return RedshiftClient(
+            os.environ["REDSHIFT_DB_HOST"],
+            os.environ["REDSHIFT_DB_NAME"],
+            os.environ["REDSHIFT_DB_USER"],
+            os.environ["REDSHIFT_DB_PASSWORD"],
+        )
+
+    @cached_property
+    def avro_encoder(self):
+        from lib.cached_avro_encoder import CachedAvroEncoder
+
+        with self.metrics.timed("avro.load_schema"):
+            return CachedAvroEncoder(
+                os.environ["LOCATION_VISITS_SCHEMA_URL"],
+                self._schema_cache,
+                float(os.environ.get("SCHEMA_FETCH_TIMEOUT", 10)),
+                float(os.environ.get("SCHEMA_CACHE_MAX_AGE_HOURS", 0)),
+                os.environ.get("FAST_AVRO_ENCODING", "True") == "True",
             )
 
-    def run(self):
-        """Main method for the class -- runs the pipeline"""
-        self.logger.info("Getting regular branch hours from Redshift")
-        self.shoppertrak_api_client.location_hours_dict = self.get_location_hours_dict()
-
-        all_sites_start_date = self._get_poll_date(0) + timedelta(days=1)
-        all_sites_end_date = (
-            datetime.fromisoformat(os.environ["END_DATE"]).date()
-            if self.ignore_cache
-            else self.yesterday
+    @cached_property
+    def _schema_cache(self):
+        if not os.environ.get("SCHEMA_CACHE_LOCATION"):
+            return None
+        return build_schema_cache(os.environ["SCHEMA_CACHE_LOCATION"])
+
+    @cached_property
+    def all_site_ids(self):
+        with self.metrics.timed("s3.fetch_all_sites"):
+            all_site_ids = set(self._all_sites_s3_client.fetch_cache())
+        self._all_sites_s3_client.close()
+        return all_site_ids
+
+    @cached_property
+    def _all_sites_s3_client(self):
+        return S3Client(
+            os.environ["ALL_SITES_S3_BUCKET"], os.environ["ALL_SITES_S3_RESOURCE"]
         )
-        self.logger.info(
-            f"Getting all sites data from {all_sites_start_date} through "
-            f"{all_sites_end_date}"
+
+    @cached_property
+    def data_lake_s3_client(self):
+        # Temp addition while testing out Snowflake data lake
+        return boto3.resource("s3").Bucket(os.environ["DATA_LAKE_S3_BUCKET"])
+
+    @cached_property
+    def s3_client(self):
+        return S3Client(os.environ["S3_BUCKET"], os.environ["S3_RESOURCE"])
+
+    @cached_property
+    def kinesis_sender(self):
+        return KinesisSender(
+            KinesisClient(
+                os.environ["KINESIS_STREAM_ARN"],
+                int(os.environ["KINESIS_BATCH_SIZE"]),
+            ),
+            int(os.environ.get("KINESIS_MAX_BATCH_BYTES", 5 * 2**20)),
+            int(os.environ.get("KINESIS_MAX_IN_FLIGHT", 1)),
         )
-        self.process_all_sites_data(all_sites_end_date, 0)
-        self.logger.info("Finished querying for all sites data")
+
+    def _bootstrap(self, dependencies):
+        """
+        Loads the dependencies, a dictionary of names to functions, concurrently
+        using a Bootstrap, each with its own timeout from BOOTSTRAP_TIMEOUTS. The
+        boto3 clients they use are created here first, since creating them from
+        several threads at once isn't thread safe.
+        """
+        self._schema_cache
         if not self.ignore_cache:
-            self.s3_client.close()
+            self.s3_client
+        if "all_sites" in dependencies:
+            self._all_sites_s3_client
+        with self.metrics.timed("bootstrap"):
+            try:
+                return Bootstrap(self.bootstrap_timeouts, self.bootstrap_timeout).run(
+                    dependencies
+                )
+            except BootstrapError:
+                self._close_clients_after_bootstrap_error()
+                raise
+
+    def _close_clients_after_bootstrap_error(self):
+        """
+        Closes the clients that were opened before a dependency failed to load, such
+        as a Redshift connection opened for the branch hours. Errors are logged rather
+        than thrown so that they don't hide the BootstrapError.
+        """
+        close_methods = [self.shoppertrak_api_client.close]
+        if self._is_built("s3_client"):
+            close_methods.append(self.s3_client.close)
+        if self._is_built("redshift_client") and self.redshift_client.conn is not None:
+            close_methods.append(self.redshift_client.close_connection)
+        for close in close_methods:
+            try:
+                close()
+            except Exception as e:
+                self.logger.warning(
+                    f"Failed to close client after bootstrap error: {e}"
+                )
+
+    def _is_built(self, client_name):
+        """Returns whether the named lazily built client has been used yet"""
+        return client_name in self.__dict__
 
-        broken_start_date = self.yesterday - timedelta(days=29)
+    def run(self):
+        """Main method for the class -- runs the pipeline"""
+        with self._profile("setup"):
+            all_sites_end_date = (
+                datetime.fromisoformat(os.environ["END_DATE"]).date()
+                if self.ignore_cache
+                else self.yesterday
+            )
+            broken_start_date = self.yesterday - timedelta(days=29)
+            dependencies = {
+                "schema": lambda: self.avro_encoder,
+                "location_hours": self.get_location_hours_dict,
+            }
+            if self.skip_recovery:
+                # Whether there's anything to do depends only on the poller state,
+                # so it's read before anything else is loaded
+                last_poll_date = self._get_poll_date()
+                if last_poll_date >= all_sites_end_date:
+                    self.logger.info(
+                        f"Already polled through {last_poll_date} and recovery is "
+                        "turned off -- nothing to do"
+                    )
+                    if self._is_built("s3_client"):
+                        self.s3_client.close()
+                    self.shoppertrak_api_client.close()
+                    self._emit_metrics()
+                    return
+            else:
+                dependencies["poller_state"] = self._get_poll_date
+                dependencies["all_sites"] = lambda: self.all_site_ids
+
+            self.logger.info(
+                f"Loading {', '.join(dependencies)} before querying ShopperTrak"
+            )
+            loaded = self._bootstrap(dependencies)
+            if "poller_state" in loaded:
+                last_poll_date = loaded["poller_state"]
+            self.shoppertrak_api_client.location_hours_dict = loaded["location_hours"]
+            all_sites_start_date = last_poll_date + timedelta(days=1)
+            if self.quota_budget is not None:
+                self.quota_budget.load(self.poller_state.get("api_quota"))
+            # Built up front since all sites polling and recovery may both use it
+            # from worker threads at the same time
+            if not self.ignore_kinesis:
+                self.kinesis_sender
+        try:
+            all_sites_end_date = self._plan_all_sites_data(
+                last_poll_date, all_sites_end_date
+            )
+            if self.use_async_client:
+                self.logger.info(
+                    f"Getting all sites data from {all_sites_start_date} through "
+                    f"{all_sites_end_date} while attempting to recover previously "
+                    f"unhealthy data from {broken_start_date} up to "
+                    f"{all_sites_start_date}"
+                )
+                # All sites polling and recovery overlap, so they're profiled as one
+                with self._profile("all_data_async"):
+                    asyncio.run(
+                        self._process_all_data_async(
+                            last_poll_date, all_sites_end_date, broken_start_date
+                        )
+                    )
+                self.logger.info("Finished querying for all data")
+            else:
+                self.logger.info(
+                    f"Getting all sites data from {all_sites_start_date} through "
+                    f"{all_sites_end_date}"
+                )
+                with self._profile("all_sites"):
+                    self.process_all_sites_data(last_poll_date, all_sites_end_date)
+                self.logger.info("Finished querying for all sites data")
+
+                if not self.skip_recovery:
+                    self.logger.info(
+                        "Attempting to recover previously unhealthy data from "
+                        f"{broken_start_date} up to {all_sites_start_date}"
+                    )
+                    self.process_broken_orbits(broken_start_date, all_sites_start_date)
+                    self.logger.info("Finished attempting to recover unhealthy data")
+        except QuotaExhaustedError as e:
+            self.logger.warning(f"Stopping run early: {e.message}")
+        finally:
+            self._save_quota()
+            if self._is_built("s3_client"):
+                self.s3_client.close()
+
+        response_cache = self.shoppertrak_api_client.response_cache
+        if response_cache is not None:
+            self.logger.info(
+                f"Response cache had {response_cache.hits} hits and "
+                f"{response_cache.misses} misses"
+            )
         self.logger.info(
-            f"Attempting to recover previously unhealthy data from {broken_start_date} "
-            f"up to {all_sites_start_date}"
+            "ShopperTrak retry metrics: "
+            f"{json.dumps(self.shoppertrak_api_client.retry_scheduler.metrics())}"
         )
-        self.process_broken_orbits(broken_start_date, all_sites_start_date)
-        self.logger.info("Finished attempting to recover unhealthy data")
+        if self.quota_budget is not None:
+            self.logger.info(
+                f"Sent {self.quota_budget.used} of {self.quota_budget.daily_limit} "
+                f"ShopperTrak API requests allowed today"
+            )
+        self.shoppertrak_api_client.close()
         if not self.ignore_kinesis:
-            self.kinesis_client.close()
+            self.logger.info(
+                f"Kinesis send metrics: {json.dumps(self.kinesis_sender.metrics())}"
+            )
+            self.kinesis_sender.close()
+        self._emit_metrics()
+
+    def _profile(self, stage):
+        """Profiles the with block as the named stage if profiling is enabled"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.profile(stage)
+
+    def _emit_metrics(self):
+        """
+        Logs the run's timers and counters as JSON and, if EMIT_EMF_METRICS is set,
+        prints them in CloudWatch embedded metric format
+        """
+        self.logger.info(f"Run metrics: {json.dumps(self.metrics.summary())}")
+        if self.emit_emf_metrics:
+            for line in self.metrics.to_emf(
+                os.environ.get("METRICS_NAMESPACE", "LocationVisitsPoller"),
+                {"Environment": os.environ.get("ENVIRONMENT", "unknown")},
+            ):
+                print(line, flush=True)
 
     def get_location_hours_dict(self):
         """
         Queries Redshift for each location's current regular hours and returns a map
         from (branch_code, weekday) to (regular_open, regular_close)
         """
-        self.redshift_client.connect()
-        raw_hours = self.redshift_client.execute_query(
-            build_redshift_hours_query(self.redshift_hours_table)
-        )
-        self.redshift_client.close_connection()
+        with self.metrics.timed("redshift.connect"):
+            self.redshift_client.connect()
+        with self.metrics.timed("redshift.execute_query"):
+            raw_hours = self.redshift_client.execute_query(
+                build_redshift_hours_query(self.redshift_hours_table)
+            )
+        with self.metrics.timed("redshift.close_connection"):
+            self.redshift_client.close_connection()
         return {
             (branch_code, weekday): (regular_open, regular_close)
             for branch_code, weekday, regular_open, regular_close in raw_hours
         }
 
-    def process_all_sites_data(self, end_date, batch_num):
-        """Gets visits data from all available sites for the given day(s)"""
-        last_poll_date = self._get_poll_date(batch_num)
-        poll_date = last_poll_date + timedelta(days=1)
-        if poll_date <= end_date:
-            self.logger.info(f"Beginning batch {batch_num+1}: {poll_date.isoformat()}")
-            all_sites_response = self.shoppertrak_api_client.query(
-                ALL_SITES_ENDPOINT, poll_date
+    def _plan_all_sites_data(self, last_poll_date, end_date):
+        """
+        Returns the last day of all sites data that can be polled within the daily API
+        budget. All sites data is polled before anything else.
+        """
+        if self.quota_budget is None:
+            return end_date
+        num_days = (end_date - last_poll_date).days
+        allowed_days = self.quota_budget.plan([("all_sites", num_days)])["all_sites"]
+        if allowed_days < num_days:
+            end_date = last_poll_date + timedelta(days=allowed_days)
+            self.logger.warning(
+                f"Only {allowed_days} of {num_days} days of all sites data fit in the "
+                f"daily API budget: polling through {end_date}"
             )
-            if all_sites_response == APIStatus.ERROR:
-                message = "Failed to retrieve all sites visits data"
-                log_based_on_poll_date(
-                    self.logger, message, poll_date in self.bad_poll_dates
-                )
-                return
+        return end_date
 
-            results = self.shoppertrak_api_client.parse_response(
-                all_sites_response, poll_date
+    def process_all_sites_data(self, last_poll_date, end_date):
+        """
+        Gets visits data from all available sites for each day after last_poll_date
+        through end_date. Each day is fetched, parsed, encoded, and sent to Kinesis as
+        a separate stage of a StagedPipeline, so the next days can be fetched and
+        parsed while earlier ones are still being encoded and sent. Up to
+        BACKFILL_CONCURRENCY days are fetched at once and at most PIPELINE_QUEUE_SIZE
+        days wait between any two stages. Days are still sent to Kinesis strictly in
+        order and polling stops at the first day that fails, so no day is ever
+        skipped.
+
+        Progress is checkpointed to S3 every CHECKPOINT_DAYS days or CHECKPOINT_SECONDS
+        seconds, whichever comes first, and again whenever the loop stops for any
+        reason so that the next run resumes after the last day sent.
+        """
+        self._start_checkpoints(last_poll_date)
+        batches = self._get_all_sites_batches(last_poll_date, end_date)
+        pipeline = StagedPipeline(
+            [
+                ("fetch", self._fetch_all_sites_day, self.backfill_concurrency),
+                ("parse", self._parse_all_sites_day, 1),
+                ("encode", self._encode_all_sites_day, 1),
+            ],
+            self.pipeline_queue_size,
+        )
+        all_sites_results = pipeline.run(batches)
+        try:
+            for encoded_day in all_sites_results:
+                if encoded_day is None:
+                    return
+                batch_num, poll_date, encoded_records = encoded_day
+                with pipeline.timed("send"):
+                    self._send_records(encoded_records)
+                self.logger.info(f"Finished batch {batch_num}: {poll_date.isoformat()}")
+
+                last_poll_date = poll_date
+                self._checkpoint(last_poll_date)
+        finally:
+            all_sites_results.close()
+            self._checkpoint(last_poll_date, force=True)
+            self.logger.info(
+                f"All sites pipeline stage stats: {json.dumps(pipeline.summary())}"
             )
-            encoded_records = self.avro_encoder.encode_batch(results)
-            if not self.ignore_kinesis:
-                self.kinesis_client.send_records(encoded_records)
-            if not self.ignore_cache:
-                self.s3_client.set_cache({"last_poll_date": poll_date.isoformat()})
 
-            self.logger.info(f"Finished batch {batch_num+1}: {poll_date.isoformat()}")
-            self.process_all_sites_data(end_date, batch_num + 1)
+    def _get_all_sites_batches(self, last_poll_date, end_date):
+        """Returns (batch number, date) for each day after last_poll_date to poll"""
+        start_date = last_poll_date + timedelta(days=1)
+        return enumerate(
+            (
+                start_date + timedelta(days=n)
+                for n in range((end_date - last_poll_date).days)
+            ),
+            start=1,
+        )
+
+    def _start_checkpoints(self, last_poll_date):
+        self._checkpointed_date = last_poll_date
+        self._checkpoint_time = time.monotonic()
+
+    def _checkpoint(self, last_poll_date, force=False):
+        """
+        Saves last_poll_date to the S3 cache if it is newer than the last checkpoint
+        and either force is set or CHECKPOINT_DAYS days or CHECKPOINT_SECONDS seconds
+        have passed since the last checkpoint
+        """
+        if last_poll_date <= self._checkpointed_date:
+            return
+        if (
+            force
+            or (last_poll_date - self._checkpointed_date).days >= self.checkpoint_days
+            or time.monotonic() - self._checkpoint_time >= self.checkpoint_seconds
+        ):
+            self._set_poll_date(last_poll_date)
+            self._checkpointed_date = last_poll_date
+            self._checkpoint_time = time.monotonic()
+
+    def _fetch_all_sites_day(self, batch):
+        """
+        Queries the API for visits data from all available sites for a single day.
+        Returns None if the data could not be retrieved, which stops the pipeline.
+        """
+        batch_num, poll_date = batch
+        self.logger.info(f"Beginning batch {batch_num}: {poll_date.isoformat()}")
+        all_sites_response = self.shoppertrak_api_client.query(
+            ALL_SITES_ENDPOINT, poll_date
+        )
+        return self._check_all_sites_response(batch_num, poll_date, all_sites_response)
+
+    def _check_all_sites_response(self, batch_num, poll_date, all_sites_response):
+        if all_sites_response == APIStatus.ERROR:
+            message = "Failed to retrieve all sites visits data"
+            log_based_on_poll_date(
+                self.logger, message, poll_date in self.bad_poll_dates
+            )
+            return None
+        return batch_num, poll_date, all_sites_response
+
+    def _parse_all_sites_day(self, fetched_day):
+        """Parses a single day of all sites data into rows"""
+        batch_num, poll_date, all_sites_response = fetched_day
+        results = self.shoppertrak_api_client.parse_response(
+            all_sites_response, poll_date
+        )
+        return batch_num, poll_date, results
+
+    def _encode_all_sites_day(self, parsed_day):
+        """Avro encodes a single day of all sites rows"""
+        batch_num, poll_date, results = parsed_day
+        return batch_num, poll_date, self._encode_rows(results)
+
+    def _encode_rows(self, rows):
+        # Every row polled in a run is fresh and has the same poll date, so those
+        # fields are encoded once per batch rather than once per row
+        with self.metrics.timed("avro.encode"):
+            encoded_records = self.avro_encoder.encode_rows(
+                rows,
+                LocationVisitsRow._fields,
+                {
+                    "is_fresh": True,
+                    "poll_date": self.shoppertrak_api_client.today_str,
+                },
+            )
+        self.metrics.increment("avro.records_encoded", len(encoded_records))
+        return encoded_records
+
+    def _send_records(self, encoded_records):
+        if not self.ignore_kinesis:
+            with self.metrics.timed("kinesis.send_records"):
+                self.kinesis_sender.send_records(encoded_records)
 
     def process_broken_orbits(self, start_date, end_date):
         """
         Re-queries individual sites with unhealthy data from the past 30 days (a limit
         set by the API) to see if any data has since been recovered
         """
-        closures_query = build_redshift_closures_query(
-            self.redshift_closures_table, start_date
-        )
-        found_sites_query = build_redshift_found_sites_query(
-            self.redshift_visits_table, start_date, end_date
-        )
-        create_table_query = build_redshift_create_table_query(
-            self.redshift_visits_table, start_date, end_date
-        )
-        self.redshift_client.connect()
-        raw_closed_site_dates = self.redshift_client.execute_query(closures_query)
-        found_site_dates = self.redshift_client.execute_query(found_sites_query)
-        self.redshift_client.execute_transaction([(create_table_query, None)])
-        unhealthy_site_dates = self.redshift_client.execute_query(
-            REDSHIFT_RECOVERABLE_QUERY
+        request_count = self.shoppertrak_api_client.request_count
+        with self.metrics.timed("redshift.connect"):
+            self.redshift_client.connect()
+        with self._profile("discover_broken_orbits"):
+            missing_site_dates, unhealthy_site_dates, known_data_index = (
+                self._discover_broken_orbits(start_date, end_date)
+            )
+            missing_site_dates, unhealthy_site_dates = self._plan_recovery(
+                missing_site_dates, unhealthy_site_dates
+            )
+        try:
+            if missing_site_dates:
+                missing_site_dates = sorted(
+                    missing_site_dates, key=lambda x: (x[1], x[0])
+                )
+                self.logger.info("Re-querying for previously missing data")
+                with self._profile("missing_recovery"):
+                    self._recover_data(
+                        missing_site_dates, KnownDataIndex(), is_recovery_mode=False
+                    )
+
+            # Site/dates with unhealthy data during closures were already excluded by
+            # Redshift
+            unhealthy_site_dates = sorted(
+                unhealthy_site_dates, key=lambda x: (x[1], x[0])
+            )
+            self.logger.info("Re-querying for previously unhealthy data")
+            with self._profile("unhealthy_recovery"):
+                self._recover_data(unhealthy_site_dates, known_data_index)
+        finally:
+            with self.metrics.timed("redshift.close_connection"):
+                self.redshift_client.close_connection()
+            self.logger.info(
+                f"Sent {self.shoppertrak_api_client.request_count - request_count} "
+                f"ShopperTrak API requests while recovering data"
+            )
+
+    def _discover_broken_orbits(self, start_date, end_date):
+        """
+        Queries Redshift for the site/dates between start_date and end_date that are
+        missing or have unhealthy data, and for the data currently known for the
+        unhealthy ones. Returns (missing site/dates, unhealthy site/dates, known data).
+        """
+        discovery_query = build_redshift_discovery_query(
+            self.redshift_visits_table,
+            self.redshift_closures_table,
+            start_date,
+            end_date,
+            self.all_site_ids if self.compute_missing_in_redshift else None,
         )
-        known_data = self.redshift_client.execute_query(
-            build_redshift_known_query(self.redshift_visits_table)
+        with self.metrics.timed("redshift.execute_query"):
+            discovery_rows = self.redshift_client.execute_query(discovery_query)
+
+        # The discovery query returns the closures and the (site_id, date) pairs found
+        # in Redshift (or, if COMPUTE_MISSING_IN_REDSHIFT is set, the missing pairs
+        # instead), the open pairs with unhealthy data, and the currently stored data
+        # for those unhealthy pairs, each marked by its kind.
+        #
+        # For the known data, form an index where the key is (site ID, orbit,
+        # timestamp) and the value is (Redshift ID, is_healthy_data, enters, exits).
+        # This is to mark old rows as stale and to prevent sending duplicate records
+        # when only some of the data for a site needs to be recovered on a particular
+        # date (e.g. when only one of several orbits is broken, or when an orbit goes
+        # down in the middle of the day).
+        raw_closed_site_dates = []
+        found_site_dates = set()
+        missing_site_dates = []
+        unhealthy_site_dates = []
+        known_data_index = KnownDataIndex()
+        for kind, site_id, visits_date, *known_row in discovery_rows:
+            if kind == "closure":
+                raw_closed_site_dates.append((site_id, visits_date))
+            elif kind == "found":
+                found_site_dates.add((site_id, visits_date))
+            elif kind == "missing":
+                missing_site_dates.append((site_id, visits_date))
+            elif kind == "unhealthy":
+                unhealthy_site_dates.append((site_id, visits_date))
+            else:
+                known_data_index.add(site_id, *known_row)
+
+        if not self.compute_missing_in_redshift:
+            missing_site_dates = self._find_missing_site_dates(
+                raw_closed_site_dates, found_site_dates, start_date, end_date
+            )
+        return missing_site_dates, unhealthy_site_dates, known_data_index
+
+    def _plan_recovery(
+        self, missing_site_dates, unhealthy_site_dates, all_sites_days=0
+    ):
+        """
+        Trims the site/dates to re-query so they fit in the daily API budget. Missing
+        data is recovered before unhealthy data, and more recent site/dates are
+        recovered before older ones. When all sites data is being polled at the same
+        time, all_sites_days requests are first kept back for it.
+        """
+        if self.quota_budget is None:
+            return missing_site_dates, unhealthy_site_dates
+        allowed = self.quota_budget.plan(
+            [
+                ("all_sites", all_sites_days),
+                ("missing", len(missing_site_dates)),
+                ("unhealthy", len(unhealthy_site_dates)),
+            ]
         )
-        self.redshift_client.execute_transaction([(REDSHIFT_DROP_QUERY, None)])
+        planned_site_dates = []
+        for name, site_dates in (
+            ("missing", missing_site_dates),
+            ("unhealthy", unhealthy_site_dates),
+        ):
+            if allowed[name] < len(site_dates):
+                self.logger.warning(
+                    f"Only {allowed[name]} of {len(site_dates)} {name} site/dates fit "
+                    f"in the daily API budget: skipping the oldest"
+                )
+                site_dates = sorted(site_dates, key=lambda x: (x[1], x[0]))
+                site_dates = site_dates[len(site_dates) - allowed[name] :]
+            planned_site_dates.append(site_dates)
+        return tuple(planned_site_dates)
 
+    def _find_missing_site_dates(
+        self, raw_closed_site_dates, found_site_dates, start_date, end_date
+    ):
+        """
+        Compares the set of (site_id, date) tuples found in Redshift to the set of all
+        such tuples that should exist to see if any sites are missing from Redshift
+        and need to be re-queried. This is as opposed to sites that are present in
+        Redshift but have unhealthy data. We do not count sites in extended closures
+        as missing.
+        """
         # If the location id is NULL, that means it is a system-wide closure
         closed_site_dates = set()
         for row in raw_closed_site_dates:
@@ -198,149 +658,367 @@ class PipelineController:
                     [(site_id[:2], row[1]) for site_id in self.all_site_ids]
                 )
 
-        # Compare the set of (site_id, date) tuples found in Redshift to the set of all
-        # such tuples that should exist to see if any sites are missing from Redshift
-        # and need to be re-queried. This is as opposed to sites that are present in
-        # Redshift but have unhealthy data. We do not count sites in extended closures
-        # as missing.
-        found_site_dates = set([tuple(row) for row in found_site_dates])
         all_dates = [
             start_date + timedelta(days=n) for n in range((end_date - start_date).days)
         ]
         all_site_dates = set(itertools.product(self.all_site_ids, all_dates))
-        missing_site_dates = all_site_dates.difference(found_site_dates)
-        if missing_site_dates:
-            missing_site_dates = [
-                (site, visits_date)
-                for (site, visits_date) in missing_site_dates
-                if (site[:2], visits_date) not in closed_site_dates
-            ]
-            missing_site_dates = sorted(missing_site_dates, key=lambda x: (x[1], x[0]))
-            self.logger.info("Re-querying for previously missing data")
-            self._recover_data(missing_site_dates, dict(), is_recovery_mode=False)
-            self._recover_and_send_json_data_to_s3(missing_site_dates)
-
-        # For all the site/date pairs with unhealthy data, form a dictionary of the
-        # currently stored data for those sites on those dates where the key is (site
-        # ID, orbit, timestamp) and the value is (Redshift ID, is_healthy_data, enters,
-        # exits). This is to mark old rows as stale and to prevent sending duplicate
-        # records when only some of the data for a site needs to be recovered on a
-        # particular date (e.g. when only one of several orbits is broken, or when an
-        # orbit goes down in the middle of the day).
-        unhealthy_site_dates = [
+        return [
             (site, visits_date)
-            for (site, visits_date) in unhealthy_site_dates
+            for (site, visits_date) in all_site_dates.difference(found_site_dates)
             if (site[:2], visits_date) not in closed_site_dates
         ]
-        unhealthy_site_dates = sorted(unhealthy_site_dates, key=lambda x: (x[1], x[0]))
-        known_data_dict = dict()
-        if known_data:
-            known_data_dict = {
-                (site_id, orbit, inc_start): (redshift_id, is_healthy, enters, exits)
-                for site_id, orbit, inc_start, redshift_id, is_healthy, enters, exits in known_data
-            }
-        self.logger.info("Re-querying for previously unhealthy data")
-        self._recover_data(unhealthy_site_dates, known_data_dict)
-        self._recover_and_send_json_data_to_s3(unhealthy_site_dates)
-        self.redshift_client.close_connection()
 
-    def _recover_data(self, site_dates, known_data_dict, is_recovery_mode=True):
+    def _recover_data(self, site_dates, known_data_index, is_recovery_mode=True):
         """
         Individually query the ShopperTrak API for each site/date pair with any
-        unhealthy data. Then check to see if the returned data is actually "recovered"
-        data, as it may have never been unhealthy to begin with. If so, send to Kinesis.
+        unhealthy data and save each raw response to S3 for later use in the data lake.
+        Then check to see if the returned data is actually "recovered" data, as it may
+        have never been unhealthy to begin with. If so, send to Kinesis.
+
+        Each site/date is queried only once for both purposes. The API queries are sent
+        using up to RECOVERY_WORKERS threads, but the results are processed one
+        site/date at a time in the original order.
         """
-        for site_id, visits_date in site_dates:
+
+        def query_site_date(site_date):
+            site_id, visits_date = site_date
             site_response = self.shoppertrak_api_client.query(
                 SINGLE_SITE_ENDPOINT + site_id, visits_date
             )
-            if site_response == APIStatus.ERROR:
-                message = f"Failed to retrieve site visits data for {site_id}"
-                log_based_on_poll_date(
-                    self.logger, message, visits_date in self.bad_poll_dates
+            return self._parse_site_response(
+                site_response, visits_date, is_recovery_mode
+            )
+
+        all_site_responses = map_in_order(
+            query_site_date, site_dates, self.recovery_workers
+        )
+        stale_ids = []
+        is_finished = False
+        try:
+            for site_date, site_response in zip(site_dates, all_site_responses):
+                stale_ids.extend(
+                    self._handle_site_response(
+                        site_date, site_response, known_data_index
+                    )
                 )
+            is_finished = True
+        finally:
+            all_site_responses.close()
+            if is_finished:
+                self._update_stale_records(stale_ids)
             else:
-                site_results = self.shoppertrak_api_client.parse_response(
-                    site_response, visits_date, is_recovery_mode=is_recovery_mode
-                )
-                self._process_recovered_data(site_results, known_data_dict)
+                self._update_stale_records_after_error(stale_ids)
 
-    def _recover_and_send_json_data_to_s3(self, site_dates):
+    def _parse_site_response(self, site_response, visits_date, is_recovery_mode):
         """
-        Temporary function. Individually query the ShopperTrak API for each site/date
-        pair with any unhealthy data, then save the JSON response to S3 for later
-        use in the data lake.
+        Returns the raw text and parsed rows of a single site response, or None if the
+        query failed. The raw text is None if the response was served from the response
+        cache, as it was saved to the data lake when it was first fetched.
         """
-        for site_id, visits_date in site_dates:
-            site_response_json = self.shoppertrak_api_client.json_query(
-                SINGLE_SITE_ENDPOINT + site_id, visits_date
+        if site_response == APIStatus.ERROR:
+            return None
+        if self.shoppertrak_api_client.is_cached_response(site_response):
+            response_text = None
+        else:
+            response_text = self.shoppertrak_api_client.get_response_text(site_response)
+        site_results = self.shoppertrak_api_client.parse_response(
+            site_response, visits_date, is_recovery_mode=is_recovery_mode
+        )
+        return response_text, site_results
+
+    def _handle_site_response(self, site_date, site_response, known_data_index):
+        """
+        Saves a parsed single site response to the data lake, unless it was served from
+        the response cache, and sends any recovered data to Kinesis. Returns the
+        Redshift ids of the rows it replaces.
+        """
+        site_id, visits_date = site_date
+        if site_response is None:
+            message = f"Failed to retrieve site visits data for {site_id}"
+            log_based_on_poll_date(
+                self.logger, message, visits_date in self.bad_poll_dates
             )
-            if site_response_json is not None:
-                s3_path = (
-                    os.environ["DATA_LAKE_S3_PATH"]
-                    + visits_date.strftime("%Y/%m/%d/")
-                    + f"{int(datetime.now(pytz.utc).timestamp())}.json"
-                )
-                self.data_lake_s3_client.put_object(
-                    Key=s3_path, Body=site_response_json.encode("utf-8")
-                )
+            return []
+        response_text, site_results = site_response
+        if response_text is not None:
+            self._send_response_to_data_lake(response_text, site_id, visits_date)
+        return self._process_recovered_data(site_results, known_data_index)
 
-    def _process_recovered_data(self, recovered_data, known_data_dict):
+    def _send_response_to_data_lake(self, response_text, site_id, visits_date):
+        """
+        Temporary function. Saves the raw XML response for a site/date to S3 for later
+        use in the data lake. The key includes the site ID and a random suffix so that
+        responses saved in the same second never overwrite each other.
+        """
+        s3_path = (
+            os.environ["DATA_LAKE_S3_PATH"]
+            + visits_date.strftime("%Y/%m/%d/")
+            + f"{site_id}_{int(datetime.now(pytz.utc).timestamp())}_"
+            + f"{uuid.uuid4().hex}.xml"
+        )
+        with self.metrics.timed("s3.put_data_lake_object"):
+            self.data_lake_s3_client.put_object(
+                Key=s3_path, Body=response_text.encode("utf-8")
+            )
+
+    def _process_recovered_data(self, recovered_data, known_data_index):
         """
         Check that ShopperTrak "recovered" data was actually unhealthy to begin with
-        and, if so, encode, send to Kinesis, and mark old Redshift rows as stale
+        and, if so, encode and send to Kinesis. Returns the Redshift ids of the old
+        rows that have been replaced, which only happens once the send succeeds.
         """
         results = []
         stale_ids = []
         for fresh_row in recovered_data:
-            data_timestamp = datetime.strptime(
-                fresh_row["increment_start"], "%Y-%m-%d %H:%M:%S"
+            known_row = known_data_index.get(
+                fresh_row.shoppertrak_site_id,
+                fresh_row.orbit,
+                fresh_row.increment_start,
             )
-            key = (fresh_row["shoppertrak_site_id"], fresh_row["orbit"], data_timestamp)
-            if key not in known_data_dict:
+            if known_row is None:
                 results.append(fresh_row)
-            else:
-                known_row = known_data_dict[key]
-                if not known_row[1]:  # previously unhealthy data
-                    results.append(fresh_row)
-                    stale_ids.append(str(known_row[0]))
-                elif (  # previously healthy data that doesn't match the new API data
-                    fresh_row["enters"] != known_row[2]
-                    or fresh_row["exits"] != known_row[3]
-                ):
-                    message = (
-                        f"Different healthy data found in API and Redshift: {key} "
-                        f"mapped to {fresh_row} in the API and {known_row} in Redshift"
-                    )
-                    log_based_on_poll_date(
-                        self.logger,
-                        message,
-                        data_timestamp.date() in self.bad_poll_dates,
-                        is_warning=True,
-                    )
-
-        # Mark old rows for successfully recovered data as stale
-        if stale_ids:
-            self.logger.info(f"Updating {len(stale_ids)} stale records")
-            update_query = build_redshift_update_query(
-                self.redshift_visits_table, ",".join(stale_ids)
-            )
-            if not self.ignore_update:
-                self.redshift_client.execute_transaction([(update_query, None)])
+            elif not known_row[1]:  # previously unhealthy data
+                results.append(fresh_row)
+                stale_ids.append(str(known_row[0]))
+            elif (  # previously healthy data that doesn't match the new API data
+                fresh_row.enters != known_row[2] or fresh_row.exits != known_row[3]
+            ):
+                key = (
+                    fresh_row.shoppertrak_site_id,
+                    fresh_row.orbit,
+                    fresh_row.increment_start,
+                )
+                message = (
+                    f"Different healthy data found in API and Redshift: {key} "
+                    f"mapped to {fresh_row} in the API and {known_row} in Redshift"
+                )
+                log_based_on_poll_date(
+                    self.logger,
+                    message,
+                    date.fromisoformat(fresh_row.increment_start[:10])
+                    in self.bad_poll_dates,
+                    is_warning=True,
+                )
 
         if results:
-            encoded_records = self.avro_encoder.encode_batch(results)
-            if not self.ignore_kinesis:
-                self.kinesis_client.send_records(encoded_records)
+            self._send_records(self._encode_rows(results))
         else:
             self.logger.info("No recovered data found")
+        return stale_ids
 
-    def _get_poll_date(self, batch_num):
-        """Retrieves the last poll date from the S3 cache or the config"""
+    def _update_stale_records(self, stale_ids):
+        """
+        Marks the old Redshift rows for successfully recovered data as stale. The ids
+        from a whole recovery pass are updated in a single transaction, split into
+        UPDATE queries of at most STALE_UPDATE_BATCH_SIZE ids each.
+        """
+        if not stale_ids:
+            return
+        self.logger.info(f"Updating {len(stale_ids)} stale records")
+        update_queries = [
+            (
+                build_redshift_update_query(
+                    self.redshift_visits_table,
+                    ",".join(stale_ids[i : i + self.stale_update_batch_size]),
+                ),
+                None,
+            )
+            for i in range(0, len(stale_ids), self.stale_update_batch_size)
+        ]
+        if not self.ignore_update:
+            with self.metrics.timed("redshift.execute_transaction"):
+                self.redshift_client.execute_transaction(update_queries)
+
+    def _update_stale_records_after_error(self, stale_ids):
+        """
+        Marks the old Redshift rows for data recovered before a recovery pass failed
+        as stale. Errors are logged rather than thrown so that they don't hide the
+        error that stopped the pass.
+        """
+        try:
+            self._update_stale_records(stale_ids)
+        except Exception as e:
+            self.logger.error(f"Failed to update {len(stale_ids)} stale records: {e}")
+
+    async def _process_all_data_async(
+        self, last_poll_date, all_sites_end_date, broken_start_date
+    ):
+        """
+        Polls all sites data and recovers broken orbits at the same time on one event
+        loop, sharing the AsyncShopperTrakApiClient's connections. The two cover
+        separate dates, so neither depends on the other. If either fails, the other
+        still finishes before the first error is thrown. Broken orbits aren't
+        recovered if SKIP_RECOVERY is set.
+        """
+        tasks = [self._process_all_sites_data_async(last_poll_date, all_sites_end_date)]
+        if not self.skip_recovery:
+            tasks.append(
+                self._process_broken_orbits_async(
+                    broken_start_date,
+                    last_poll_date + timedelta(days=1),
+                    (all_sites_end_date - last_poll_date).days,
+                )
+            )
+        async with self.shoppertrak_api_client:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _process_all_sites_data_async(self, last_poll_date, end_date):
+        """
+        Same as process_all_sites_data, but up to BACKFILL_CONCURRENCY days are
+        fetched at once on the event loop while each day is parsed, encoded, and sent
+        to Kinesis in a worker thread. Days are still sent strictly in order and
+        polling stops at the first day that fails.
+        """
+        self._start_checkpoints(last_poll_date)
+        all_sites_responses = map_in_order_async(
+            self._fetch_all_sites_day_async,
+            self._get_all_sites_batches(last_poll_date, end_date),
+            self.backfill_concurrency,
+        )
+        try:
+            async for fetched_day in all_sites_responses:
+                if fetched_day is None:
+                    return
+                parsed_day = await asyncio.to_thread(
+                    self._parse_all_sites_day, fetched_day
+                )
+                batch_num, poll_date, encoded_records = await asyncio.to_thread(
+                    self._encode_all_sites_day, parsed_day
+                )
+                await asyncio.to_thread(self._send_records, encoded_records)
+                self.logger.info(f"Finished batch {batch_num}: {poll_date.isoformat()}")
+
+                last_poll_date = poll_date
+                await asyncio.to_thread(self._checkpoint, last_poll_date)
+        finally:
+            await all_sites_responses.aclose()
+            await asyncio.to_thread(self._checkpoint, last_poll_date, True)
+
+    async def _fetch_all_sites_day_async(self, batch):
+        batch_num, poll_date = batch
+        self.logger.info(f"Beginning batch {batch_num}: {poll_date.isoformat()}")
+        all_sites_response = await self.shoppertrak_api_client.query(
+            ALL_SITES_ENDPOINT, poll_date
+        )
+        return self._check_all_sites_response(batch_num, poll_date, all_sites_response)
+
+    async def _process_broken_orbits_async(self, start_date, end_date, all_sites_days):
+        """
+        Same as process_broken_orbits, but Redshift, S3, and Kinesis are used from
+        worker threads so that the event loop is free for the API queries. The
+        all_sites_days being polled at the same time are kept back from the budget.
+        """
+        with self.metrics.timed("redshift.connect"):
+            await asyncio.to_thread(self.redshift_client.connect)
+        try:
+            missing_site_dates, unhealthy_site_dates, known_data_index = (
+                await asyncio.to_thread(
+                    self._discover_broken_orbits, start_date, end_date
+                )
+            )
+            missing_site_dates, unhealthy_site_dates = self._plan_recovery(
+                missing_site_dates, unhealthy_site_dates, all_sites_days
+            )
+            if missing_site_dates:
+                missing_site_dates = sorted(
+                    missing_site_dates, key=lambda x: (x[1], x[0])
+                )
+                self.logger.info("Re-querying for previously missing data")
+                await self._recover_data_async(
+                    missing_site_dates, KnownDataIndex(), is_recovery_mode=False
+                )
+
+            unhealthy_site_dates = sorted(
+                unhealthy_site_dates, key=lambda x: (x[1], x[0])
+            )
+            self.logger.info("Re-querying for previously unhealthy data")
+            await self._recover_data_async(unhealthy_site_dates, known_data_index)
+        finally:
+            with self.metrics.timed("redshift.close_connection"):
+                await asyncio.to_thread(self.redshift_client.close_connection)
+
+    async def _recover_data_async(
+        self, site_dates, known_data_index, is_recovery_mode=True
+    ):
+        """
+        Same as _recover_data, but up to RECOVERY_WORKERS site/dates are queried at
+        once on the event loop instead of in threads
+        """
+
+        async def query_site_date(site_date):
+            site_id, visits_date = site_date
+            site_response = await self.shoppertrak_api_client.query(
+                SINGLE_SITE_ENDPOINT + site_id, visits_date
+            )
+            return await asyncio.to_thread(
+                self._parse_site_response, site_response, visits_date, is_recovery_mode
+            )
+
+        all_site_responses = map_in_order_async(
+            query_site_date, site_dates, self.recovery_workers
+        )
+        stale_ids = []
+        is_finished = False
+        site_dates = iter(site_dates)
+        try:
+            async for site_response in all_site_responses:
+                stale_ids.extend(
+                    await asyncio.to_thread(
+                        self._handle_site_response,
+                        next(site_dates),
+                        site_response,
+                        known_data_index,
+                    )
+                )
+            is_finished = True
+        finally:
+            await all_site_responses.aclose()
+            if is_finished:
+                await asyncio.to_thread(self._update_stale_records, stale_ids)
+            else:
+                await asyncio.to_thread(
+                    self._update_stale_records_after_error, stale_ids
+                )
+
+    def _get_poll_date(self):
+        """
+        Retrieves the last poll date from the S3 cache or the config. The S3 state is
+        only read once per run and is kept in memory afterwards.
+        """
         if self.ignore_cache:
             poll_str = os.environ["LAST_POLL_DATE"]
-            poll_date = datetime.strptime(poll_str, "%Y-%m-%d").date()
-            return poll_date + timedelta(days=batch_num)
         else:
-            poll_str = self.s3_client.fetch_cache()["last_poll_date"]
-            return datetime.strptime(poll_str, "%Y-%m-%d").date()
+            with self.metrics.timed("s3.fetch_cache"):
+                self.poller_state = self.s3_client.fetch_cache()
+            poll_str = self.poller_state["last_poll_date"]
+        return datetime.strptime(poll_str, "%Y-%m-%d").date()
+
+    def _set_poll_date(self, poll_date):
+        """
+        Checkpoints the last successfully polled date, along with today's API usage
+        if there is a budget, to the S3 cache
+        """
+        self.poller_state = {
+            **self.poller_state,
+            "last_poll_date": poll_date.isoformat(),
+        }
+        if self.quota_budget is not None:
+            self.poller_state["api_quota"] = self.quota_budget.to_state()
+        if not self.ignore_cache:
+            with self.metrics.timed("s3.set_cache"):
+                self.s3_client.set_cache(self.poller_state)
+
+    def _save_quota(self):
+        """Saves today's API usage, if there is a budget, to the S3 cache"""
+        if self.quota_budget is None:
+            return
+        self.poller_state = {
+            **self.poller_state,
+            "api_quota": self.quota_budget.to_state(),
+        }
+        if not self.ignore_cache and "last_poll_date" in self.poller_state:
+            with self.metrics.timed("s3.set_cache"):
+                self.s3_client.set_cache(self.poller_state)
@@ -0,0 +1,84 @@
+import pytz
+import threading
+
+from datetime import datetime
+
+
+class QuotaBudget:
+    """
+    Class for keeping track of how many ShopperTrak API requests have been sent each
+    UTC day so that a run can be planned against the daily limit and stop cleanly
+    before reaching it. The count is saved in the poller state alongside the last
+    poll date so it carries over between runs on the same day.
+
+    A reserve of requests is kept back so that retries of busy requests and requests
+    made outside the poller don't push the total over the limit.
+    """
+
+    def __init__(self, daily_limit, reserve=0):
+        self.daily_limit = daily_limit
+        self.reserve = reserve
+        self.day = self._get_utc_day()
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def load(self, state):
+        """Loads the count saved in the poller state if it is from the same UTC day"""
+        self.day = self._get_utc_day()
+        if state and state.get("day") == self.day:
+            self.used = int(state.get("used", 0))
+        else:
+            self.used = 0
+
+    def to_state(self):
+        with self._lock:
+            return {"day": self.day, "used": self.used}
+
+    @property
+    def remaining(self):
+        """How many more requests can be sent today, not counting the reserve"""
+        with self._lock:
+            self._roll_over()
+            return max(0, self.daily_limit - self.reserve - self.used)
+
+    def try_acquire(self):
+        """Counts a request about to be sent and returns False if none are left"""
+        with self._lock:
+            self._roll_over()
+            if self.used >= self.daily_limit - self.reserve:
+                return False
+            self.used += 1
+            return True
+
+    def exhaust(self):
+        """Marks today's budget as used up, e.g. when ShopperTrak reports it is"""
+        with self._lock:
+            self._roll_over()
+            self.used = max(self.used, self.daily_limit)
+
+    def plan(self, demands):
+        """
+        Splits the remaining budget between the given (name, number of requests)
+        demands in priority order and returns a dictionary of how many requests each
+        is allowed
+        """
+        remaining = self.remaining
+        allowed = dict()
+        for name, count in demands:
+            allowed[name] = min(count, remaining)
+            remaining -= allowed[name]
+        return allowed
+
+    def _roll_over(self):
+        day = self._get_utc_day()
+        if day != self.day:
+            self.day = day
+            self.used = 0
+
+    def _get_utc_day(self):
+        return datetime.now(pytz.utc).date().isoformat()
+
+
+class QuotaExhaustedError(Exception):
+    def __init__(self, message=None):
+        self.message = message
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import pytz
+import threading
+
+from datetime import datetime, timedelta
+from lib.blob_store import build_blob_store
+from urllib.parse import quote
+
+# Recovery re-queries data up to 30 days old, so responses for those dates must keep
+# expiring for their replacements to be fetched
+DEFAULT_IMMUTABLE_AFTER_DAYS = 31
+
+
+def build_response_cache(location, ttl_hours, immutable_after_days):
+    """
+    Returns a ResponseCache kept under the prefix if the location is an
+    s3://bucket/prefix URI and in the local directory at the location otherwise
+    """
+    return ResponseCache(
+        build_blob_store(location, "response_cache"), ttl_hours, immutable_after_days
+    )
+
+
+class ResponseCache:
+    """
+    Class for caching raw ShopperTrak API responses in a blob store, keyed by
+    endpoint, date, and query parameters. Responses for dates at least
+    immutable_after_days old are assumed to never change and are always reused.
+    Responses for more recent dates are only reused for ttl_hours after they were
+    fetched, as the data may still be recovered.
+    """
+
+    def __init__(self, store, ttl_hours, immutable_after_days):
+        self.store = store
+        self.ttl = timedelta(hours=ttl_hours)
+        self.immutable_after_days = immutable_after_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, endpoint, query_date, params):
+        """Returns the cached response text or None if there is no usable response"""
+        entry = self.store.read(self._build_key(endpoint, query_date, params))
+        today = datetime.now(pytz.timezone("US/Eastern")).date()
+        is_immutable = (today - query_date).days >= self.immutable_after_days
+        if entry is not None and (
+            is_immutable
+            or datetime.fromisoformat(entry["fetched_at"]) + self.ttl
+            > datetime.now(pytz.utc)
+        ):
+            self._record(is_hit=True)
+            return entry["response_text"]
+        self._record(is_hit=False)
+        return None
+
+    def set(self, endpoint, query_date, params, response_text):
+        """Caches a response that was just fetched"""
+        entry = {
+            "fetched_at": datetime.now(pytz.utc).isoformat(),
+            "response_text": response_text,
+        }
+        self.store.write(self._build_key(endpoint, query_date, params), entry)
+
+    def _record(self, is_hit):
+        with self._lock:
+            if is_hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _build_key(self, endpoint, query_date, params):
+        params_hash = hashlib.sha256(
+            json.dumps(params, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        return f"{quote(endpoint, safe='')}/{query_date.isoformat()}/{params_hash}.json"
@@ -0,0 +1,175 @@
+import asyncio
+import random
+import threading
+import time
+
+from nypl_py_utils.functions.log_helper import create_log
+
+# How often coroutines waiting for another request's probe check whether it finished
+_PROBE_POLL_SECONDS = 1
+
+
+class RetryScheduler:
+    """
+    Class for deciding how long to wait before retrying requests that ShopperTrak
+    turned away because it was busy or down. Each retry waits exponentially longer,
+    from min_seconds up to max_seconds, with random jitter so that concurrent requests
+    don't all retry at the same moment.
+
+    A single request backing off only pauses its own thread (or coroutine, for the
+    _async methods used by AsyncShopperTrakApiClient). However, after
+    breaker_threshold busy responses in a row, across every endpoint, the circuit
+    breaker opens and all requests wait until the backoff ends. Exactly one request is
+    then sent as a probe while the rest keep waiting: if it succeeds the breaker
+    closes, and if not it opens again. If the probe doesn't report back within
+    max_seconds (e.g. because its request failed), another request takes its place.
+    """
+
+    def __init__(self, min_seconds, max_seconds, breaker_threshold):
+        self.logger = create_log("retry_scheduler")
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.breaker_threshold = breaker_threshold
+
+        self.breaker_state = "closed"
+        self.breaker_opens = 0
+        self.retry_attempts = 0
+        self.total_wait_seconds = 0.0
+        self._consecutive_busy = 0
+        self._breaker_until = 0.0
+        self._probe_deadline = 0.0
+        self._lock = threading.Lock()
+        self._probe_finished = threading.Condition(self._lock)
+
+    def get_delay(self, attempt):
+        """Returns how many seconds to wait before the given retry attempt"""
+        ceiling = max(
+            self.min_seconds,
+            min(self.max_seconds, self.min_seconds * 2 ** (attempt - 1)),
+        )
+        return random.uniform(max(self.min_seconds, ceiling / 2), ceiling)
+
+    def wait_for_breaker(self):
+        """
+        Blocks while the circuit breaker is open or another request is probing
+        whether ShopperTrak is available again
+        """
+        waited_for = None
+        while True:
+            with self._probe_finished:
+                action, seconds, waited_for = self._check_breaker(waited_for)
+                if action == "wait_for_probe":
+                    self._probe_finished.wait(seconds)
+                    continue
+            if action == "send":
+                return
+            elif seconds > 0:
+                self._sleep(seconds)
+
+    async def wait_for_breaker_async(self):
+        """
+        Same as wait_for_breaker, but only pauses the calling coroutine. As the probe
+        may finish on another thread, coroutines waiting for it check back every
+        _PROBE_POLL_SECONDS.
+        """
+        waited_for = None
+        while True:
+            with self._lock:
+                action, seconds, waited_for = self._check_breaker(waited_for)
+            if action == "send":
+                return
+            elif action == "wait_for_probe":
+                await self._sleep_async(min(seconds, _PROBE_POLL_SECONDS))
+            elif seconds > 0:
+                await self._sleep_async(seconds)
+
+    def back_off(self, attempt):
+        """
+        Records a busy response and waits before the given retry attempt, opening the
+        circuit breaker if there have been too many busy responses in a row. Returns
+        how many seconds were waited.
+        """
+        delay = self._record_busy(attempt)
+        self._sleep(delay)
+        return delay
+
+    async def back_off_async(self, attempt):
+        """Same as back_off, but only pauses the calling coroutine"""
+        delay = self._record_busy(attempt)
+        await self._sleep_async(delay)
+        return delay
+
+    def record_success(self):
+        """Records a response showing that ShopperTrak is available"""
+        with self._lock:
+            self._consecutive_busy = 0
+            if self.breaker_state != "closed":
+                self.logger.info("ShopperTrak is available again: resuming requests")
+                self.breaker_state = "closed"
+                self._probe_finished.notify_all()
+
+    def metrics(self):
+        """Returns the number of retries, time spent waiting, and breaker state"""
+        with self._lock:
+            return {
+                "retry_attempts": self.retry_attempts,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+                "breaker_state": self.breaker_state,
+                "breaker_opens": self.breaker_opens,
+            }
+
+    def _check_breaker(self, waited_for):
+        """
+        Decides what a request about to be sent should do, given the opening of the
+        breaker it has already waited out (if any). Returns an action, how many seconds
+        to wait for, and the opening the request will have waited out. The action is
+        either "send", "wait" for the backoff to end, or "wait_for_probe" to finish.
+        Must be called while holding the lock.
+        """
+        if self.breaker_state == "closed":
+            return "send", 0, waited_for
+        now = time.monotonic()
+        if self.breaker_state == "open":
+            if waited_for != self.breaker_opens:
+                return "wait", max(self._breaker_until - now, 0), self.breaker_opens
+            self.logger.info("Sending a probe request to ShopperTrak")
+            self.breaker_state = "half_open"
+            self._probe_deadline = now + self.max_seconds
+            return "send", 0, waited_for
+        if now >= self._probe_deadline:
+            self.logger.warning("Probe request never finished: sending another")
+            self._probe_deadline = now + self.max_seconds
+            return "send", 0, waited_for
+        return "wait_for_probe", self._probe_deadline - now, waited_for
+
+    def _record_busy(self, attempt):
+        """Records a busy response and returns how long to wait before retrying"""
+        delay = self.get_delay(attempt)
+        with self._lock:
+            self.retry_attempts += 1
+            self._consecutive_busy += 1
+            if (
+                self.breaker_state == "half_open"
+                or self._consecutive_busy >= self.breaker_threshold
+            ):
+                if self.breaker_state != "open":
+                    self.breaker_opens += 1
+                    self.logger.warning(
+                        f"ShopperTrak turned away {self._consecutive_busy} requests in "
+                        f"a row: pausing all requests for {delay:.1f} seconds"
+                    )
+                    self._probe_finished.notify_all()
+                self.breaker_state = "open"
+                self._breaker_until = max(self._breaker_until, time.monotonic() + delay)
+        self.logger.info(f"Waiting {delay:.1f} seconds and trying again")
+        return delay
+
+    def _sleep(self, seconds):
+        with self._lock:
+            self.total_wait_seconds += seconds
+        time.sleep(seconds)
+
+    async def _sleep_async(self, seconds):
+        with self._lock:
+            self.total_wait_seconds += seconds
+        await asyncio.sleep(seconds)
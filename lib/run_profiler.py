@@ -0,0 +1,144 @@
+import boto3
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import tracemalloc
+
+from contextlib import contextmanager
+from datetime import datetime
+from nypl_py_utils.functions.log_helper import create_log
+
+PROFILE_MODES = ("cpu", "alloc")
+
+# Number of functions or allocation sites listed in each text report
+_TOP_N = 30
+
+
+class RunProfiler:
+    """
+    Class for profiling a poller run stage by stage, either with cProfile ("cpu"
+    mode) or with tracemalloc ("alloc" mode), so that its cost can be attributed to
+    all sites polling, missing data recovery, or unhealthy data recovery.
+
+    Stages must not overlap. In cpu mode each stage is saved as its own pstats file
+    and the whole run as their combination, along with a text report of the top
+    functions by cumulative time. In alloc mode a text report lists each stage's top
+    net allocations and the run's largest live allocations and peak memory.
+
+    Reports are written to a local directory or uploaded to an s3://bucket/prefix
+    location, in a subdirectory named after the time the run started.
+    """
+
+    def __init__(self, mode, output_location):
+        self.logger = create_log("run_profiler")
+        if mode not in PROFILE_MODES:
+            raise RunProfilerError(
+                f"Unknown profile mode '{mode}': expected one of {PROFILE_MODES}"
+            )
+        self.mode = mode
+        self.output_location = output_location
+        self.run_name = datetime.now().strftime("%Y%m%dT%H%M%S")
+        self.stage_stats = dict()
+        self.stage_allocations = dict()
+        if self.mode == "alloc":
+            tracemalloc.start(10)
+
+    @contextmanager
+    def profile(self, stage):
+        """Profiles the with block as the named stage"""
+        if self.mode == "cpu":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self.stage_stats[stage] = profiler
+        else:
+            start_snapshot = tracemalloc.take_snapshot()
+            try:
+                yield
+            finally:
+                self.stage_allocations[stage] = tracemalloc.take_snapshot().compare_to(
+                    start_snapshot, "lineno"
+                )
+
+    def save(self):
+        """Writes the reports for every stage profiled so far"""
+        with tempfile.TemporaryDirectory() as directory:
+            if self.mode == "cpu":
+                file_names = self._write_cpu_reports(directory)
+            else:
+                file_names = self._write_alloc_report(directory)
+                tracemalloc.stop()
+            if self.output_location.startswith("s3://"):
+                s3_client = boto3.client(
+                    "s3", region_name=os.environ.get("AWS_REGION", "us-east-1")
+                )
+            for file_name in file_names:
+                local_path = os.path.join(directory, file_name)
+                destination = self._join(self.output_location, file_name)
+                if destination.startswith("s3://"):
+                    bucket, _, key = destination[len("s3://") :].partition("/")
+                    s3_client.upload_file(local_path, bucket, key)
+                else:
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    os.replace(local_path, destination)
+        self.logger.info(
+            f"Saved {self.mode} profile to {self._join(self.output_location)}"
+        )
+
+    def _write_cpu_reports(self, directory):
+        file_names = []
+        report = io.StringIO()
+        run_stats = None
+        for stage, profiler in self.stage_stats.items():
+            file_names.append(f"cpu_{stage}.pstats")
+            profiler.dump_stats(os.path.join(directory, file_names[-1]))
+            stats = pstats.Stats(profiler, stream=report)
+            report.write(f"==== {stage} ====\n")
+            stats.sort_stats("cumulative").print_stats(_TOP_N)
+            if run_stats is None:
+                run_stats = pstats.Stats(profiler, stream=report)
+            else:
+                run_stats.add(profiler)
+
+        if run_stats is not None:
+            file_names.append("cpu_run.pstats")
+            run_stats.dump_stats(os.path.join(directory, file_names[-1]))
+            report.write("==== run ====\n")
+            run_stats.sort_stats("cumulative").print_stats(_TOP_N)
+        file_names.append("cpu_report.txt")
+        with open(os.path.join(directory, file_names[-1]), "w") as f:
+            f.write(report.getvalue())
+        return file_names
+
+    def _write_alloc_report(self, directory):
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"Current traced memory: {current / 2**20:.1f} MiB",
+            f"Peak traced memory: {peak / 2**20:.1f} MiB",
+        ]
+        for stage, differences in self.stage_allocations.items():
+            lines.append(f"==== {stage}: top net allocations ====")
+            lines.extend(str(difference) for difference in differences[:_TOP_N])
+        lines.append("==== run: largest live allocations ====")
+        lines.extend(
+            str(statistic)
+            for statistic in tracemalloc.take_snapshot().statistics("lineno")[:_TOP_N]
+        )
+        with open(os.path.join(directory, "alloc_report.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return ["alloc_report.txt"]
+
+    def _join(self, location, file_name=""):
+        return "/".join(
+            part.rstrip("/") for part in (location, self.run_name, file_name) if part
+        )
+
+
+class RunProfilerError(Exception):
+    def __init__(self, message=None):
+        self.message = message
@@ -0,0 +1,36 @@
+from lib.blob_store import build_blob_store
+
+
+def build_schema_cache(location):
+    """
+    Returns a SchemaCache kept in the S3 object if the location is an s3://bucket/key
+    URI and in the local file at the location otherwise
+    """
+    directory, separator, key = location.rpartition("/")
+    return SchemaCache(build_blob_store(directory + separator, "schema_cache"), key)
+
+
+class SchemaCache:
+    """
+    Class for keeping the last known-good copy of an Avro schema fetched from the
+    Platform API as a single document in a blob store. The entry is a dictionary of
+    the schema JSON, the ETag it was served with (if any), and when it was fetched.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def read(self):
+        """Returns the cached entry or None if there is no usable entry"""
+        entry = self.store.read(self.key)
+        if (
+            not isinstance(entry, dict)
+            or "schema" not in entry
+            or "fetched_at" not in entry
+        ):
+            return None
+        return entry
+
+    def write(self, entry):
+        self.store.write(self.key, entry)
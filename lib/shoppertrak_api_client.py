@@ -1,14 +1,20 @@
-import json
 import os
 import pytz
 import requests
-import time
+import threading
+import weakref
 import xml.etree.ElementTree as ET
 
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, time as dt_time
 from enum import Enum
 from helpers.util import log_based_on_poll_date
+from lib.metrics import Metrics
+from lib.quota_budget import QuotaExhaustedError
+from lib.response_cache import build_response_cache, DEFAULT_IMMUTABLE_AFTER_DAYS
+from lib.retry_scheduler import RetryScheduler
 from nypl_py_utils.functions.log_helper import create_log
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import RequestException
 from urllib.parse import quote
@@ -16,6 +22,27 @@ from urllib.parse import quote
 ALL_SITES_ENDPOINT = "allsites"
 SINGLE_SITE_ENDPOINT = "site/"
 
+# Number of characters fed to the streaming XML parser at a time
+_STREAM_CHUNK_SIZE = 65536
+
+_WEEKDAYS = (
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+)
+
+# Maps each of the 96 possible 15-minute startTime values to its time and to the time
+# portion of the increment_start string so they don't need to be parsed for every row
+_START_TIMES = {
+    f"{hour:02}{minute:02}00": (dt_time(hour, minute), f" {hour:02}:{minute:02}:00")
+    for hour in range(24)
+    for minute in range(0, 60, 15)
+}
+
 
 class APIStatus(Enum):
     SUCCESS = 1  # The API successfully retrieved the data
@@ -26,67 +53,240 @@ class APIStatus(Enum):
     ERROR = 3
 
 
+class LocationVisitsRow(
+    namedtuple(
+        "LocationVisitsRow",
+        [
+            "shoppertrak_site_id",
+            "orbit",
+            "increment_start",
+            "enters",
+            "exits",
+            "is_healthy_data",
+            "is_missing_data",
+            "is_fresh",
+            "poll_date",
+        ],
+    )
+):
+    """
+    One 15-minute increment of LocationVisits data, with the fields of the Avro
+    schema in order. Backfills produce millions of these, so a tuple without a
+    per-instance __dict__ is used rather than a dictionary.
+    """
+
+    __slots__ = ()
+
+
 class ShopperTrakApiClient:
     """Class for querying the ShopperTrak API for location visits data"""
 
     def __init__(self, username, password, location_hours_dict, bad_poll_dates):
         self.logger = create_log("shoppertrak_api_client")
         self.base_url = os.environ["SHOPPERTRAK_API_BASE_URL"]
-        self.auth = HTTPBasicAuth(username, password)
         self.max_retries = int(os.environ["MAX_RETRIES"])
+        # Busy requests are retried at least max_retries times and for at least this
+        # many seconds of backoff, so that short ShopperTrak outages are ridden out
+        self.retry_budget_seconds = float(
+            os.environ.get("SHOPPERTRAK_RETRY_BUDGET_SECONDS", 600)
+        )
+        self.timeout = (
+            float(os.environ.get("SHOPPERTRAK_CONNECT_TIMEOUT", 10)),
+            float(os.environ.get("SHOPPERTRAK_READ_TIMEOUT", 300)),
+        )
+
+        # A single long-lived session is used so that connections to ShopperTrak are
+        # kept alive and reused rather than re-established for every request
+        self.session = self._build_session(
+            username, password, int(os.environ.get("SHOPPERTRAK_POOL_SIZE", 10))
+        )
+
         self.today_str = datetime.now(pytz.timezone("US/Eastern")).date().isoformat()
         self.location_hours_dict = location_hours_dict
         self.bad_poll_dates = bad_poll_dates
+        self.stream_parse = os.environ.get("STREAM_PARSE", False) == "True"
+        # The raw text of each XML root returned by query, kept only as long as the
+        # root itself so that it can be saved to the data lake unchanged
+        self._response_texts = weakref.WeakKeyDictionary()
+        # The XML roots returned by query that were served from the response cache
+        self._cached_responses = weakref.WeakSet()
+
+        # Shared by every thread using this client so that they all pause when
+        # ShopperTrak is repeatedly turned away requests
+        self.retry_scheduler = RetryScheduler(
+            float(os.environ.get("SHOPPERTRAK_RETRY_MIN_SECONDS", 15)),
+            float(os.environ.get("SHOPPERTRAK_RETRY_MAX_SECONDS", 300)),
+            int(os.environ.get("SHOPPERTRAK_BREAKER_THRESHOLD", 1)),
+        )
+
+        # Total number of requests sent to ShopperTrak, all of which count towards the
+        # daily API limit. If a QuotaBudget is set, requests stop once it runs out.
+        self.request_count = 0
+        self._request_count_lock = threading.Lock()
+        self.quota_budget = None
+
+        # Timings of requests, back-offs, and parsing. Replaced by the
+        # PipelineController so they are reported with the rest of the run's metrics.
+        self.metrics = Metrics()
+
+        self.response_cache = None
+        if os.environ.get("RESPONSE_CACHE_LOCATION"):
+            self.response_cache = build_response_cache(
+                os.environ["RESPONSE_CACHE_LOCATION"],
+                float(os.environ.get("RESPONSE_CACHE_TTL_HOURS", 12)),
+                int(
+                    os.environ.get(
+                        "RESPONSE_CACHE_IMMUTABLE_DAYS", DEFAULT_IMMUTABLE_AFTER_DAYS
+                    )
+                ),
+            )
+
+    @property
+    def location_hours_dict(self):
+        return self._location_hours_dict
+
+    @location_hours_dict.setter
+    def location_hours_dict(self, location_hours_dict):
+        # Each site's hours are resolved at most once per weekday, so the resolved
+        # hours need to be reset whenever the underlying hours change
+        self._location_hours_dict = location_hours_dict
+        self._site_hours_cache = dict()
+
+    def close(self):
+        self.session.close()
 
-    def query(self, endpoint, query_date, query_count=1):
+    def query(self, endpoint, query_date, query_count=1, waited_seconds=0):
         """
         Sends query to ShopperTrak API and either a) returns the result as an XML root
-        if the query was successful, b) returns APIStatus.ERROR if the query failed but
-        others should be attempted, or c) waits and tries again if the API was busy.
+        (or as an XMLResponseStream when streaming is enabled) if the query was
+        successful, b) returns APIStatus.ERROR if the query failed but others should be
+        attempted, or c) waits and tries again if the API was busy.
         """
-        full_url = self.base_url + "service/" + quote(endpoint)
-        date_str = query_date.strftime("%Y%m%d")
-        is_bad_poll_date = bool(query_date in self.bad_poll_dates)
+        path = "service/" + quote(endpoint)
+        params = self._build_query_params(query_date)
 
-        self.logger.info(f"Querying {endpoint} for {date_str} data")
-        try:
-            response = requests.get(
-                full_url,
-                auth=self.auth,
-                headers={
-                    "Content-Type": "application/xml",
-                    "Cache-Control": "no-cache",
-                    "Pragma": "no-cache",
-                },
-                params={
-                    "date": date_str,
-                    "increment": "15",
-                    "total_property_only": "false",
-                    "detail": "entrance",
-                },
+        response_text = self._get_cached_response(path, query_date, params)
+        is_cached = response_text is not None
+        if not is_cached:
+            self._wait_for_backoff()
+            self.logger.info(f"Querying {endpoint} for {params['date']} data")
+            try:
+                with self.metrics.timed("shoppertrak.request"):
+                    response = self.session.get(
+                        self.base_url + path,
+                        headers={"Content-Type": "application/xml"},
+                        params=params,
+                        timeout=self.timeout,
+                    )
+                    response.raise_for_status()
+                    response_text = response.text
+            except RequestException as e:
+                return self._handle_request_error(self.base_url + path, e, query_date)
+
+        with self.metrics.timed("shoppertrak.check_response"):
+            result = self._handle_query_response(
+                response_text,
+                path,
+                query_date,
+                params,
+                query_count,
+                waited_seconds,
+                is_cached,
             )
-            response.raise_for_status()
-        except RequestException as e:
-            message = f"Failed to retrieve response from {full_url}: {e}"
-            log_based_on_poll_date(self.logger, message, is_bad_poll_date)
-            if is_bad_poll_date:
-                return APIStatus.ERROR
-            else:
-                raise ShopperTrakApiClientError(message) from None
+        if result == APIStatus.RETRY:
+            with self.metrics.timed("shoppertrak.back_off"):
+                delay = self.retry_scheduler.back_off(query_count)
+            return self.query(
+                endpoint, query_date, query_count + 1, waited_seconds + delay
+            )
+        return result
 
-        response_status, response_root = self._check_response(response.text, query_date)
+    def _build_session(self, username, password, pool_size):
+        session = requests.Session()
+        session.auth = HTTPBasicAuth(username, password)
+        session.headers.update(
+            {
+                "Accept-Encoding": "gzip",
+                "Cache-Control": "no-cache",
+                "Pragma": "no-cache",
+            }
+        )
+        session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size),
+        )
+        return session
+
+    def _build_query_params(self, query_date):
+        return {
+            "date": query_date.strftime("%Y%m%d"),
+            "increment": "15",
+            "total_property_only": "false",
+            "detail": "entrance",
+        }
+
+    def _handle_request_error(self, full_url, error, query_date):
+        """
+        Returns APIStatus.ERROR for a request that failed on a known bad poll date and
+        throws an error otherwise
+        """
+        is_bad_poll_date = bool(query_date in self.bad_poll_dates)
+        message = f"Failed to retrieve response from {full_url}: {error}"
+        log_based_on_poll_date(self.logger, message, is_bad_poll_date)
+        if is_bad_poll_date:
+            return APIStatus.ERROR
+        else:
+            raise ShopperTrakApiClientError(message) from None
+
+    def _handle_query_response(
+        self,
+        response_text,
+        path,
+        query_date,
+        params,
+        query_count,
+        waited_seconds,
+        is_cached,
+    ):
+        """
+        Checks the text of a query response and returns what query should return, or
+        APIStatus.RETRY if query should wait and try again. Busy queries are retried
+        until both max_retries queries have been sent and waited_seconds, the backoff
+        so far, has reached retry_budget_seconds.
+        """
+        is_bad_poll_date = bool(query_date in self.bad_poll_dates)
+        if self.stream_parse:
+            response_status, response_root = self._check_streamed_response(
+                response_text, query_date
+            )
+        else:
+            response_status, response_root = self._check_response(
+                response_text, query_date
+            )
+        if response_status != APIStatus.RETRY and not is_cached:
+            self.retry_scheduler.record_success()
         if response_status == APIStatus.SUCCESS:
+            if not is_cached:
+                self._set_cached_response(path, query_date, params, response_text)
+            if self.stream_parse:
+                response_root.is_cached = is_cached
+            else:
+                self._response_texts[response_root] = response_text
+                if is_cached:
+                    self._cached_responses.add(response_root)
             return response_root
         elif response_status == APIStatus.ERROR:
             return response_status
         elif response_status == APIStatus.RETRY:
-            if query_count < self.max_retries:
-                self.logger.info("Waiting 5 minutes and trying again")
-                time.sleep(300)
-                return self.query(endpoint, query_date, query_count + 1)
+            if (
+                query_count < self.max_retries
+                or waited_seconds < self.retry_budget_seconds
+            ):
+                return APIStatus.RETRY
             else:
                 message = (
-                    f"Hit retry limit: sent {self.max_retries} queries with no response"
+                    f"Hit retry limit: sent {query_count} queries with no response "
+                    f"over {waited_seconds:.0f} seconds"
                 )
                 log_based_on_poll_date(self.logger, message, is_bad_poll_date)
                 if is_bad_poll_date:
@@ -101,45 +301,53 @@ class ShopperTrakApiClient:
             else:
                 raise ShopperTrakApiClientError(message) from None
 
-    def json_query(self, endpoint, query_date, query_count=1):
+    def _get_cached_response(self, path, query_date, params):
+        """Returns a cached response text, or None if caching is disabled or missed"""
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(path, query_date, params)
+
+    def _set_cached_response(self, path, query_date, params, response_text):
+        if self.response_cache is not None:
+            self.response_cache.set(path, query_date, params, response_text)
+
+    def _wait_for_backoff(self):
         """
-        Used for Snowflake data lake. Sends query to ShopperTrak API and either a) returns
-        the JSON text if the query was successful, b) returns None if the query failed, or
-        c) waits and tries again if the API was busy.
+        Blocks while ShopperTrak's circuit breaker is open and counts the request about
+        to be sent, throwing an error if the daily API budget has been used up
         """
-        full_url = self.base_url + "traffic/15min/" + quote(endpoint)
-        date_str = query_date.strftime("%Y%m%d")
-
-        response = requests.get(
-            full_url,
-            auth=self.auth,
-            headers={
-                "Content-Type": "application/json",
-                "Cache-Control": "no-cache",
-                "Pragma": "no-cache",
-            },
-            params={
-                "date": date_str,
-                "total_property_only": "false",
-                "detail": "entrance",
-            },
-        )
+        self.retry_scheduler.wait_for_breaker()
+        self._count_request()
 
-        response_dict = json.loads(response.text)
-        if "code" in response_dict:
-            code = response_dict["code"]
-            if code == "000" or code == "E108":
-                if query_count < self.max_retries:
-                    time.sleep(300)
-                    return self.json_query(endpoint, query_date, query_count + 1)
-            return None
+    def _count_request(self):
+        """
+        Counts a request about to be sent, throwing an error if the daily API budget
+        has been used up
+        """
+        if self.quota_budget is not None and not self.quota_budget.try_acquire():
+            raise QuotaExhaustedError("Daily ShopperTrak API budget used up")
+        with self._request_count_lock:
+            self.request_count += 1
 
-        return response.text
+    def get_response_text(self, response):
+        """Returns the raw XML text of a successful response returned by query"""
+        if isinstance(response, XMLResponseStream):
+            return response.response_text
+        return self._response_texts[response]
+
+    def is_cached_response(self, response):
+        """
+        Returns whether a successful response returned by query was served from the
+        response cache rather than fetched from ShopperTrak
+        """
+        if isinstance(response, XMLResponseStream):
+            return response.is_cached
+        return response in self._cached_responses
 
     def parse_response(self, xml_root, input_date, is_recovery_mode=False):
         """
-        Takes API response as an XML root and returns a list of dictionaries containing
-        result records. The XML root is expected to look as follows:
+        Takes API response as an XML root or an XMLResponseStream and returns a list of
+        LocationVisitsRows. The XML is expected to look as follows:
 
         <sites>
             <site siteID="lib a">
@@ -160,6 +368,22 @@ class ShopperTrakApiClient:
             </site>
         </sites>
         """
+        with self.metrics.timed("shoppertrak.parse_response"):
+            rows = self._parse_response(xml_root, input_date, is_recovery_mode)
+        self.metrics.increment("shoppertrak.rows_parsed", len(rows))
+        return rows
+
+    def _parse_response(self, xml_root, input_date, is_recovery_mode):
+        if isinstance(xml_root, XMLResponseStream):
+            try:
+                return list(
+                    self.iter_streamed_rows(xml_root, input_date, is_recovery_mode)
+                )
+            except ShopperTrakApiClientError:
+                if input_date in self.bad_poll_dates:
+                    return []
+                raise
+
         rows = []
         for site_xml in xml_root.findall("site"):
             site_val = self._get_xml_str(site_xml, "siteID")
@@ -167,7 +391,8 @@ class ShopperTrakApiClient:
                 date_val = datetime.strptime(
                     self._get_xml_str(date_xml, "dateValue"), "%Y%m%d"
                 ).date()
-                weekday = date_val.strftime("%A")
+                date_str = date_val.isoformat()
+                weekday = _WEEKDAYS[date_val.weekday()]
                 if date_val != input_date:
                     message = (
                         f"Request date does not match response date.\nRequest date: "
@@ -190,11 +415,12 @@ class ShopperTrakApiClient:
                             traffic_xml,
                             site_val,
                             date_val,
+                            date_str,
                             entrance_val,
                             weekday,
                             is_recovery_mode,
                         )
-                        if result_row["increment_start"] in seen_timestamps:
+                        if result_row.increment_start in seen_timestamps:
                             message = (
                                 f"Received multiple results from the API for the same "
                                 f"site/date/orbit/timestamp combination: {result_row}"
@@ -205,21 +431,89 @@ class ShopperTrakApiClient:
                                 input_date in self.bad_poll_dates,
                                 is_warning=True,
                             )
-                        if result_row["is_healthy_data"] or not is_recovery_mode:
+                        if result_row.is_healthy_data or not is_recovery_mode:
                             rows.append(result_row)
-                        seen_timestamps.add(result_row["increment_start"])
+                        seen_timestamps.add(result_row.increment_start)
         return rows
 
+    def iter_streamed_rows(self, response_stream, input_date, is_recovery_mode=False):
+        """
+        Streaming counterpart to parse_response. Yields result records one at a time
+        from the traffic an XMLResponseStream collected while it was read, without
+        parsing the XML again.
+        """
+        is_bad_poll_date = input_date in self.bad_poll_dates
+        site_attrib = date_attrib = None
+        site_val = date_val = date_str = weekday = None
+        for (
+            entrance_site,
+            entrance_date,
+            entrance_attrib,
+            traffic,
+        ) in response_stream.entrances:
+            if entrance_site is not site_attrib:
+                site_attrib = entrance_site
+                site_val = self._get_xml_str(site_attrib, "siteID")
+            if entrance_date is not date_attrib:
+                date_attrib = entrance_date
+                date_val = datetime.strptime(
+                    self._get_xml_str(date_attrib, "dateValue"), "%Y%m%d"
+                ).date()
+                date_str = date_val.isoformat()
+                weekday = _WEEKDAYS[date_val.weekday()]
+                if date_val != input_date:
+                    message = (
+                        f"Request date does not match response date.\nRequest "
+                        f"date: {input_date}\nResponse date: {date_val}"
+                    )
+                    log_based_on_poll_date(self.logger, message, is_bad_poll_date)
+                    raise ShopperTrakApiClientError(message)
+            seen_timestamps = set()
+            entrance_val = self._get_xml_str(entrance_attrib, "entranceName")
+            if entrance_val:
+                entrance_val = self._cast_str_to_int(entrance_val.lstrip("EP"))
+            for traffic_attrib in traffic:
+                result_row = self._form_row(
+                    traffic_attrib,
+                    site_val,
+                    date_val,
+                    date_str,
+                    entrance_val,
+                    weekday,
+                    is_recovery_mode,
+                )
+                if result_row.increment_start in seen_timestamps:
+                    message = (
+                        f"Received multiple results from the API for the same "
+                        f"site/date/orbit/timestamp combination: {result_row}"
+                    )
+                    log_based_on_poll_date(
+                        self.logger, message, is_bad_poll_date, is_warning=True
+                    )
+                seen_timestamps.add(result_row.increment_start)
+                if result_row.is_healthy_data or not is_recovery_mode:
+                    yield result_row
+
     def _form_row(
-        self, traffic_xml, site_val, date_val, entrance_val, weekday, is_recovery_mode
+        self,
+        traffic_xml,
+        site_val,
+        date_val,
+        date_str,
+        entrance_val,
+        weekday,
+        is_recovery_mode,
     ):
         """Forms one result row out of various XML elements and values"""
-        start_time_val = datetime.strptime(
-            self._get_xml_str(traffic_xml, "startTime"), "%H%M%S"
-        ).time()
-        start_dt_str = datetime.combine(date_val, start_time_val).strftime(
-            "%Y-%m-%d %H:%M:%S"
-        )
+        start_time_str = self._get_xml_str(traffic_xml, "startTime")
+        if start_time_str in _START_TIMES:
+            start_time_val, start_time_suffix = _START_TIMES[start_time_str]
+            start_dt_str = date_str + start_time_suffix
+        else:
+            start_time_val = datetime.strptime(start_time_str, "%H%M%S").time()
+            start_dt_str = datetime.combine(date_val, start_time_val).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            )
 
         enters = self._cast_str_to_int(self._get_xml_str(traffic_xml, "enters"))
         exits = self._cast_str_to_int(self._get_xml_str(traffic_xml, "exits"))
@@ -244,9 +538,8 @@ class ShopperTrakApiClient:
         if is_healthy_data or is_recovery_mode or enters > 0 or exits > 0:
             is_missing_data = False
         else:
-            branch_code = site_val.split(" ")[0]
-            if (branch_code, weekday) in self.location_hours_dict:
-                location_hours = self.location_hours_dict[(branch_code, weekday)]
+            location_hours = self._get_site_hours(site_val, weekday)
+            if location_hours is not None:
                 if location_hours[0] is None and location_hours[1] is None:
                     is_missing_data = False
                 else:
@@ -255,6 +548,7 @@ class ShopperTrakApiClient:
                         and start_time_val < location_hours[1]
                     )
             else:
+                branch_code = site_val.split(" ")[0]
                 message = (
                     f"Location hours not found for '{branch_code}' on '{weekday}'. "
                     f"Setting is_missing_data to True."
@@ -267,17 +561,30 @@ class ShopperTrakApiClient:
                 )
                 is_missing_data = True
 
-        return {
-            "shoppertrak_site_id": site_val,
-            "orbit": entrance_val,
-            "increment_start": start_dt_str,
-            "enters": enters,
-            "exits": exits,
-            "is_healthy_data": is_healthy_data,
-            "is_missing_data": is_missing_data,
-            "is_fresh": True,
-            "poll_date": self.today_str,
-        }
+        return LocationVisitsRow(
+            site_val,
+            entrance_val,
+            start_dt_str,
+            enters,
+            exits,
+            is_healthy_data,
+            is_missing_data,
+            True,
+            self.today_str,
+        )
+
+    def _get_site_hours(self, site_val, weekday):
+        """
+        Returns the (regular_open, regular_close) hours of the site's branch on the
+        given weekday, or None if they are unknown
+        """
+        key = (site_val, weekday)
+        if key not in self._site_hours_cache:
+            branch_code = site_val.split(" ")[0]
+            self._site_hours_cache[key] = self.location_hours_dict.get(
+                (branch_code, weekday)
+            )
+        return self._site_hours_cache[key]
 
     def _check_response(self, response_text, query_date):
         """
@@ -298,39 +605,7 @@ class ShopperTrakApiClient:
             return APIStatus.ERROR, None
 
         if error is not None and error.text is not None:
-            # E107 is used when the daily API limit has been exceeded
-            if error.text == "E107":
-                message = "API limit exceeded"
-                log_based_on_poll_date(self.logger, message, is_bad_poll_date)
-                if is_bad_poll_date:
-                    return APIStatus.ERROR, None
-                else:
-                    raise ShopperTrakApiClientError(message)
-            # E000 is used when ShopperTrak is down and E108 is used when it's busy
-            elif error.text == "E000" or error.text == "E108":
-                self.logger.info("ShopperTrak is unavailable")
-                return APIStatus.RETRY, None
-            elif error.text == "E104":
-                log_based_on_poll_date(
-                    self.logger,
-                    f"The site ID supplied has multiple matches: {response_text}",
-                    is_bad_poll_date,
-                )
-                return APIStatus.ERROR, None
-            elif error.text == "E110":
-                log_based_on_poll_date(
-                    self.logger,
-                    f"The current user does not have access to the given site: {response_text}",
-                    is_bad_poll_date,
-                )
-                return APIStatus.ERROR, None
-            else:
-                log_based_on_poll_date(
-                    self.logger,
-                    f"Error code {error.text} found in XML response: {response_text}",
-                    is_bad_poll_date,
-                )
-                return APIStatus.ERROR, None
+            return self._check_error_code(error.text, response_text, query_date), None
         elif len(root.findall(".//traffic")) == 0:
             log_based_on_poll_date(
                 self.logger,
@@ -341,6 +616,85 @@ class ShopperTrakApiClient:
         else:
             return APIStatus.SUCCESS, root
 
+    def _check_streamed_response(self, response_text, query_date):
+        """
+        Streaming counterpart to _check_response. Reads the whole response in a single
+        pass, collecting its traffic as it goes, and returns an XMLResponseStream if no
+        errors are found. Otherwise, either throws an error or returns an APIStatus
+        where appropriate.
+        """
+        is_bad_poll_date = bool(query_date in self.bad_poll_dates)
+        try:
+            response_stream = XMLResponseStream(response_text)
+        except ET.ParseError as e:
+            log_based_on_poll_date(
+                self.logger,
+                f"Could not parse XML response {response_text}: {e}",
+                is_bad_poll_date,
+            )
+            return APIStatus.ERROR, None
+
+        if response_stream.error_code is not None:
+            return (
+                self._check_error_code(
+                    response_stream.error_code, response_text, query_date
+                ),
+                None,
+            )
+        elif not response_stream.has_traffic:
+            log_based_on_poll_date(
+                self.logger,
+                f"No traffic found in XML response: {response_text}",
+                is_bad_poll_date,
+            )
+            return APIStatus.ERROR, None
+        else:
+            return APIStatus.SUCCESS, response_stream
+
+    def _check_error_code(self, error_code, response_text, query_date):
+        """
+        Maps an error code found in an XML response to the appropriate APIStatus,
+        throwing an error if the daily API limit has been exceeded
+        """
+        is_bad_poll_date = bool(query_date in self.bad_poll_dates)
+
+        # E107 is used when the daily API limit has been exceeded
+        if error_code == "E107":
+            message = "API limit exceeded"
+            log_based_on_poll_date(self.logger, message, is_bad_poll_date)
+            if self.quota_budget is not None:
+                self.quota_budget.exhaust()
+                raise QuotaExhaustedError(message)
+            elif is_bad_poll_date:
+                return APIStatus.ERROR
+            else:
+                raise ShopperTrakApiClientError(message)
+        # E000 is used when ShopperTrak is down and E108 is used when it's busy
+        elif error_code == "E000" or error_code == "E108":
+            self.logger.info("ShopperTrak is unavailable")
+            return APIStatus.RETRY
+        elif error_code == "E104":
+            log_based_on_poll_date(
+                self.logger,
+                f"The site ID supplied has multiple matches: {response_text}",
+                is_bad_poll_date,
+            )
+            return APIStatus.ERROR
+        elif error_code == "E110":
+            log_based_on_poll_date(
+                self.logger,
+                f"The current user does not have access to the given site: {response_text}",
+                is_bad_poll_date,
+            )
+            return APIStatus.ERROR
+        else:
+            log_based_on_poll_date(
+                self.logger,
+                f"Error code {error_code} found in XML response: {response_text}",
+                is_bad_poll_date,
+            )
+            return APIStatus.ERROR
+
     def _get_xml_str(self, xml, attribute):
         """
         Returns XML attribute as string and logs a warning if the attribute does not
@@ -365,6 +719,67 @@ class ShopperTrakApiClient:
             return None
 
 
+class XMLResponseStream:
+    """
+    ShopperTrak XML response read in a single pass, which both checks it for an
+    <error> code and collects its traffic. It is the target of an XMLParser, so it
+    receives each tag and its attributes straight from the parser and no elements are
+    ever built. Each <entrance> is kept as the attributes of its site, date, and
+    entrance along with the attributes of each of its <traffic> elements. Throws an
+    ET.ParseError if the response is malformed anywhere, including if it has been cut
+    short.
+    """
+
+    def __init__(self, response_text, chunk_size=_STREAM_CHUNK_SIZE):
+        self.response_text = response_text
+        self.is_cached = False
+        self.error_code = None
+        self.entrances = []
+        self._site_attrib = self._date_attrib = self._traffic = None
+        self._depth = 0
+        self._error_text = None
+
+        parser = ET.XMLParser(target=self)
+        for i in range(0, len(response_text), chunk_size):
+            parser.feed(response_text[i : i + chunk_size])
+        parser.close()
+
+    @property
+    def has_traffic(self):
+        return any(traffic for _, _, _, traffic in self.entrances)
+
+    # The methods below are called by the XMLParser as it reads the response
+
+    def start(self, tag, attrib):
+        self._depth += 1
+        if tag == "traffic":
+            self._traffic.append(attrib)
+        elif tag == "entrance":
+            self._traffic = []
+            self.entrances.append(
+                (self._site_attrib, self._date_attrib, attrib, self._traffic)
+            )
+        elif tag == "date":
+            self._date_attrib = attrib
+        elif tag == "site":
+            self._site_attrib = attrib
+        elif tag == "error" and self._depth == 2:
+            self._error_text = []
+
+    def end(self, tag):
+        self._depth -= 1
+        if tag == "error" and self._error_text is not None:
+            self.error_code = "".join(self._error_text) or None
+            self._error_text = None
+
+    def data(self, text):
+        if self._error_text is not None:
+            self._error_text.append(text)
+
+    def close(self):
+        return None
+
+
 class ShopperTrakApiClientError(Exception):
     def __init__(self, message=None):
         self.message = message
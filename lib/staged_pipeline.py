@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+
+from contextlib import contextmanager
+
+# Sentinel passed down the queues once there are no more items
+_DONE = object()
+
+
+class StagedPipeline:
+    """
+    Class for running items through a series of stages concurrently. Each stage is a
+    (name, function, number of worker threads) tuple and consecutive stages are joined
+    by bounded queues, so while one item is in a later stage the next items can already
+    be in earlier ones without the number of items in memory growing unbounded.
+
+    If a stage returns None for an item, the remaining stages are skipped for that
+    item. Results are yielded by run() in the same order as the input items.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = {name: StageStats(queue_size) for name, _, _ in stages}
+        self._start_time = None
+
+    def run(self, items):
+        """
+        Lazily feeds the items through every stage and yields the final results in
+        order. If a stage throws an error, it is re-raised when its item is reached
+        and the pipeline is stopped.
+        """
+        self._start_time = time.perf_counter()
+        stopped = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        queues.append(queue.Queue())
+        in_flight = threading.Semaphore(
+            self.queue_size * len(self.stages)
+            + sum(workers for _, _, workers in self.stages)
+        )
+
+        threads = [
+            threading.Thread(
+                target=self._feed,
+                args=(items, queues[0], in_flight, stopped),
+                name="pipeline-feed",
+                daemon=True,
+            )
+        ]
+        for i, (name, _, workers) in enumerate(self.stages):
+            remaining_workers = [workers, threading.Lock()]
+            # Named so that each stage's threads can be told apart in py-spy dumps
+            threads.extend(
+                threading.Thread(
+                    target=self._work,
+                    args=(i, queues[i], queues[i + 1], stopped, remaining_workers),
+                    name=f"pipeline-{name}-{worker}",
+                    daemon=True,
+                )
+                for worker in range(workers)
+            )
+        for thread in threads:
+            thread.start()
+
+        finished_results = dict()
+        next_index = 0
+        try:
+            while True:
+                message = queues[-1].get()
+                if message is _DONE:
+                    return
+                index, result = message
+                finished_results[index] = result
+                while next_index in finished_results:
+                    result = finished_results.pop(next_index)
+                    next_index += 1
+                    in_flight.release()
+                    if isinstance(result, _StageFailure):
+                        raise result.error
+                    yield result
+        finally:
+            stopped.set()
+            for thread in threads:
+                thread.join()
+
+    @contextmanager
+    def timed(self, name):
+        """
+        Records the time spent in the with block as one item processed by the named
+        stage. Used for stages run by the caller, such as sending the final results.
+        """
+        if name not in self.stats:
+            self.stats[name] = StageStats(None)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stats[name].record_item(time.perf_counter() - start)
+
+    def summary(self):
+        """Returns each stage's item count, busy time, throughput, and occupancy"""
+        elapsed_seconds = time.perf_counter() - (
+            self._start_time or time.perf_counter()
+        )
+        return {
+            name: stats.summary(elapsed_seconds) for name, stats in self.stats.items()
+        }
+
+    def _feed(self, items, first_queue, in_flight, stopped):
+        first_stats = self.stats[self.stages[0][0]]
+        for index, item in enumerate(items):
+            while not in_flight.acquire(timeout=0.1):
+                if stopped.is_set():
+                    break
+            if stopped.is_set():
+                break
+            first_queue.put((index, item))
+            first_stats.record_queue(first_queue.qsize())
+        for _ in range(self.stages[0][2]):
+            first_queue.put(_DONE)
+
+    def _work(self, stage_index, input_queue, output_queue, stopped, remaining_workers):
+        name, func, _ = self.stages[stage_index]
+        next_stats = None
+        next_workers = 1
+        if stage_index + 1 < len(self.stages):
+            next_name, _, next_workers = self.stages[stage_index + 1]
+            next_stats = self.stats[next_name]
+
+        while True:
+            message = input_queue.get()
+            if message is _DONE:
+                break
+            if stopped.is_set():
+                continue
+
+            index, item = message
+            if item is not None and not isinstance(item, _StageFailure):
+                start = time.perf_counter()
+                try:
+                    item = func(item)
+                except Exception as e:
+                    item = _StageFailure(e)
+                self.stats[name].record_item(time.perf_counter() - start)
+            output_queue.put((index, item))
+            if next_stats is not None:
+                next_stats.record_queue(output_queue.qsize())
+
+        # The last worker of each stage to finish tells the next stage to finish too
+        with remaining_workers[1]:
+            remaining_workers[0] -= 1
+            is_last_worker = remaining_workers[0] == 0
+        if is_last_worker:
+            for _ in range(next_workers):
+                output_queue.put(_DONE)
+
+
+class StageStats:
+    """Counters for a single stage of a StagedPipeline"""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.queue_samples = 0
+        self.queue_total = 0
+        self.queue_max = 0
+        self._lock = threading.Lock()
+
+    def record_item(self, seconds):
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += seconds
+
+    def record_queue(self, occupancy):
+        with self._lock:
+            self.queue_samples += 1
+            self.queue_total += occupancy
+            self.queue_max = max(self.queue_max, occupancy)
+
+    def summary(self, elapsed_seconds):
+        summary = {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": (
+                round(self.items / elapsed_seconds, 3) if elapsed_seconds else None
+            ),
+        }
+        if self.queue_size is not None:
+            summary["queue_size"] = self.queue_size
+            summary["mean_queue_occupancy"] = (
+                round(self.queue_total / self.queue_samples, 3)
+                if self.queue_samples
+                else 0
+            )
+            summary["max_queue_occupancy"] = self.queue_max
+        return summary
+
+
+class _StageFailure:
+    """Wraps an error thrown by a stage so it can be re-raised in order"""
+
+    def __init__(self, error):
+        self.error = error
@@ -1,13 +1,31 @@
 import os
 
 from lib.pipeline_controller import PipelineController
+from lib.run_profiler import RunProfiler
 from nypl_py_utils.functions.config_helper import load_env_file
 
 
 def main():
     load_env_file(os.environ["ENVIRONMENT"], "config/{}.yaml")
-    controller = PipelineController()
-    controller.run()
+    if os.environ.get("PROFILE"):
+        _run_with_profiler(
+            RunProfiler(
+                os.environ["PROFILE"], os.environ.get("PROFILE_OUTPUT", "profiles")
+            )
+        )
+    else:
+        controller = PipelineController()
+        controller.run()
+
+
+def _run_with_profiler(profiler):
+    try:
+        with profiler.profile("startup"):
+            controller = PipelineController()
+        controller.profiler = profiler
+        controller.run()
+    finally:
+        profiler.save()
 
 
 if __name__ == "__main__":
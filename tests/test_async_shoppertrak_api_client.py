@@ -0,0 +1,188 @@
+import asyncio
+import math
+import pytest
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from datetime import date
+from freezegun import freeze_time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from lib import APIStatus, ShopperTrakApiClientError
+from lib.async_shoppertrak_api_client import AsyncShopperTrakApiClient
+from lib.quota_budget import QuotaBudget, QuotaExhaustedError
+
+_TEST_API_RESPONSE = (
+    '<?xml version="1.0" ?><sites><site siteID="aa"><date dateValue="20231231">'
+    '<entrance entranceName="EP 01">'
+    '<traffic code="01" exits="1" enters="2" startTime="010000"/>'
+    '<traffic code="02" exits="3" enters="4" startTime="020000"/>'
+    "</entrance></date></site></sites>"
+)
+_BUSY_API_RESPONSE = '<?xml version="1.0" ?><message><error>E108</error></message>'
+
+
+class _StubShopperTrakHandler(BaseHTTPRequestHandler):
+    """Replies to each request with the next of the server's queued responses"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get("Authorization")))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status, body = (
+                server.responses.pop(0) if server.responses else (200, server.default)
+            )
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestAsyncShopperTrakApiClient:
+
+    @pytest.fixture
+    def stub_server(self, monkeypatch):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StubShopperTrakHandler)
+        server.lock = threading.Lock()
+        server.requests = []
+        server.responses = []
+        server.default = _TEST_API_RESPONSE
+        server.delay = 0
+        server.in_flight = 0
+        server.max_in_flight = 0
+        thread = threading.Thread(
+            target=server.serve_forever, args=(0.01,), daemon=True
+        )
+        thread.start()
+        monkeypatch.setenv(
+            "SHOPPERTRAK_API_BASE_URL", f"http://127.0.0.1:{server.server_port}/"
+        )
+
+        yield server
+
+        server.shutdown()
+        server.server_close()
+
+    @pytest.fixture
+    def test_instance(self, stub_server, monkeypatch):
+        monkeypatch.setenv("ASYNC_CONCURRENCY", "2")
+        return AsyncShopperTrakApiClient(
+            "test_username", "test_password", dict(), [date(2023, 12, 30)]
+        )
+
+    @pytest.fixture
+    def mock_sleep(self, mocker):
+        # Like time.sleep, sleeping moves the clock forward by at least as long as
+        # was asked, so that backoffs end
+        with freeze_time("2024-01-01 23:00:00-05:00") as frozen_time:
+            yield mocker.patch(
+                "lib.retry_scheduler.asyncio.sleep",
+                side_effect=lambda seconds: frozen_time.tick(math.ceil(seconds)),
+            )
+
+    def _run(self, test_instance, coroutine):
+        async def run_with_client():
+            async with test_instance:
+                return await coroutine
+
+        return asyncio.run(run_with_client())
+
+    def test_query(self, test_instance, stub_server):
+        xml_root = self._run(
+            test_instance, test_instance.query("allsites", date(2023, 12, 31))
+        )
+
+        assert ET.tostring(xml_root) == ET.tostring(ET.fromstring(_TEST_API_RESPONSE))
+        assert len(test_instance.parse_response(xml_root, date(2023, 12, 31))) == 2
+        assert stub_server.requests == [
+            (
+                "/service/allsites?date=20231231&increment=15"
+                "&total_property_only=false&detail=entrance",
+                "Basic dGVzdF91c2VybmFtZTp0ZXN0X3Bhc3N3b3Jk",
+            )
+        ]
+        assert test_instance.request_count == 1
+        assert test_instance.session.is_closed
+
+    def test_query_retry(self, test_instance, stub_server, mock_sleep):
+        stub_server.responses = [(200, _BUSY_API_RESPONSE)]
+
+        xml_root = self._run(
+            test_instance, test_instance.query("allsites", date(2023, 12, 31))
+        )
+
+        assert xml_root.find("site").get("siteID") == "aa"
+        assert len(stub_server.requests) == 2
+        mock_sleep.assert_called_once_with(15)
+        assert test_instance.retry_scheduler.metrics()["retry_attempts"] == 1
+
+    def test_query_retry_limit(self, test_instance, stub_server, mock_sleep):
+        stub_server.default = _BUSY_API_RESPONSE
+        test_instance.retry_budget_seconds = 0
+
+        with pytest.raises(ShopperTrakApiClientError):
+            self._run(
+                test_instance, test_instance.query("allsites", date(2023, 12, 31))
+            )
+
+        assert len(stub_server.requests) == 3
+        assert mock_sleep.call_count == 2
+
+    def test_query_request_error(self, test_instance, stub_server):
+        stub_server.responses = [(500, "Internal Server Error")]
+
+        with pytest.raises(ShopperTrakApiClientError):
+            self._run(
+                test_instance, test_instance.query("allsites", date(2023, 12, 31))
+            )
+
+    def test_query_request_error_bad_poll_date(self, test_instance, stub_server):
+        stub_server.responses = [(500, "Internal Server Error")]
+
+        assert (
+            self._run(
+                test_instance, test_instance.query("allsites", date(2023, 12, 30))
+            )
+            == APIStatus.ERROR
+        )
+
+    def test_query_concurrency_limit(self, test_instance, stub_server):
+        stub_server.delay = 0.05
+
+        async def query_all():
+            return await asyncio.gather(
+                *(
+                    test_instance.query(f"site/{site_id}", date(2023, 12, 31))
+                    for site_id in ("aa", "bb", "cc", "dd", "ee", "ff")
+                )
+            )
+
+        results = self._run(test_instance, query_all())
+
+        assert len(results) == 6
+        assert all(result != APIStatus.ERROR for result in results)
+        assert len(stub_server.requests) == 6
+        assert stub_server.max_in_flight == 2
+
+    def test_query_quota_exhausted(self, test_instance, stub_server):
+        test_instance.quota_budget = QuotaBudget(0)
+
+        with pytest.raises(QuotaExhaustedError):
+            self._run(
+                test_instance, test_instance.query("allsites", date(2023, 12, 31))
+            )
+
+        assert stub_server.requests == []
+
+    def test_close(self, test_instance):
+        test_instance.close()
+
+        assert test_instance.session.is_closed
@@ -0,0 +1,92 @@
+import json
+import pytest
+
+from botocore.exceptions import ClientError
+from lib.blob_store import build_blob_store, LocalBlobStore, S3BlobStore
+
+_TEST_DOCUMENT = {"fetched_at": "2024-01-02T03:00:00+00:00", "value": "xml"}
+
+
+class TestBlobStore:
+
+    @pytest.fixture
+    def test_instance(self, tmp_path):
+        return LocalBlobStore(str(tmp_path), "test_store")
+
+    @pytest.fixture
+    def mock_s3_client(self, mocker):
+        mock_boto3 = mocker.patch("lib.blob_store.boto3")
+        return mock_boto3.client.return_value
+
+    def test_build_blob_store(self, tmp_path, mock_s3_client):
+        local_store = build_blob_store(str(tmp_path), "test_store")
+        assert type(local_store) == LocalBlobStore
+        assert local_store.directory == str(tmp_path)
+
+        s3_store = build_blob_store("s3://test_bucket/test/prefix/", "test_store")
+        assert type(s3_store) == S3BlobStore
+        assert s3_store.bucket == "test_bucket"
+        assert s3_store.prefix == "test/prefix/"
+
+    def test_read_missing(self, test_instance):
+        assert test_instance.read("a/b.json") is None
+
+    def test_write_and_read(self, test_instance, tmp_path):
+        test_instance.write("a/b.json", _TEST_DOCUMENT)
+
+        assert test_instance.read("a/b.json") == _TEST_DOCUMENT
+        assert [path.name for path in (tmp_path / "a").iterdir()] == ["b.json"]
+
+    def test_read_malformed(self, test_instance, tmp_path):
+        with open(tmp_path / "b.json", "w") as f:
+            f.write("{bad")
+
+        assert test_instance.read("b.json") is None
+
+    def test_s3_read(self, mock_s3_client):
+        mock_body = mock_s3_client.get_object.return_value["Body"]
+        mock_body.read.return_value = json.dumps(_TEST_DOCUMENT)
+        test_instance = S3BlobStore("test_bucket", "prefix/", "test_store")
+
+        assert test_instance.read("a/b.json") == _TEST_DOCUMENT
+        mock_s3_client.get_object.assert_called_once_with(
+            Bucket="test_bucket", Key="prefix/a/b.json"
+        )
+
+    def test_s3_read_missing(self, mock_s3_client, caplog):
+        mock_s3_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+        )
+        test_instance = S3BlobStore("test_bucket", "prefix/", "test_store")
+
+        assert test_instance.read("a/b.json") is None
+        assert caplog.text == ""
+
+    def test_s3_read_error(self, mock_s3_client, caplog):
+        mock_s3_client.get_object.side_effect = ClientError(
+            {"Error": {"Code": "AccessDenied"}}, "GetObject"
+        )
+        test_instance = S3BlobStore("test_bucket", "prefix/", "test_store")
+
+        assert test_instance.read("a/b.json") is None
+        assert "Could not read prefix/a/b.json from test_bucket" in caplog.text
+
+    def test_s3_write(self, mock_s3_client):
+        test_instance = S3BlobStore("test_bucket", "prefix/", "test_store")
+
+        test_instance.write("a/b.json", _TEST_DOCUMENT)
+
+        kwargs = mock_s3_client.put_object.call_args.kwargs
+        assert kwargs["Bucket"] == "test_bucket"
+        assert kwargs["Key"] == "prefix/a/b.json"
+        assert json.loads(kwargs["Body"]) == _TEST_DOCUMENT
+
+    def test_s3_write_error(self, mock_s3_client, caplog):
+        mock_s3_client.put_object.side_effect = ClientError(
+            {"Error": {"Code": "AccessDenied"}}, "PutObject"
+        )
+        test_instance = S3BlobStore("test_bucket", "prefix/", "test_store")
+
+        test_instance.write("a/b.json", _TEST_DOCUMENT)
+
+        assert "Could not write prefix/a/b.json to test_bucket" in caplog.text
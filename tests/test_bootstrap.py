@@ -0,0 +1,62 @@
+import pytest
+import threading
+
+from lib.bootstrap import Bootstrap, BootstrapError
+
+
+class TestBootstrap:
+
+    @pytest.fixture
+    def test_instance(self):
+        return Bootstrap({"location_hours": 0.2}, default_timeout=5)
+
+    def test_run(self, test_instance):
+        # Each dependency only finishes once all three are being loaded at once
+        barrier = threading.Barrier(3, timeout=1)
+
+        def load(result):
+            def load():
+                barrier.wait()
+                return result
+
+            return load
+
+        loaded = test_instance.run(
+            {
+                "schema": load("schema"),
+                "poller_state": load({"last_poll_date": "2023-12-31"}),
+                "location_hours": load(dict()),
+            }
+        )
+
+        assert loaded == {
+            "schema": "schema",
+            "poller_state": {"last_poll_date": "2023-12-31"},
+            "location_hours": dict(),
+        }
+
+    def test_run_error(self, test_instance):
+        release = threading.Event()
+
+        def fail():
+            raise ConnectionError("Redshift is down")
+
+        # The error is raised without waiting for the schema
+        with pytest.raises(BootstrapError) as e:
+            test_instance.run({"schema": release.wait, "location_hours": fail})
+        release.set()
+
+        assert e.value.message == "Failed to load location_hours: Redshift is down"
+        assert type(e.value.__cause__) is ConnectionError
+
+    def test_run_timeout(self, test_instance):
+        release = threading.Event()
+
+        # location_hours has its own timeout, shorter than the default
+        with pytest.raises(BootstrapError) as e:
+            test_instance.run(
+                {"schema": lambda: "schema", "location_hours": release.wait}
+            )
+        release.set()
+
+        assert e.value.message == "Timed out loading location_hours after 0.2 seconds"
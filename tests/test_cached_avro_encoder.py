@@ -0,0 +1,194 @@
+import json
+import pytest
+
+from lib.cached_avro_encoder import CachedAvroEncoder
+from lib.schema_cache import build_schema_cache
+from nypl_py_utils.classes.avro_client import AvroClientError, AvroEncoder
+from requests.exceptions import ConnectTimeout
+
+_TEST_SCHEMA_URL = "https://test_schema_url"
+_TEST_SCHEMA = json.dumps(
+    {
+        "type": "record",
+        "name": "LocationVisits",
+        "fields": [
+            {"name": "shoppertrak_site_id", "type": "string"},
+            {"name": "enters", "type": "int"},
+        ],
+    }
+)
+_OLD_TEST_SCHEMA = json.dumps(
+    {
+        "type": "record",
+        "name": "LocationVisits",
+        "fields": [{"name": "shoppertrak_site_id", "type": "string"}],
+    }
+)
+_TEST_RECORD = {"shoppertrak_site_id": "aa", "enters": 10}
+
+
+class TestCachedAvroEncoder:
+
+    @pytest.fixture
+    def schema_cache(self, tmp_path):
+        return build_schema_cache(str(tmp_path / "schema.json"))
+
+    def _cache_schema(self, schema_cache, fetched_at="2024-01-02T00:00:00+00:00"):
+        schema_cache.write(
+            {"schema": _OLD_TEST_SCHEMA, "etag": '"v1"', "fetched_at": fetched_at}
+        )
+
+    def test_fetch_without_cache(self, requests_mock):
+        requests_mock.get(_TEST_SCHEMA_URL, json={"data": {"schema": _TEST_SCHEMA}})
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL)
+
+        assert test_instance.schema.name == "LocationVisits"
+        assert test_instance.schema_source == "Platform API"
+        assert test_instance.encode_batch([_TEST_RECORD]) == [b"\x04aa\x14"]
+
+    def test_fast_encoding(self, requests_mock, mocker):
+        requests_mock.get(_TEST_SCHEMA_URL, json={"data": {"schema": _TEST_SCHEMA}})
+        avro_encode_spy = mocker.spy(AvroEncoder, "encode_batch")
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, fast_encoding=True)
+
+        assert test_instance.fast_encoder is not None
+        assert test_instance.encode_batch([_TEST_RECORD]) == [b"\x04aa\x14"]
+        avro_encode_spy.assert_not_called()
+
+    @pytest.mark.parametrize("fast_encoding", [True, False])
+    def test_encode_rows(self, requests_mock, fast_encoding):
+        requests_mock.get(_TEST_SCHEMA_URL, json={"data": {"schema": _TEST_SCHEMA}})
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, fast_encoding=fast_encoding)
+
+        assert test_instance.encode_rows(
+            [(10, "aa"), (0, "b")], ["enters", "shoppertrak_site_id"]
+        ) == [b"\x04aa\x14", b"\x02b\x00"]
+        assert test_instance.encode_rows(
+            [(10, "aa"), (0, "b")],
+            ["enters", "shoppertrak_site_id"],
+            {"shoppertrak_site_id": "cc"},
+        ) == [b"\x04cc\x14", b"\x04cc\x00"]
+
+    def test_fast_encoding_unsupported_schema(self, requests_mock, caplog):
+        requests_mock.get(
+            _TEST_SCHEMA_URL,
+            json={
+                "data": {
+                    "schema": json.dumps(
+                        {
+                            "type": "record",
+                            "name": "LocationVisits",
+                            "fields": [
+                                {
+                                    "name": "orbits",
+                                    "type": {"type": "array", "items": "int"},
+                                }
+                            ],
+                        }
+                    )
+                }
+            },
+        )
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, fast_encoding=True)
+
+        assert test_instance.fast_encoder is None
+        assert "instead of a FastAvroEncoder: array fields" in caplog.text
+        assert test_instance.encode_batch([{"orbits": [1]}]) == [b"\x02\x02\x00"]
+
+    def test_fetch_and_cache(self, schema_cache, requests_mock, caplog):
+        requests_mock.get(
+            _TEST_SCHEMA_URL,
+            json={"data": {"schema": _TEST_SCHEMA}},
+            headers={"ETag": '"v2"'},
+        )
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, schema_cache)
+
+        assert test_instance.schema_source == "Platform API"
+        assert test_instance.load_seconds >= 0
+        assert "Loaded LocationVisits Avro schema from Platform API" in caplog.text
+        assert "If-None-Match" not in requests_mock.last_request.headers
+        assert requests_mock.last_request.timeout == 10
+        assert schema_cache.read() == {
+            "schema": _TEST_SCHEMA,
+            "etag": '"v2"',
+            "fetched_at": "2024-01-02T04:00:00+00:00",
+        }
+
+    def test_schema_changed(self, schema_cache, requests_mock, caplog):
+        self._cache_schema(schema_cache)
+        requests_mock.get(_TEST_SCHEMA_URL, json={"data": {"schema": _TEST_SCHEMA}})
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, schema_cache)
+
+        assert test_instance.encode_batch([_TEST_RECORD]) == [b"\x04aa\x14"]
+        assert requests_mock.last_request.headers["If-None-Match"] == '"v1"'
+        assert "Avro schema has changed since it was last cached" in caplog.text
+        assert schema_cache.read()["schema"] == _TEST_SCHEMA
+        assert schema_cache.read()["etag"] is None
+
+    def test_not_modified(self, schema_cache, requests_mock):
+        self._cache_schema(schema_cache)
+        requests_mock.get(_TEST_SCHEMA_URL, status_code=304)
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, schema_cache)
+
+        assert test_instance.schema_source == "cache (not modified)"
+        assert test_instance.encode_batch([{"shoppertrak_site_id": "aa"}]) == [
+            b"\x04aa"
+        ]
+        assert schema_cache.read() == {
+            "schema": _OLD_TEST_SCHEMA,
+            "etag": '"v1"',
+            "fetched_at": "2024-01-02T04:00:00+00:00",
+        }
+
+    def test_fresh_cache(self, schema_cache, requests_mock):
+        self._cache_schema(schema_cache)
+
+        test_instance = CachedAvroEncoder(
+            _TEST_SCHEMA_URL, schema_cache, max_age_hours=24
+        )
+
+        assert test_instance.schema_source == "cache"
+        assert not requests_mock.called
+
+    def test_stale_cache(self, schema_cache, requests_mock):
+        self._cache_schema(schema_cache, fetched_at="2024-01-01T00:00:00+00:00")
+        requests_mock.get(_TEST_SCHEMA_URL, json={"data": {"schema": _TEST_SCHEMA}})
+
+        test_instance = CachedAvroEncoder(
+            _TEST_SCHEMA_URL, schema_cache, max_age_hours=24
+        )
+
+        assert test_instance.schema_source == "Platform API"
+        assert requests_mock.called
+
+    def test_fallback_when_down(self, schema_cache, requests_mock, caplog):
+        self._cache_schema(schema_cache)
+        requests_mock.get(_TEST_SCHEMA_URL, exc=ConnectTimeout)
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, schema_cache)
+
+        assert test_instance.schema_source == "cache (fallback)"
+        assert "Falling back to the copy cached at 2024-01-02T00:00:00" in caplog.text
+        assert schema_cache.read()["fetched_at"] == "2024-01-02T00:00:00+00:00"
+
+    def test_fallback_when_malformed(self, schema_cache, requests_mock):
+        self._cache_schema(schema_cache)
+        requests_mock.get(_TEST_SCHEMA_URL, json={"data": {"schema": "{bad"}})
+
+        test_instance = CachedAvroEncoder(_TEST_SCHEMA_URL, schema_cache)
+
+        assert test_instance.schema_source == "cache (fallback)"
+        assert schema_cache.read()["schema"] == _OLD_TEST_SCHEMA
+
+    def test_error_without_cached_copy(self, schema_cache, requests_mock):
+        requests_mock.get(_TEST_SCHEMA_URL, status_code=503)
+
+        with pytest.raises(AvroClientError):
+            CachedAvroEncoder(_TEST_SCHEMA_URL, schema_cache)
@@ -0,0 +1,166 @@
+import avro.schema
+import json
+import pytest
+
+from avro.io import BinaryEncoder, DatumWriter
+from io import BytesIO
+from lib.fast_avro_encoder import FastAvroEncoder, UnsupportedSchemaError
+from nypl_py_utils.classes.avro_client import AvroClientError
+
+_TEST_SCHEMA = avro.schema.parse(
+    json.dumps(
+        {
+            "type": "record",
+            "name": "LocationVisits",
+            "fields": [
+                {"name": "shoppertrak_site_id", "type": "string"},
+                {"name": "orbit", "type": ["null", "int"]},
+                {"name": "increment_start", "type": "string"},
+                {"name": "enters", "type": ["null", "int"]},
+                {"name": "exits", "type": ["int", "null"]},
+                {"name": "count", "type": "long"},
+                {"name": "ratio", "type": ["null", "float", "double"]},
+                {"name": "is_healthy_data", "type": "boolean"},
+                {"name": "raw", "type": ["null", "bytes"]},
+                {"name": "poll_date", "type": "string"},
+            ],
+        }
+    )
+)
+_TEST_RECORDS = [
+    {
+        "shoppertrak_site_id": "aa",
+        "orbit": 1,
+        "increment_start": "2024-01-01 10:00:00",
+        "enters": 10,
+        "exits": 0,
+        "count": 2**40,
+        "ratio": 0.5,
+        "is_healthy_data": True,
+        "raw": b"\x00\xff",
+        "poll_date": "2024-01-02",
+    },
+    {
+        "shoppertrak_site_id": "bb café 📚",
+        "orbit": None,
+        "increment_start": "2024-01-01 10:15:00",
+        "enters": None,
+        "exits": None,
+        "count": -(2**63),
+        "ratio": None,
+        "is_healthy_data": False,
+        "raw": None,
+        "poll_date": "2024-01-02",
+    },
+    {
+        "shoppertrak_site_id": "aa",
+        "orbit": -65,
+        "increment_start": "2024-01-01 10:30:00",
+        "enters": 2**31 - 1,
+        "exits": -(2**31),
+        "count": 4096,
+        "ratio": 3,
+        "is_healthy_data": True,
+        "raw": b"",
+        "poll_date": "2024-01-02",
+    },
+]
+
+
+def _encode_with_avro(record):
+    with BytesIO() as output_stream:
+        DatumWriter(_TEST_SCHEMA).write(record, BinaryEncoder(output_stream))
+        return output_stream.getvalue()
+
+
+class TestFastAvroEncoder:
+
+    @pytest.fixture
+    def test_instance(self):
+        return FastAvroEncoder(_TEST_SCHEMA)
+
+    def test_encode_batch(self, test_instance):
+        assert test_instance.encode_batch(_TEST_RECORDS) == [
+            _encode_with_avro(record) for record in _TEST_RECORDS
+        ]
+        # Encoded strings are reused from the cache the second time
+        assert test_instance.encode_batch(_TEST_RECORDS) == [
+            _encode_with_avro(record) for record in _TEST_RECORDS
+        ]
+
+    def test_encode_rows(self, test_instance):
+        field_names = [
+            name for name in test_instance.field_names if name != "poll_date"
+        ][::-1]
+        rows = [tuple(record[name] for name in field_names) for record in _TEST_RECORDS]
+
+        assert test_instance.encode_rows(
+            rows, field_names, {"poll_date": "2024-01-02"}
+        ) == [_encode_with_avro(record) for record in _TEST_RECORDS]
+
+    def test_encode_rows_constants_override_rows(self, test_instance):
+        rows = [
+            tuple(record[name] for name in test_instance.field_names)
+            for record in _TEST_RECORDS
+        ]
+
+        assert test_instance.encode_rows(
+            rows, test_instance.field_names, {"poll_date": "2024-01-03"}
+        ) == [
+            _encode_with_avro({**record, "poll_date": "2024-01-03"})
+            for record in _TEST_RECORDS
+        ]
+
+    def test_encode_rows_missing_field(self, test_instance):
+        with pytest.raises(AvroClientError):
+            test_instance.encode_rows([("aa",)], ["shoppertrak_site_id"])
+
+    @pytest.mark.parametrize(
+        "field_name, value",
+        [
+            ("shoppertrak_site_id", None),
+            ("shoppertrak_site_id", 1),
+            ("orbit", "1"),
+            ("enters", 2**31),
+            ("count", 2**63),
+            ("count", 1.5),
+            ("ratio", "0.5"),
+            ("is_healthy_data", 1),
+            ("raw", "abc"),
+        ],
+    )
+    def test_encode_batch_invalid_value(self, test_instance, field_name, value):
+        with pytest.raises(AvroClientError):
+            test_instance.encode_batch([{**_TEST_RECORDS[0], field_name: value}])
+
+    def test_encode_batch_missing_field(self, test_instance):
+        record = {**_TEST_RECORDS[1]}
+        del record["orbit"]
+        assert test_instance.encode_batch([record]) == [_encode_with_avro(record)]
+
+        del record["increment_start"]
+        with pytest.raises(AvroClientError):
+            test_instance.encode_batch([record])
+
+    @pytest.mark.parametrize(
+        "field_type",
+        [
+            {"type": "array", "items": "int"},
+            {"type": "enum", "name": "Color", "symbols": ["RED"]},
+            {"type": "long", "logicalType": "timestamp-millis"},
+            ["null", {"type": "map", "values": "int"}],
+        ],
+    )
+    def test_unsupported_schema(self, field_type):
+        schema = avro.schema.parse(
+            json.dumps(
+                {
+                    "type": "record",
+                    "name": "Unsupported",
+                    "fields": [{"name": "field", "type": field_type}],
+                }
+            )
+        )
+
+        with pytest.raises(UnsupportedSchemaError):
+            FastAvroEncoder(schema)
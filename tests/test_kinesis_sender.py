@@ -0,0 +1,188 @@
+import pytest
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from lib.kinesis_sender import KinesisSender, KinesisSenderError
+
+_TEST_RECORDS = [f"record{i}".encode() for i in range(5)]
+
+
+def _build_response(error_codes):
+    return {
+        "FailedRecordCount": sum(code is not None for code in error_codes),
+        "Records": [
+            {"ErrorCode": code} if code is not None else {"SequenceNumber": "1"}
+            for code in error_codes
+        ],
+    }
+
+
+def _succeed(Records, StreamARN):
+    return _build_response([None] * len(Records))
+
+
+class TestKinesisSender:
+
+    @pytest.fixture
+    def mock_kinesis_client(self, mocker):
+        mock_kinesis_client = mocker.MagicMock()
+        mock_kinesis_client.stream_arn = "test_kinesis_stream"
+        mock_kinesis_client.batch_size = 2
+        mock_kinesis_client.max_retries = 3
+        mock_kinesis_client.kinesis_client.put_records.side_effect = _succeed
+        return mock_kinesis_client
+
+    @pytest.fixture
+    def test_instance(self, mock_kinesis_client):
+        return KinesisSender(mock_kinesis_client)
+
+    @pytest.fixture
+    def mock_sleep(self, mocker):
+        return mocker.patch("lib.kinesis_sender.time.sleep")
+
+    def _get_sent_data(self, mock_kinesis_client):
+        return [
+            [record["Data"] for record in call.kwargs["Records"]]
+            for call in mock_kinesis_client.kinesis_client.put_records.call_args_list
+        ]
+
+    def test_send_records_batch_size(self, test_instance, mock_kinesis_client):
+        test_instance.send_records(_TEST_RECORDS)
+
+        assert self._get_sent_data(mock_kinesis_client) == [
+            _TEST_RECORDS[:2],
+            _TEST_RECORDS[2:4],
+            _TEST_RECORDS[4:],
+        ]
+        for call in mock_kinesis_client.kinesis_client.put_records.call_args_list:
+            assert call.kwargs["StreamARN"] == "test_kinesis_stream"
+        partition_keys = [
+            record["PartitionKey"]
+            for call in mock_kinesis_client.kinesis_client.put_records.call_args_list
+            for record in call.kwargs["Records"]
+        ]
+        assert len(set(partition_keys)) == 5
+        assert test_instance.metrics()["records_sent"] == 5
+        assert test_instance.metrics()["put_records_calls"] == 3
+
+    def test_send_records_batch_bytes(self, mock_kinesis_client):
+        mock_kinesis_client.batch_size = 500
+        # Each record is 7 bytes of data and a 19 byte partition key, counted up from
+        # the frozen time in nanoseconds
+        test_instance = KinesisSender(mock_kinesis_client, max_batch_bytes=60)
+
+        test_instance.send_records(_TEST_RECORDS)
+
+        assert self._get_sent_data(mock_kinesis_client) == [
+            _TEST_RECORDS[:2],
+            _TEST_RECORDS[2:4],
+            _TEST_RECORDS[4:],
+        ]
+
+    def test_send_records_partial_failure(
+        self, test_instance, mock_kinesis_client, mock_sleep
+    ):
+        mock_kinesis_client.kinesis_client.put_records.side_effect = [
+            _build_response([None, "ProvisionedThroughputExceededException"]),
+            _build_response([None]),
+        ]
+
+        test_instance.send_records(_TEST_RECORDS[:2])
+
+        # Only the record that failed is sent again
+        assert self._get_sent_data(mock_kinesis_client) == [
+            _TEST_RECORDS[:2],
+            _TEST_RECORDS[1:2],
+        ]
+        mock_sleep.assert_called_once()
+        assert 0.25 <= mock_sleep.call_args.args[0] <= 0.5
+        assert test_instance.metrics() == {
+            "records_sent": 2,
+            "put_records_calls": 2,
+            "retried_records": 1,
+            "throttled_records": 1,
+            "records_per_second": 0.0,
+        }
+
+    def test_send_records_retry_limit(
+        self, test_instance, mock_kinesis_client, mock_sleep
+    ):
+        mock_kinesis_client.kinesis_client.put_records.side_effect = (
+            lambda Records, StreamARN: _build_response(
+                ["InternalFailure"] * len(Records)
+            )
+        )
+
+        with pytest.raises(KinesisSenderError):
+            test_instance.send_records(_TEST_RECORDS[:2])
+
+        assert mock_kinesis_client.kinesis_client.put_records.call_count == 3
+        assert mock_sleep.call_count == 2
+        assert test_instance.metrics()["throttled_records"] == 0
+
+    def test_send_records_throttled_request(
+        self, test_instance, mock_kinesis_client, mock_sleep
+    ):
+        mock_kinesis_client.kinesis_client.put_records.side_effect = [
+            ClientError(
+                {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+                "PutRecords",
+            ),
+            _build_response([None, None]),
+        ]
+
+        test_instance.send_records(_TEST_RECORDS[:2])
+
+        assert self._get_sent_data(mock_kinesis_client) == [
+            _TEST_RECORDS[:2],
+            _TEST_RECORDS[:2],
+        ]
+        assert test_instance.metrics()["throttled_records"] == 2
+
+    def test_send_records_client_error(
+        self, test_instance, mock_kinesis_client, mock_sleep
+    ):
+        mock_kinesis_client.kinesis_client.put_records.side_effect = ClientError(
+            {"Error": {"Code": "ResourceNotFoundException"}}, "PutRecords"
+        )
+
+        with pytest.raises(KinesisSenderError):
+            test_instance.send_records(_TEST_RECORDS)
+
+        assert mock_kinesis_client.kinesis_client.put_records.call_count == 1
+        mock_sleep.assert_not_called()
+
+    def test_send_records_in_parallel(self, mock_kinesis_client):
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def put_records(Records, StreamARN):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return _build_response([None] * len(Records))
+
+        mock_kinesis_client.kinesis_client.put_records.side_effect = put_records
+        test_instance = KinesisSender(mock_kinesis_client, max_in_flight=3)
+
+        test_instance.send_records(_TEST_RECORDS * 2)
+
+        assert mock_kinesis_client.kinesis_client.put_records.call_count == 5
+        assert in_flight[1] == 3
+        assert test_instance.metrics()["records_sent"] == 10
+
+    def test_records_per_second(self, test_instance, mocker):
+        mocker.patch("lib.kinesis_sender.time.monotonic", side_effect=[10, 12.5])
+
+        test_instance.send_records(_TEST_RECORDS)
+
+        assert test_instance.metrics()["records_per_second"] == 2.0
+
+    def test_close(self, test_instance, mock_kinesis_client):
+        test_instance.close()
+
+        mock_kinesis_client.close.assert_called_once()
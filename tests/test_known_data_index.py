@@ -0,0 +1,109 @@
+import pytest
+
+from datetime import datetime
+from lib.known_data_index import KnownDataIndex, KnownDataIndexError
+
+_TEST_ROWS = [
+    ("aa", 1, datetime(2023, 12, 1, 9, 0, 0), 99, True, 10, 11),
+    ("aa", 2, datetime(2023, 12, 1, 9, 0, 0), 98, False, 0, 0),
+    ("aa", 1, datetime(2023, 12, 1, 9, 15, 0), 97, False, 0, 0),
+    ("cc", 3, datetime(2023, 12, 2, 23, 45, 0), 96, True, 200, 201),
+]
+
+
+class TestKnownDataIndex:
+
+    @pytest.fixture
+    def test_instance(self):
+        return KnownDataIndex.from_rows(_TEST_ROWS)
+
+    def test_get(self, test_instance):
+        assert test_instance.get("aa", 1, "2023-12-01 09:00:00") == (99, True, 10, 11)
+        assert test_instance.get("aa", 2, "2023-12-01 09:00:00") == (98, False, 0, 0)
+        assert test_instance.get("aa", 1, "2023-12-01 09:15:00") == (97, False, 0, 0)
+        assert test_instance.get("cc", 3, "2023-12-02 23:45:00") == (
+            96,
+            True,
+            200,
+            201,
+        )
+
+    def test_get_missing(self, test_instance):
+        assert test_instance.get("bb", 1, "2023-12-01 09:00:00") is None
+        assert test_instance.get("aa", 3, "2023-12-01 09:00:00") is None
+        assert test_instance.get("aa", 1, "2023-12-01 09:30:00") is None
+        assert test_instance.get("aa", 1, "2023-12-02 09:00:00") is None
+        assert test_instance.get("cc", 3, "2023-12-01 23:45:00") is None
+
+    def test_len(self, test_instance):
+        assert len(test_instance) == 4
+        assert len(KnownDataIndex()) == 0
+
+    def test_iter(self, test_instance):
+        assert dict(test_instance) == {row[:3]: row[3:] for row in _TEST_ROWS}
+
+    def test_eq(self, test_instance):
+        assert test_instance == KnownDataIndex.from_rows(reversed(_TEST_ROWS))
+        assert test_instance != KnownDataIndex.from_rows(_TEST_ROWS[:3])
+        assert KnownDataIndex() == KnownDataIndex()
+
+    def test_add_replaces_duplicate(self, test_instance):
+        test_instance.add("aa", 1, datetime(2023, 12, 1, 9, 0, 0), 50, False, 1, 2)
+
+        assert test_instance.get("aa", 1, "2023-12-01 09:00:00") == (50, False, 1, 2)
+
+    def test_null_orbit(self, test_instance):
+        test_instance.add("aa", None, datetime(2023, 12, 1, 9, 0, 0), 50, False, 1, 2)
+
+        assert test_instance.get("aa", None, "2023-12-01 09:00:00") == (50, False, 1, 2)
+        assert test_instance.get("aa", 1, "2023-12-01 09:00:00") == (99, True, 10, 11)
+        assert test_instance.get("aa", None, "2023-12-01 09:15:00") is None
+        assert test_instance.get("cc", None, "2023-12-02 23:45:00") is None
+        assert dict(test_instance)[("aa", None, datetime(2023, 12, 1, 9, 0, 0))] == (
+            50,
+            False,
+            1,
+            2,
+        )
+
+    def test_add_orbit_out_of_range(self, test_instance):
+        for orbit in (-1, 65535, 1 << 16):
+            with pytest.raises(KnownDataIndexError):
+                test_instance.add(
+                    "aa", orbit, datetime(2023, 12, 1, 9, 0, 0), 50, False, 1, 2
+                )
+
+        # Out of range orbits are never stored, so can't clash with stored keys
+        assert test_instance.get("aa", 65535, "2023-12-01 09:00:00") is None
+        assert test_instance.get("aa", (1 << 16) + 1, "2023-12-01 09:00:00") is None
+        assert test_instance == KnownDataIndex.from_rows(_TEST_ROWS)
+
+    def test_add_too_many_sites(self, test_instance, mocker):
+        mocker.patch("lib.known_data_index._SITE_BITS", 1)
+
+        with pytest.raises(KnownDataIndexError):
+            test_instance.add("bb", 1, datetime(2023, 12, 1, 9, 0, 0), 50, False, 1, 2)
+
+    def test_null_values(self, test_instance):
+        test_instance.add("bb", 1, datetime(2023, 12, 1, 9, 0, 0), 50, None, None, None)
+        test_instance.add("bb", 2, datetime(2023, 12, 1, 9, 0, 0), 51, False, None, 0)
+
+        assert test_instance.get("bb", 1, "2023-12-01 09:00:00") == (
+            50,
+            None,
+            None,
+            None,
+        )
+        assert test_instance.get("bb", 2, "2023-12-01 09:00:00") == (
+            51,
+            False,
+            None,
+            0,
+        )
+        assert test_instance == KnownDataIndex.from_rows(
+            _TEST_ROWS
+            + [
+                ("bb", 1, datetime(2023, 12, 1, 9, 0, 0), 50, None, None, None),
+                ("bb", 2, datetime(2023, 12, 1, 9, 0, 0), 51, False, None, 0),
+            ]
+        )
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import pytest
+
+from lib.metrics import Metrics
+
+
+class TestMetrics:
+
+    @pytest.fixture
+    def test_instance(self):
+        return Metrics()
+
+    def test_timed(self, test_instance, mocker):
+        mocker.patch("lib.metrics.time.perf_counter", side_effect=[1, 3, 10, 11])
+
+        with test_instance.timed("redshift.execute_query"):
+            pass
+        with pytest.raises(ValueError):
+            with test_instance.timed("redshift.execute_query"):
+                raise ValueError("bad query")
+
+        assert test_instance.summary()["timers"] == {
+            "redshift.execute_query": {
+                "calls": 2,
+                "errors": 1,
+                "total_seconds": 3,
+                "mean_seconds": 1.5,
+                "max_seconds": 2,
+            }
+        }
+
+    def test_timed_async(self, test_instance):
+        async def query():
+            with test_instance.timed("shoppertrak.request"):
+                await asyncio.sleep(0)
+
+        asyncio.run(query())
+
+        assert test_instance.summary()["timers"]["shoppertrak.request"]["calls"] == 1
+
+    def test_increment(self, test_instance):
+        test_instance.increment("shoppertrak.rows_parsed", 96)
+        test_instance.increment("shoppertrak.rows_parsed", 4)
+        test_instance.increment("avro.records_encoded")
+
+        assert test_instance.summary()["counters"] == {
+            "avro.records_encoded": 1,
+            "shoppertrak.rows_parsed": 100,
+        }
+
+    def test_to_emf(self, test_instance):
+        test_instance.record_time("s3.set_cache", 0.25)
+        test_instance.increment("avro.records_encoded", 5)
+
+        lines = test_instance.to_emf("TestNamespace", {"Environment": "test"})
+
+        assert len(lines) == 1
+        emf_line = json.loads(lines[0])
+        assert emf_line["_aws"]["Timestamp"] == 1704168000000
+        assert emf_line["_aws"]["CloudWatchMetrics"] == [
+            {
+                "Namespace": "TestNamespace",
+                "Dimensions": [["Environment"]],
+                "Metrics": [
+                    {"Name": "s3.set_cache.seconds", "Unit": "Seconds"},
+                    {"Name": "s3.set_cache.calls", "Unit": "Count"},
+                    {"Name": "s3.set_cache.errors", "Unit": "Count"},
+                    {"Name": "avro.records_encoded", "Unit": "Count"},
+                ],
+            }
+        ]
+        assert emf_line["Environment"] == "test"
+        assert emf_line["s3.set_cache.seconds"] == 0.25
+        assert emf_line["s3.set_cache.calls"] == 1
+        assert emf_line["avro.records_encoded"] == 5
+
+    def test_to_emf_many_metrics(self, test_instance):
+        for i in range(150):
+            test_instance.increment(f"counter{i}")
+
+        lines = [json.loads(line) for line in test_instance.to_emf("TestNamespace")]
+
+        assert [
+            len(line["_aws"]["CloudWatchMetrics"][0]["Metrics"]) for line in lines
+        ] == [100, 50]
@@ -1,12 +1,24 @@
+import asyncio
+import json
 import logging
+import os
 import pytest
+import subprocess
+import sys
+import uuid
 import xml.etree.ElementTree as ET
 
 from datetime import date, datetime, time
-from helpers.query_helper import REDSHIFT_DROP_QUERY, REDSHIFT_RECOVERABLE_QUERY
+from lib.async_shoppertrak_api_client import AsyncShopperTrakApiClient
+from lib.bootstrap import BootstrapError
+from lib.known_data_index import KnownDataIndex
 from lib.pipeline_controller import PipelineController
-from lib.shoppertrak_api_client import APIStatus
-
+from lib.quota_budget import QuotaBudget, QuotaExhaustedError
+from lib.shoppertrak_api_client import (
+    APIStatus,
+    LocationVisitsRow,
+    ShopperTrakApiClientError,
+)
 
 _TEST_LOCATION_HOURS_DICT = {("aa", "Sunday"): (time(9), time(17))}
 _TEST_KNOWN_DATA_DICT = {
@@ -22,12 +34,27 @@ _TEST_RECOVERABLE_SITE_DATES = (
     ["aa", date(2023, 12, 2)],
     ["bb", date(2023, 12, 3)],
 )
+_TEST_KNOWN_DATA_ROWS = [
+    ("known", site_id, inc_start.date(), orbit, inc_start, *known_row)
+    for (site_id, orbit, inc_start), known_row in _TEST_KNOWN_DATA_DICT.items()
+]
+_TEST_KNOWN_DATA_INDEX = KnownDataIndex.from_rows(
+    [k + v for k, v in _TEST_KNOWN_DATA_DICT.items()]
+)
 _TEST_ENCODED_RECORDS = [b"encoded1", b"encoded2", b"encoded3"]
+_TEST_ENCODING_CONSTANTS = {"is_fresh": True, "poll_date": "2024-01-01"}
 _TEST_XML_ROOT = ET.fromstring('<?xml version="1.0"?><element></element>')
 
 
-def _build_test_api_data(increment_date_str, is_all_healthy_data):
+def _build_discovery_rows(kind, site_dates):
     return [
+        (kind, site_id, visits_date) + (None,) * 6
+        for site_id, visits_date in site_dates
+    ]
+
+
+def _build_test_api_data(increment_date_str, is_all_healthy_data):
+    rows = [
         {
             "shoppertrak_site_id": "aa",
             "orbit": 1,
@@ -84,15 +111,17 @@ def _build_test_api_data(increment_date_str, is_all_healthy_data):
             "poll_date": "2024-01-01",
         },
     ]
+    return [LocationVisitsRow(**row) for row in rows]
 
 
 class TestPipelineController:
 
     @pytest.fixture
     def test_instance(self, mocker):
-        mocker.patch("lib.pipeline_controller.AvroEncoder")
+        mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
         mocker.patch("lib.pipeline_controller.KinesisClient")
-        mocker.patch("lib.pipeline_controller.RedshiftClient")
+        mocker.patch("lib.pipeline_controller.KinesisSender")
+        mocker.patch("nypl_py_utils.classes.redshift_client.RedshiftClient")
         mocker.patch(
             "lib.pipeline_controller.S3Client",
             side_effect=[mocker.MagicMock(), mocker.MagicMock()],
@@ -101,6 +130,10 @@ class TestPipelineController:
         test_instance = PipelineController()
         test_instance.all_site_ids = {"aa", "bb", "cc", "dd", "ee"}
         test_instance.shoppertrak_api_client = mocker.MagicMock()
+        test_instance.shoppertrak_api_client.request_count = 0
+        test_instance.shoppertrak_api_client.today_str = "2024-01-01"
+        test_instance.shoppertrak_api_client.is_cached_response.return_value = False
+        test_instance.data_lake_s3_client = mocker.MagicMock()
         return test_instance
 
     @pytest.fixture
@@ -108,9 +141,9 @@ class TestPipelineController:
         mocker.patch("lib.pipeline_controller.create_log")
 
     def test_run(self, mock_logger, mocker):
-        mocker.patch("lib.pipeline_controller.AvroEncoder")
+        mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
         mocker.patch("lib.pipeline_controller.KinesisClient")
-        mocker.patch("lib.pipeline_controller.RedshiftClient")
+        mocker.patch("nypl_py_utils.classes.redshift_client.RedshiftClient")
 
         mocked_location_hours_method = mocker.patch(
             "lib.pipeline_controller.PipelineController.get_location_hours_dict",
@@ -122,6 +155,7 @@ class TestPipelineController:
         mocked_broken_orbits_method = mocker.patch(
             "lib.pipeline_controller.PipelineController.process_broken_orbits"
         )
+        mocked_close_method = mocker.patch("lib.ShopperTrakApiClient.close")
 
         mock_all_sites_s3_client = mocker.MagicMock()
         mock_all_sites_s3_client.fetch_cache.return_value = ["aa", "bb"]
@@ -129,34 +163,357 @@ class TestPipelineController:
         mock_s3_client.fetch_cache.return_value = {"last_poll_date": "2023-12-29"}
         mock_s3_constructor = mocker.patch(
             "lib.pipeline_controller.S3Client",
-            side_effect=[mock_all_sites_s3_client, mock_s3_client],
+            side_effect=[mock_s3_client, mock_all_sites_s3_client],
         )
 
         test_instance = PipelineController()
         assert test_instance.shoppertrak_api_client.location_hours_dict == dict()
+        mock_s3_constructor.assert_not_called()
+
+        test_instance.run()
+
+        mocked_location_hours_method.assert_called_once()
+        assert (
+            test_instance.shoppertrak_api_client.location_hours_dict
+            == _TEST_LOCATION_HOURS_DICT
+        )
+        mocked_all_sites_method.assert_called_once_with(
+            date(2023, 12, 29), date(2023, 12, 31)
+        )
+        mock_s3_client.close.assert_called_once()
+        mocked_broken_orbits_method.assert_called_once_with(
+            date(2023, 12, 2), date(2023, 12, 30)
+        )
+        mocked_close_method.assert_called_once()
+        test_instance.kinesis_sender.kinesis_client.close.assert_called_once()
+        timers = test_instance.metrics.summary()["timers"]
+        assert timers["bootstrap"]["calls"] == 1
+        assert timers["s3.fetch_all_sites"]["calls"] == 1
+        assert timers["s3.fetch_cache"]["calls"] == 1
+        assert timers["avro.load_schema"]["calls"] == 1
+
         assert test_instance.all_site_ids == {"aa", "bb"}
         mock_s3_constructor.assert_has_calls(
             [
-                mocker.call("test_all_sites_s3_bucket", "test_all_sites_s3_resource"),
                 mocker.call("test_s3_bucket", "test_s3_resource"),
+                mocker.call("test_all_sites_s3_bucket", "test_all_sites_s3_resource"),
             ]
         )
         mock_all_sites_s3_client.fetch_cache.assert_called_once()
         mock_all_sites_s3_client.close.assert_called_once()
 
+    def test_init_is_lazy(self, mocker):
+        clients = [
+            mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder"),
+            mocker.patch("lib.pipeline_controller.KinesisClient"),
+            mocker.patch("nypl_py_utils.classes.redshift_client.RedshiftClient"),
+            mocker.patch("lib.pipeline_controller.S3Client"),
+            mocker.patch("lib.pipeline_controller.boto3.resource"),
+        ]
+
+        PipelineController()
+
+        for client in clients:
+            client.assert_not_called()
+
+    def test_startup_time(self):
+        # Measured in a new interpreter, since this one has already imported
+        # everything and its clock is frozen
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import json, sys, time\n"
+                "start = time.perf_counter()\n"
+                "import main\n"
+                "main.PipelineController()\n"
+                "print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        startup_seconds, modules = json.loads(result.stdout)
+
+        assert startup_seconds < 5
+        for heavy_module in ("avro", "httpx", "redshift_connector"):
+            assert heavy_module not in modules
+
+    def test_run_nothing_to_do(self, mock_logger, mocker):
+        mocker.patch.dict(os.environ, {"SKIP_RECOVERY": "True"})
+        mock_avro_encoder = mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
+        mock_kinesis_client = mocker.patch("lib.pipeline_controller.KinesisClient")
+        mock_redshift_client = mocker.patch(
+            "nypl_py_utils.classes.redshift_client.RedshiftClient"
+        )
+        mocked_all_sites_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_all_sites_data"
+        )
+        mocked_close_method = mocker.patch("lib.ShopperTrakApiClient.close")
+        mock_s3_client = mocker.MagicMock()
+        mock_s3_client.fetch_cache.return_value = {"last_poll_date": "2023-12-31"}
+        mock_s3_constructor = mocker.patch(
+            "lib.pipeline_controller.S3Client", return_value=mock_s3_client
+        )
+
+        test_instance = PipelineController()
         test_instance.run()
 
-        mocked_location_hours_method.assert_called_once()
-        assert (
-            test_instance.shoppertrak_api_client.location_hours_dict
-            == _TEST_LOCATION_HOURS_DICT
+        # Only the poller state is read before the run stops
+        mock_s3_constructor.assert_called_once_with(
+            "test_s3_bucket", "test_s3_resource"
         )
-        mocked_all_sites_method.assert_called_once_with(date(2023, 12, 31), 0)
+        mock_s3_client.set_cache.assert_not_called()
         mock_s3_client.close.assert_called_once()
-        mocked_broken_orbits_method.assert_called_once_with(
-            date(2023, 12, 2), date(2023, 12, 30)
+        mocked_close_method.assert_called_once()
+        mocked_all_sites_method.assert_not_called()
+        mock_avro_encoder.assert_not_called()
+        mock_kinesis_client.assert_not_called()
+        mock_redshift_client.assert_not_called()
+
+    def test_run_skip_recovery(self, mock_logger, mocker):
+        mocker.patch.dict(os.environ, {"SKIP_RECOVERY": "True"})
+        mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
+        mocker.patch("lib.pipeline_controller.KinesisClient")
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController.get_location_hours_dict",
+            return_value=_TEST_LOCATION_HOURS_DICT,
+        )
+        mocked_all_sites_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_all_sites_data"
+        )
+        mocked_broken_orbits_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_broken_orbits"
+        )
+        mocker.patch("lib.ShopperTrakApiClient.close")
+        mock_s3_client = mocker.MagicMock()
+        mock_s3_client.fetch_cache.return_value = {"last_poll_date": "2023-12-29"}
+        mocker.patch("lib.pipeline_controller.S3Client", return_value=mock_s3_client)
+
+        test_instance = PipelineController()
+        test_instance.run()
+
+        mocked_all_sites_method.assert_called_once_with(
+            date(2023, 12, 29), date(2023, 12, 31)
+        )
+        mocked_broken_orbits_method.assert_not_called()
+        mock_s3_client.close.assert_called_once()
+        # The all sites list is only needed for recovery
+        assert "s3.fetch_all_sites" not in test_instance.metrics.summary()["timers"]
+
+    def test_run_bootstrap_error(self, mock_logger, mocker):
+        mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
+        mocker.patch("lib.pipeline_controller.KinesisClient")
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController.get_location_hours_dict",
+            side_effect=ConnectionError("Redshift is down"),
+        )
+        mocked_all_sites_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_all_sites_data"
+        )
+        mock_s3_client = mocker.MagicMock()
+        mock_s3_client.fetch_cache.return_value = {"last_poll_date": "2023-12-29"}
+        mocker.patch("lib.pipeline_controller.S3Client", return_value=mock_s3_client)
+
+        with pytest.raises(BootstrapError) as e:
+            PipelineController().run()
+
+        assert e.value.message == "Failed to load location_hours: Redshift is down"
+        mocked_all_sites_method.assert_not_called()
+        mock_s3_client.close.assert_called()
+
+    def test_run_bootstrap_error_closes_redshift(self, mock_logger, mocker):
+        mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
+        mocker.patch("lib.pipeline_controller.KinesisClient")
+        mocker.patch("nypl_py_utils.classes.redshift_client.RedshiftClient")
+        mocker.patch("lib.pipeline_controller.S3Client")
+        mocker.patch("lib.pipeline_controller.ShopperTrakApiClient")
+
+        def connect_and_fail(controller):
+            controller.redshift_client.connect()
+            raise ConnectionError("Query timed out")
+
+        mocker.patch.object(
+            PipelineController,
+            "get_location_hours_dict",
+            autospec=True,
+            side_effect=connect_and_fail,
+        )
+        test_instance = PipelineController()
+        test_instance.redshift_client.close_connection.side_effect = Exception(
+            "Already closed"
+        )
+
+        with pytest.raises(BootstrapError) as e:
+            test_instance.run()
+
+        # Errors closing the clients don't hide the BootstrapError
+        assert e.value.message == "Failed to load location_hours: Query timed out"
+        test_instance.redshift_client.close_connection.assert_called_once()
+        test_instance.shoppertrak_api_client.close.assert_called_once()
+
+    def test_emit_metrics(self, test_instance, mocker, capsys):
+        mocker.patch.dict(os.environ, {"ENVIRONMENT": "test"})
+        test_instance.metrics.record_time("redshift.execute_query", 2.5)
+        test_instance.metrics.increment("avro.records_encoded", 10)
+
+        test_instance._emit_metrics()
+        assert capsys.readouterr().out == ""
+
+        test_instance.emit_emf_metrics = True
+        test_instance._emit_metrics()
+
+        emf_line = json.loads(capsys.readouterr().out)
+        assert emf_line["_aws"]["CloudWatchMetrics"][0]["Namespace"] == (
+            "LocationVisitsPoller"
+        )
+        assert emf_line["Environment"] == "test"
+        assert emf_line["redshift.execute_query.seconds"] == 2.5
+        assert emf_line["avro.records_encoded"] == 10
+
+    def test_run_quota_exhausted(self, mock_logger, mocker):
+        mocker.patch.dict(os.environ, {"SHOPPERTRAK_DAILY_LIMIT": "100"})
+        mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
+        mocker.patch("lib.pipeline_controller.KinesisClient")
+        mocker.patch("nypl_py_utils.classes.redshift_client.RedshiftClient")
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController.get_location_hours_dict",
+            return_value=_TEST_LOCATION_HOURS_DICT,
+        )
+        mocked_all_sites_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_all_sites_data",
+            side_effect=QuotaExhaustedError("Daily ShopperTrak API budget used up"),
+        )
+        mocked_broken_orbits_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_broken_orbits"
+        )
+        mocker.patch("lib.ShopperTrakApiClient.close")
+        mock_all_sites_s3_client = mocker.MagicMock()
+        mock_all_sites_s3_client.fetch_cache.return_value = ["aa", "bb"]
+        mock_s3_client = mocker.MagicMock()
+        mock_s3_client.fetch_cache.return_value = {
+            "last_poll_date": "2023-12-29",
+            "api_quota": {"day": "2024-01-02", "used": 95},
+        }
+        mocker.patch(
+            "lib.pipeline_controller.S3Client",
+            side_effect=[mock_s3_client, mock_all_sites_s3_client],
+        )
+
+        test_instance = PipelineController()
+        assert test_instance.shoppertrak_api_client.quota_budget is (
+            test_instance.quota_budget
+        )
+        test_instance.run()
+
+        # The run stops cleanly, still saving its API usage
+        mocked_all_sites_method.assert_called_once_with(
+            date(2023, 12, 29), date(2023, 12, 31)
+        )
+        mocked_broken_orbits_method.assert_not_called()
+        mock_s3_client.set_cache.assert_called_once_with(
+            {
+                "last_poll_date": "2023-12-29",
+                "api_quota": {"day": "2024-01-02", "used": 95},
+            }
+        )
+        mock_s3_client.close.assert_called_once()
+        test_instance.kinesis_sender.kinesis_client.close.assert_called_once()
+
+    def test_run_async_client(self, mock_logger, mocker):
+        mocker.patch.dict(os.environ, {"ASYNC_CLIENT": "True"})
+        mocker.patch("lib.cached_avro_encoder.CachedAvroEncoder")
+        mocker.patch("lib.pipeline_controller.KinesisClient")
+        mocker.patch("nypl_py_utils.classes.redshift_client.RedshiftClient")
+        mocked_close_method = mocker.patch(
+            "lib.async_shoppertrak_api_client.AsyncShopperTrakApiClient.close"
+        )
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController.get_location_hours_dict",
+            return_value=_TEST_LOCATION_HOURS_DICT,
+        )
+        mocked_async_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_all_data_async"
+        )
+        mocked_all_sites_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_all_sites_data"
+        )
+        mocked_broken_orbits_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController.process_broken_orbits"
+        )
+        mock_all_sites_s3_client = mocker.MagicMock()
+        mock_all_sites_s3_client.fetch_cache.return_value = ["aa", "bb"]
+        mock_s3_client = mocker.MagicMock()
+        mock_s3_client.fetch_cache.return_value = {"last_poll_date": "2023-12-29"}
+        mocker.patch(
+            "lib.pipeline_controller.S3Client",
+            side_effect=[mock_s3_client, mock_all_sites_s3_client],
+        )
+
+        test_instance = PipelineController()
+        assert isinstance(
+            test_instance.shoppertrak_api_client, AsyncShopperTrakApiClient
+        )
+        test_instance.run()
+
+        mocked_async_method.assert_awaited_once_with(
+            date(2023, 12, 29), date(2023, 12, 31), date(2023, 12, 2)
+        )
+        mocked_all_sites_method.assert_not_called()
+        mocked_broken_orbits_method.assert_not_called()
+        mocked_close_method.assert_called_once()
+
+    def test_plan_all_sites_data(self, test_instance, mock_logger):
+        assert test_instance._plan_all_sites_data(
+            date(2023, 12, 20), date(2023, 12, 31)
+        ) == date(2023, 12, 31)
+
+        test_instance.quota_budget = QuotaBudget(10, reserve=2)
+        test_instance.quota_budget.load({"day": "2024-01-02", "used": 5})
+
+        assert test_instance._plan_all_sites_data(
+            date(2023, 12, 20), date(2023, 12, 31)
+        ) == date(2023, 12, 23)
+        assert test_instance._plan_all_sites_data(
+            date(2023, 12, 29), date(2023, 12, 31)
+        ) == date(2023, 12, 31)
+
+    def test_plan_recovery(self, test_instance, mock_logger):
+        missing = [("aa", date(2023, 12, 2)), ("bb", date(2023, 12, 1))]
+        unhealthy = [
+            ("aa", date(2023, 12, 3)),
+            ("cc", date(2023, 12, 1)),
+            ("bb", date(2023, 12, 4)),
+        ]
+        assert test_instance._plan_recovery(missing, unhealthy) == (missing, unhealthy)
+
+        test_instance.quota_budget = QuotaBudget(4)
+        test_instance.quota_budget.load({"day": "2024-01-02", "used": 1})
+
+        # Missing data comes first, then the most recent unhealthy data
+        assert test_instance._plan_recovery(missing, unhealthy) == (
+            missing,
+            [("bb", date(2023, 12, 4))],
+        )
+
+        test_instance.quota_budget.load({"day": "2024-01-02", "used": 3})
+        assert test_instance._plan_recovery(missing, unhealthy) == (
+            [("aa", date(2023, 12, 2))],
+            [],
+        )
+
+    def test_set_poll_date_with_quota(self, test_instance):
+        test_instance.quota_budget = QuotaBudget(10)
+        test_instance.quota_budget.try_acquire()
+
+        test_instance._set_poll_date(date(2023, 12, 31))
+
+        test_instance.s3_client.set_cache.assert_called_once_with(
+            {
+                "last_poll_date": "2023-12-31",
+                "api_quota": {"day": "2024-01-02", "used": 1},
+            }
         )
-        test_instance.kinesis_client.close.assert_called_once()
 
     def test_get_location_hours_dict(self, test_instance, mock_logger, mocker):
         mocked_hours_query = mocker.patch(
@@ -181,25 +538,23 @@ class TestPipelineController:
     ):
         TEST_API_DATA = _build_test_api_data("2023-12-31", False)
 
-        test_instance.s3_client.fetch_cache.side_effect = [
-            {"last_poll_date": "2023-12-30"},
-            {"last_poll_date": "2023-12-31"},
-        ]
         test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
         test_instance.shoppertrak_api_client.parse_response.return_value = TEST_API_DATA
-        test_instance.avro_encoder.encode_batch.return_value = _TEST_ENCODED_RECORDS
+        test_instance.avro_encoder.encode_rows.return_value = _TEST_ENCODED_RECORDS
 
-        test_instance.process_all_sites_data(date(2023, 12, 31), 0)
+        test_instance.process_all_sites_data(date(2023, 12, 30), date(2023, 12, 31))
 
-        assert test_instance.s3_client.fetch_cache.call_count == 2
+        test_instance.s3_client.fetch_cache.assert_not_called()
         test_instance.shoppertrak_api_client.query.assert_called_once_with(
             "allsites", date(2023, 12, 31)
         )
         test_instance.shoppertrak_api_client.parse_response.assert_called_once_with(
             _TEST_XML_ROOT, date(2023, 12, 31)
         )
-        test_instance.avro_encoder.encode_batch.assert_called_once_with(TEST_API_DATA)
-        test_instance.kinesis_client.send_records.assert_called_once_with(
+        test_instance.avro_encoder.encode_rows.assert_called_once_with(
+            TEST_API_DATA, LocationVisitsRow._fields, _TEST_ENCODING_CONSTANTS
+        )
+        test_instance.kinesis_sender.send_records.assert_called_once_with(
             _TEST_ENCODED_RECORDS
         )
         test_instance.s3_client.set_cache.assert_called_once_with(
@@ -207,17 +562,11 @@ class TestPipelineController:
         )
 
     def test_process_all_sites_data_multi_run(self, test_instance, mock_logger, mocker):
-        test_instance.s3_client.fetch_cache.side_effect = [
-            {"last_poll_date": "2023-12-28"},
-            {"last_poll_date": "2023-12-29"},
-            {"last_poll_date": "2023-12-30"},
-            {"last_poll_date": "2023-12-31"},
-        ]
         test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
 
-        test_instance.process_all_sites_data(date(2023, 12, 31), 0)
+        test_instance.process_all_sites_data(date(2023, 12, 28), date(2023, 12, 31))
 
-        assert test_instance.s3_client.fetch_cache.call_count == 4
+        test_instance.s3_client.fetch_cache.assert_not_called()
         test_instance.shoppertrak_api_client.query.assert_has_calls(
             [
                 mocker.call("allsites", date(2023, 12, 29)),
@@ -233,101 +582,215 @@ class TestPipelineController:
             ]
         )
 
-    def test_process_all_sites_error(self, test_instance, mock_logger, mocker, caplog):
-        test_instance.s3_client.fetch_cache.return_value = {
-            "last_poll_date": "2023-12-30"
+    def test_process_all_sites_data_checkpoint_days(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.checkpoint_days = 2
+        test_instance.poller_state = {"last_poll_date": "2023-12-26", "other": 1}
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+
+        test_instance.process_all_sites_data(date(2023, 12, 26), date(2023, 12, 31))
+
+        assert test_instance.shoppertrak_api_client.query.call_count == 5
+        assert test_instance.s3_client.set_cache.call_count == 3
+        assert test_instance.poller_state == {
+            "last_poll_date": "2023-12-31",
+            "other": 1,
         }
+
+    def test_process_all_sites_data_checkpoint_seconds(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.checkpoint_days = 100
+        test_instance.checkpoint_seconds = 60
+        mocker.patch(
+            "lib.pipeline_controller.time.monotonic",
+            side_effect=[0, 30, 90, 100, 110, 120, 130],
+        )
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+
+        test_instance.process_all_sites_data(date(2023, 12, 27), date(2023, 12, 31))
+
+        test_instance.s3_client.set_cache.assert_has_calls(
+            [
+                mocker.call({"last_poll_date": "2023-12-29"}),
+                mocker.call({"last_poll_date": "2023-12-31"}),
+            ]
+        )
+        assert test_instance.s3_client.set_cache.call_count == 2
+
+    def test_process_all_sites_data_long_backfill(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.checkpoint_days = 500
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+
+        test_instance.process_all_sites_data(date(2018, 12, 31), date(2023, 12, 31))
+
+        assert test_instance.shoppertrak_api_client.query.call_count == 1826
+        assert test_instance.s3_client.set_cache.call_count == 4
+        test_instance.s3_client.set_cache.assert_called_with(
+            {"last_poll_date": "2023-12-31"}
+        )
+
+    def test_process_all_sites_data_concurrent(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.backfill_concurrency = 3
+        test_instance.checkpoint_days = 2
+        test_instance.shoppertrak_api_client.query.side_effect = (
+            lambda endpoint, poll_date: poll_date
+        )
+        test_instance.shoppertrak_api_client.parse_response.side_effect = (
+            lambda response, poll_date: [response]
+        )
+        test_instance.avro_encoder.encode_rows.side_effect = (
+            lambda results, field_names, constants: [results[0].isoformat()]
+        )
+
+        test_instance.process_all_sites_data(date(2023, 12, 21), date(2023, 12, 31))
+
+        assert test_instance.kinesis_sender.send_records.call_args_list == [
+            mocker.call([f"2023-12-{day}"]) for day in range(22, 32)
+        ]
+        test_instance.s3_client.set_cache.assert_has_calls(
+            [
+                mocker.call({"last_poll_date": "2023-12-23"}),
+                mocker.call({"last_poll_date": "2023-12-25"}),
+                mocker.call({"last_poll_date": "2023-12-27"}),
+                mocker.call({"last_poll_date": "2023-12-29"}),
+                mocker.call({"last_poll_date": "2023-12-31"}),
+            ]
+        )
+
+    def test_process_all_sites_data_pipeline_stats(self, test_instance, mocker, caplog):
+        test_instance.logger = logging.getLogger("test_pipeline_controller")
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+
+        with caplog.at_level(logging.INFO):
+            test_instance.process_all_sites_data(date(2023, 12, 28), date(2023, 12, 31))
+
+        assert "All sites pipeline stage stats" in caplog.text
+        for stage in ("fetch", "parse", "encode", "send"):
+            assert f'"{stage}": {{"items": 3' in caplog.text
+
+    def test_process_all_sites_data_concurrent_error(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.backfill_concurrency = 3
+        test_instance.checkpoint_days = 10
+        test_instance.shoppertrak_api_client.query.side_effect = (
+            lambda endpoint, poll_date: (
+                APIStatus.ERROR if poll_date == date(2023, 12, 25) else poll_date
+            )
+        )
+        test_instance.shoppertrak_api_client.parse_response.side_effect = (
+            lambda response, poll_date: [response]
+        )
+        test_instance.avro_encoder.encode_rows.side_effect = (
+            lambda results, field_names, constants: [results[0].isoformat()]
+        )
+
+        test_instance.process_all_sites_data(date(2023, 12, 21), date(2023, 12, 31))
+
+        # Later days may already have been retrieved, but they are never sent and the
+        # last poll date never moves past the failed day
+        assert test_instance.kinesis_sender.send_records.call_args_list == [
+            mocker.call(["2023-12-22"]),
+            mocker.call(["2023-12-23"]),
+            mocker.call(["2023-12-24"]),
+        ]
+        test_instance.s3_client.set_cache.assert_called_once_with(
+            {"last_poll_date": "2023-12-24"}
+        )
+
+    def test_process_all_sites_error(self, test_instance, mock_logger, mocker, caplog):
         test_instance.shoppertrak_api_client.query.return_value = APIStatus.ERROR
 
         with caplog.at_level(logging.WARNING):
-            test_instance.process_all_sites_data(date(2023, 12, 31), 0)
+            test_instance.process_all_sites_data(date(2023, 12, 30), date(2023, 12, 31))
 
         assert "Failed to retrieve all sites visits data" in caplog.text
-        test_instance.s3_client.fetch_cache.assert_called_once()
         test_instance.shoppertrak_api_client.query.assert_called_once_with(
             "allsites", date(2023, 12, 31)
         )
         test_instance.shoppertrak_api_client.parse_response.assert_not_called()
-        test_instance.avro_encoder.encode_batch.assert_not_called()
-        test_instance.kinesis_client.send_records.assert_not_called()
+        test_instance.avro_encoder.encode_rows.assert_not_called()
+        test_instance.kinesis_sender.send_records.assert_not_called()
         test_instance.s3_client.set_cache.assert_not_called()
 
-    def test_process_broken_orbits_no_missing_sites(
+    def test_process_all_sites_error_checkpoints_progress(
         self, test_instance, mock_logger, mocker
     ):
-        mocked_closures_query = mocker.patch(
-            "lib.pipeline_controller.build_redshift_closures_query",
-            return_value="CLOSURES",
-        )
-        mocked_found_sites_query = mocker.patch(
-            "lib.pipeline_controller.build_redshift_found_sites_query",
-            return_value="FOUND SITES",
+        test_instance.checkpoint_days = 10
+        test_instance.shoppertrak_api_client.query.side_effect = [
+            _TEST_XML_ROOT,
+            _TEST_XML_ROOT,
+            APIStatus.ERROR,
+        ]
+
+        test_instance.process_all_sites_data(date(2023, 12, 27), date(2023, 12, 31))
+
+        test_instance.s3_client.set_cache.assert_called_once_with(
+            {"last_poll_date": "2023-12-29"}
         )
-        mocked_create_table_query = mocker.patch(
-            "lib.pipeline_controller.build_redshift_create_table_query",
-            return_value="CREATE TABLE",
+
+    def test_process_all_sites_exception_checkpoints_progress(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.checkpoint_days = 10
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+        test_instance.kinesis_sender.send_records.side_effect = [
+            None,
+            Exception("Kinesis down"),
+        ]
+
+        with pytest.raises(Exception):
+            test_instance.process_all_sites_data(date(2023, 12, 27), date(2023, 12, 31))
+
+        test_instance.s3_client.set_cache.assert_called_once_with(
+            {"last_poll_date": "2023-12-28"}
         )
-        mocked_build_known_query = mocker.patch(
-            "lib.pipeline_controller.build_redshift_known_query",
-            return_value="KNOWN",
+
+    def test_process_broken_orbits_no_missing_sites(
+        self, test_instance, mock_logger, mocker
+    ):
+        mocked_discovery_query = mocker.patch(
+            "lib.pipeline_controller.build_redshift_discovery_query",
+            return_value="DISCOVERY",
         )
         mocked_recover_data_method = mocker.patch(
             "lib.pipeline_controller.PipelineController._recover_data"
         )
-        mocker.patch(
-            "lib.pipeline_controller.PipelineController._recover_and_send_json_data_to_s3"
+        test_instance.redshift_client.execute_query.return_value = (
+            _build_discovery_rows(
+                "found",
+                [
+                    (site_id, date(2023, 12, day))
+                    for day in (1, 2)
+                    for site_id in ("aa", "bb", "cc", "dd", "ee")
+                ],
+            )
+            + _build_discovery_rows("unhealthy", _TEST_RECOVERABLE_SITE_DATES)
+            + _TEST_KNOWN_DATA_ROWS
         )
-        test_instance.redshift_client.execute_query.side_effect = [
-            [],
-            (
-                ["aa", date(2023, 12, 1)],
-                ["bb", date(2023, 12, 1)],
-                ["cc", date(2023, 12, 1)],
-                ["dd", date(2023, 12, 1)],
-                ["ee", date(2023, 12, 1)],
-                ["aa", date(2023, 12, 2)],
-                ["bb", date(2023, 12, 2)],
-                ["cc", date(2023, 12, 2)],
-                ["dd", date(2023, 12, 2)],
-                ["ee", date(2023, 12, 2)],
-            ),
-            _TEST_RECOVERABLE_SITE_DATES,
-            [k + v for k, v in _TEST_KNOWN_DATA_DICT.items()],
-        ]
 
         test_instance.process_broken_orbits(date(2023, 12, 1), date(2023, 12, 3))
 
         test_instance.redshift_client.connect.assert_called_once()
-        test_instance.redshift_client.execute_transaction.assert_has_calls(
-            [
-                mocker.call([("CREATE TABLE", None)]),
-                mocker.call([(REDSHIFT_DROP_QUERY, None)]),
-            ]
-        )
-        test_instance.redshift_client.execute_query.assert_has_calls(
-            [
-                mocker.call("CLOSURES"),
-                mocker.call("FOUND SITES"),
-                mocker.call(REDSHIFT_RECOVERABLE_QUERY),
-                mocker.call("KNOWN"),
-            ]
-        )
+        test_instance.redshift_client.execute_query.assert_called_once_with("DISCOVERY")
+        test_instance.redshift_client.execute_transaction.assert_not_called()
         test_instance.redshift_client.close_connection.assert_called_once()
-        mocked_closures_query.assert_called_once_with(
-            "location_closures_v2_test_redshift_name", date(2023, 12, 1)
-        )
-        mocked_found_sites_query.assert_called_once_with(
-            "location_visits_test_redshift_name", date(2023, 12, 1), date(2023, 12, 3)
-        )
-        mocked_create_table_query.assert_called_once_with(
-            "location_visits_test_redshift_name", date(2023, 12, 1), date(2023, 12, 3)
-        )
-        mocked_build_known_query.assert_called_once_with(
-            "location_visits_test_redshift_name"
+        mocked_discovery_query.assert_called_once_with(
+            "location_visits_test_redshift_name",
+            "location_closures_v2_test_redshift_name",
+            date(2023, 12, 1),
+            date(2023, 12, 3),
+            None,
         )
         mocked_recover_data_method.assert_called_once_with(
             [tuple(row) for row in _TEST_RECOVERABLE_SITE_DATES],
-            _TEST_KNOWN_DATA_DICT,
+            _TEST_KNOWN_DATA_INDEX,
         )
 
     def test_process_broken_orbits_missing_sites(
@@ -336,28 +799,39 @@ class TestPipelineController:
         mocked_recover_data_method = mocker.patch(
             "lib.pipeline_controller.PipelineController._recover_data"
         )
-        mocker.patch(
-            "lib.pipeline_controller.PipelineController._recover_and_send_json_data_to_s3"
+        # Unhealthy site/dates during closures have already been excluded by Redshift
+        test_instance.redshift_client.execute_query.return_value = (
+            _build_discovery_rows(
+                "closure",
+                [
+                    ("cc", date(2023, 12, 1)),
+                    ("ee", date(2023, 12, 2)),
+                    (None, date(2023, 12, 3)),
+                ],
+            )
+            + _build_discovery_rows(
+                "found",
+                [
+                    ("aa", date(2023, 12, 1)),
+                    ("bb", date(2023, 12, 1)),
+                    ("cc", date(2023, 12, 1)),
+                    ("dd", date(2023, 12, 1)),
+                    ("aa", date(2023, 12, 2)),
+                    ("bb", date(2023, 12, 2)),
+                    ("cc", date(2023, 12, 2)),
+                    ("bb", date(2023, 12, 3)),
+                ],
+            )
+            + _build_discovery_rows(
+                "unhealthy",
+                [
+                    ("aa", date(2023, 12, 2)),
+                    ("aa", date(2023, 12, 1)),
+                    ("bb", date(2023, 12, 1)),
+                ],
+            )
+            + _TEST_KNOWN_DATA_ROWS
         )
-        test_instance.redshift_client.execute_query.side_effect = [
-            (
-                ["cc", date(2023, 12, 1)],
-                ["ee", date(2023, 12, 2)],
-                [None, date(2023, 12, 3)],
-            ),
-            (
-                ["aa", date(2023, 12, 1)],
-                ["bb", date(2023, 12, 1)],
-                ["cc", date(2023, 12, 1)],
-                ["dd", date(2023, 12, 1)],
-                ["aa", date(2023, 12, 2)],
-                ["bb", date(2023, 12, 2)],
-                ["cc", date(2023, 12, 2)],
-                ["bb", date(2023, 12, 3)],
-            ),
-            _TEST_RECOVERABLE_SITE_DATES,
-            [k + v for k, v in _TEST_KNOWN_DATA_DICT.items()],
-        ]
 
         test_instance.process_broken_orbits(date(2023, 12, 1), date(2023, 12, 3))
 
@@ -367,7 +841,7 @@ class TestPipelineController:
             [
                 mocker.call(
                     [("ee", date(2023, 12, 1)), ("dd", date(2023, 12, 2))],
-                    dict(),
+                    KnownDataIndex(),
                     is_recovery_mode=False,
                 ),
                 mocker.call(
@@ -376,15 +850,76 @@ class TestPipelineController:
                         ("bb", date(2023, 12, 1)),
                         ("aa", date(2023, 12, 2)),
                     ],
-                    _TEST_KNOWN_DATA_DICT,
+                    _TEST_KNOWN_DATA_INDEX,
+                ),
+            ]
+        )
+
+    def test_process_broken_orbits_profiled(self, test_instance, mock_logger, mocker):
+        mocker.patch("lib.pipeline_controller.PipelineController._recover_data")
+        test_instance.profiler = mocker.MagicMock()
+        test_instance.redshift_client.execute_query.return_value = (
+            _build_discovery_rows("found", [("aa", date(2023, 12, 1))])
+            + _build_discovery_rows("unhealthy", [("aa", date(2023, 12, 1))])
+            + _TEST_KNOWN_DATA_ROWS
+        )
+
+        test_instance.process_broken_orbits(date(2023, 12, 1), date(2023, 12, 3))
+
+        assert [
+            profile_call.args
+            for profile_call in test_instance.profiler.profile.call_args_list
+        ] == [
+            ("discover_broken_orbits",),
+            ("missing_recovery",),
+            ("unhealthy_recovery",),
+        ]
+
+    def test_process_broken_orbits_missing_sites_in_redshift(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.compute_missing_in_redshift = True
+        test_instance.all_site_ids = {"aa", "b'b"}
+        mocked_recover_data_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController._recover_data"
+        )
+        test_instance.redshift_client.execute_query.return_value = (
+            _build_discovery_rows(
+                "missing", [("b'b", date(2023, 12, 2)), ("aa", date(2023, 12, 1))]
+            )
+            + _build_discovery_rows("unhealthy", [("aa", date(2023, 12, 2))])
+            + _TEST_KNOWN_DATA_ROWS
+        )
+
+        test_instance.process_broken_orbits(date(2023, 12, 1), date(2023, 12, 3))
+
+        discovery_query = test_instance.redshift_client.execute_query.call_args.args[0]
+        assert "SELECT 'aa' AS shoppertrak_site_id" in discovery_query
+        assert "UNION ALL SELECT 'b''b'" in discovery_query
+        assert "SELECT '2023-12-01'::DATE AS visits_date" in discovery_query
+        assert "UNION ALL SELECT '2023-12-02'::DATE" in discovery_query
+        assert "'2023-12-03'::DATE" not in discovery_query
+        assert "'found'" not in discovery_query
+        mocked_recover_data_method.assert_has_calls(
+            [
+                mocker.call(
+                    [("aa", date(2023, 12, 1)), ("b'b", date(2023, 12, 2))],
+                    KnownDataIndex(),
+                    is_recovery_mode=False,
                 ),
+                mocker.call([("aa", date(2023, 12, 2))], _TEST_KNOWN_DATA_INDEX),
             ]
         )
 
     def test_recover_data(self, test_instance, mock_logger, mocker):
         TEST_API_DATA = _build_test_api_data("2023-12-01", True)
+        mocker.patch(
+            "lib.pipeline_controller.uuid.uuid4",
+            side_effect=[uuid.UUID(int=i) for i in range(1, 5)],
+        )
 
         test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+        test_instance.shoppertrak_api_client.get_response_text.return_value = "xml"
         test_instance.shoppertrak_api_client.parse_response.side_effect = [
             TEST_API_DATA[:3],
             TEST_API_DATA[3:4],
@@ -392,7 +927,8 @@ class TestPipelineController:
             [],
         ]
         mocked_process_recovered_data_method = mocker.patch(
-            "lib.pipeline_controller.PipelineController._process_recovered_data"
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            return_value=[],
         )
 
         test_instance._recover_data(
@@ -402,7 +938,7 @@ class TestPipelineController:
                 ("cc", date(2023, 12, 1)),
                 ("aa", date(2023, 12, 2)),
             ],
-            _TEST_KNOWN_DATA_DICT,
+            _TEST_KNOWN_DATA_INDEX,
         )
 
         test_instance.shoppertrak_api_client.query.assert_has_calls(
@@ -423,12 +959,60 @@ class TestPipelineController:
         )
         mocked_process_recovered_data_method.assert_has_calls(
             [
-                mocker.call(TEST_API_DATA[:3], _TEST_KNOWN_DATA_DICT),
-                mocker.call(TEST_API_DATA[3:4], _TEST_KNOWN_DATA_DICT),
-                mocker.call(TEST_API_DATA[4:], _TEST_KNOWN_DATA_DICT),
-                mocker.call([], _TEST_KNOWN_DATA_DICT),
+                mocker.call(TEST_API_DATA[:3], _TEST_KNOWN_DATA_INDEX),
+                mocker.call(TEST_API_DATA[3:4], _TEST_KNOWN_DATA_INDEX),
+                mocker.call(TEST_API_DATA[4:], _TEST_KNOWN_DATA_INDEX),
+                mocker.call([], _TEST_KNOWN_DATA_INDEX),
             ]
         )
+        # Responses saved in the same second for the same date get different keys
+        assert test_instance.data_lake_s3_client.put_object.call_args_list == [
+            mocker.call(
+                Key="test_data_lake_resource2023/12/01/aa_1704168000_"
+                + "0" * 31
+                + "1.xml",
+                Body=b"xml",
+            ),
+            mocker.call(
+                Key="test_data_lake_resource2023/12/01/bb_1704168000_"
+                + "0" * 31
+                + "2.xml",
+                Body=b"xml",
+            ),
+            mocker.call(
+                Key="test_data_lake_resource2023/12/01/cc_1704168000_"
+                + "0" * 31
+                + "3.xml",
+                Body=b"xml",
+            ),
+            mocker.call(
+                Key="test_data_lake_resource2023/12/02/aa_1704168000_"
+                + "0" * 31
+                + "4.xml",
+                Body=b"xml",
+            ),
+        ]
+
+    def test_recover_data_cached_response(self, test_instance, mock_logger, mocker):
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+        test_instance.shoppertrak_api_client.is_cached_response.return_value = True
+        test_instance.shoppertrak_api_client.parse_response.return_value = []
+        mocked_process_recovered_data_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            return_value=[],
+        )
+
+        test_instance._recover_data([("aa", date(2023, 12, 1))], _TEST_KNOWN_DATA_INDEX)
+
+        # A cached response was saved to the data lake when it was first fetched
+        test_instance.shoppertrak_api_client.is_cached_response.assert_called_once_with(
+            _TEST_XML_ROOT
+        )
+        test_instance.shoppertrak_api_client.get_response_text.assert_not_called()
+        test_instance.data_lake_s3_client.put_object.assert_not_called()
+        mocked_process_recovered_data_method.assert_called_once_with(
+            [], _TEST_KNOWN_DATA_INDEX
+        )
 
     def test_recover_data_with_bad_poll_date(
         self, test_instance, mock_logger, mocker, caplog
@@ -449,7 +1033,8 @@ class TestPipelineController:
             TEST_API_DATA[4:],
         ]
         mocked_process_recovered_data_method = mocker.patch(
-            "lib.pipeline_controller.PipelineController._process_recovered_data"
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            return_value=[],
         )
 
         with caplog.at_level(logging.INFO):
@@ -460,7 +1045,7 @@ class TestPipelineController:
                     ("cc", date(2023, 12, 1)),
                     ("aa", date(2023, 12, 2)),
                 ],
-                _TEST_KNOWN_DATA_DICT,
+                _TEST_KNOWN_DATA_INDEX,
             )
 
         # Verify that although ShopperTrak returned APIStatus.Error, we
@@ -486,9 +1071,9 @@ class TestPipelineController:
         )
         mocked_process_recovered_data_method.assert_has_calls(
             [
-                mocker.call(TEST_API_DATA[:3], _TEST_KNOWN_DATA_DICT),
-                mocker.call(TEST_API_DATA[3:4], _TEST_KNOWN_DATA_DICT),
-                mocker.call(TEST_API_DATA[4:], _TEST_KNOWN_DATA_DICT),
+                mocker.call(TEST_API_DATA[:3], _TEST_KNOWN_DATA_INDEX),
+                mocker.call(TEST_API_DATA[3:4], _TEST_KNOWN_DATA_INDEX),
+                mocker.call(TEST_API_DATA[4:], _TEST_KNOWN_DATA_INDEX),
             ]
         )
 
@@ -499,7 +1084,8 @@ class TestPipelineController:
             _TEST_XML_ROOT,
         ]
         mocked_process_recovered_data_method = mocker.patch(
-            "lib.pipeline_controller.PipelineController._process_recovered_data"
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            return_value=[],
         )
 
         with caplog.at_level(logging.WARNING):
@@ -509,7 +1095,7 @@ class TestPipelineController:
                     ("bb", date(2023, 12, 1)),
                     ("aa", date(2023, 12, 2)),
                 ],
-                _TEST_KNOWN_DATA_DICT,
+                _TEST_KNOWN_DATA_INDEX,
             )
 
         assert "Failed to retrieve site visits data for bb" in caplog.text
@@ -522,35 +1108,307 @@ class TestPipelineController:
         assert mocked_process_recovered_data_method.call_count == 2
 
     def test_process_recovered_data(self, test_instance, mocker, caplog):
-        mocked_update_query = mocker.patch(
-            "lib.pipeline_controller.build_redshift_update_query",
-            return_value="UPDATE",
-        )
         TEST_API_DATA = _build_test_api_data("2023-12-01", True)
-        test_instance.avro_encoder.encode_batch.return_value = _TEST_ENCODED_RECORDS
+        test_instance.avro_encoder.encode_rows.return_value = _TEST_ENCODED_RECORDS
 
         with caplog.at_level(logging.WARNING):
-            test_instance._process_recovered_data(TEST_API_DATA, _TEST_KNOWN_DATA_DICT)
+            stale_ids = test_instance._process_recovered_data(
+                TEST_API_DATA, _TEST_KNOWN_DATA_INDEX
+            )
 
         assert (
             "Different healthy data found in API and Redshift: ('cc', 3, "
-            "FakeDatetime(2023, 12, 1, 9, 30)) mapped to {'shoppertrak_site_id': 'cc', "
-            "'orbit': 3, 'increment_start': '2023-12-01 09:30:00', 'enters': 0, "
-            "'exits': 0, 'is_healthy_data': True, 'is_missing_data': False, "
-            "'is_fresh': True, 'poll_date': '2024-01-01'} in the API and (96, True, "
-            "200, 201) in Redshift"
+            "'2023-12-01 09:30:00') mapped to LocationVisitsRow(shoppertrak_site_id="
+            "'cc', orbit=3, increment_start='2023-12-01 09:30:00', enters=0, "
+            "exits=0, is_healthy_data=True, is_missing_data=False, is_fresh=True, "
+            "poll_date='2024-01-01') in the API and (96, True, 200, 201) in Redshift"
         ) in caplog.text
         assert "aa" not in caplog.text
         assert "bb" not in caplog.text
-        mocked_update_query.assert_called_once_with(
-            "location_visits_test_redshift_name", "98,97"
+        assert stale_ids == ["98", "97"]
+        test_instance.redshift_client.execute_transaction.assert_not_called()
+        test_instance.avro_encoder.encode_rows.assert_called_once_with(
+            TEST_API_DATA[1:4], LocationVisitsRow._fields, _TEST_ENCODING_CONSTANTS
+        )
+        test_instance.kinesis_sender.send_records.assert_called_once_with(
+            _TEST_ENCODED_RECORDS
+        )
+        summary = test_instance.metrics.summary()
+        assert summary["timers"]["avro.encode"]["calls"] == 1
+        assert summary["timers"]["kinesis.send_records"]["calls"] == 1
+        assert summary["counters"]["avro.records_encoded"] == 3
+
+    def test_process_recovered_data_send_error(self, test_instance, mocker):
+        TEST_API_DATA = _build_test_api_data("2023-12-01", True)
+        test_instance.kinesis_sender.send_records.side_effect = Exception(
+            "Kinesis down"
+        )
+
+        with pytest.raises(Exception):
+            test_instance._process_recovered_data(TEST_API_DATA, _TEST_KNOWN_DATA_INDEX)
+
+        test_instance.redshift_client.execute_transaction.assert_not_called()
+
+    def test_update_stale_records(self, test_instance, mock_logger, mocker):
+        mocked_update_query = mocker.patch(
+            "lib.pipeline_controller.build_redshift_update_query",
+            side_effect=lambda table, ids: f"UPDATE {ids}",
+        )
+        test_instance.stale_update_batch_size = 2
+
+        test_instance._update_stale_records(["1", "2", "3", "4", "5"])
+
+        mocked_update_query.assert_has_calls(
+            [
+                mocker.call("location_visits_test_redshift_name", "1,2"),
+                mocker.call("location_visits_test_redshift_name", "3,4"),
+                mocker.call("location_visits_test_redshift_name", "5"),
+            ]
         )
         test_instance.redshift_client.execute_transaction.assert_called_once_with(
-            [("UPDATE", None)]
+            [("UPDATE 1,2", None), ("UPDATE 3,4", None), ("UPDATE 5", None)]
+        )
+
+    def test_update_stale_records_empty(self, test_instance, mock_logger):
+        test_instance._update_stale_records([])
+
+        test_instance.redshift_client.execute_transaction.assert_not_called()
+
+    def test_update_stale_records_ignore_update(self, test_instance, mock_logger):
+        test_instance.ignore_update = True
+
+        test_instance._update_stale_records(["1", "2"])
+
+        test_instance.redshift_client.execute_transaction.assert_not_called()
+
+    def test_recover_data_updates_stale_records_once(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            side_effect=[["1", "2"], [], ["3"]],
         )
-        test_instance.avro_encoder.encode_batch.assert_called_once_with(
-            TEST_API_DATA[1:4]
+        mocked_update_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController._update_stale_records"
         )
-        test_instance.kinesis_client.send_records.assert_called_once_with(
-            _TEST_ENCODED_RECORDS
+
+        test_instance._recover_data(
+            [
+                ("aa", date(2023, 12, 1)),
+                ("bb", date(2023, 12, 1)),
+                ("aa", date(2023, 12, 2)),
+            ],
+            _TEST_KNOWN_DATA_INDEX,
+        )
+
+        mocked_update_method.assert_called_once_with(["1", "2", "3"])
+
+    def test_recover_data_error_updates_sent_stale_records(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            side_effect=[["1", "2"], Exception("Kinesis down")],
+        )
+        mocked_update_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController._update_stale_records"
+        )
+
+        with pytest.raises(Exception):
+            test_instance._recover_data(
+                [
+                    ("aa", date(2023, 12, 1)),
+                    ("bb", date(2023, 12, 1)),
+                    ("aa", date(2023, 12, 2)),
+                ],
+                _TEST_KNOWN_DATA_INDEX,
+            )
+
+        # Only the ids whose replacement records were sent are marked as stale
+        mocked_update_method.assert_called_once_with(["1", "2"])
+
+    def test_recover_data_error_keeps_original_error(
+        self, test_instance, mocker, caplog
+    ):
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            side_effect=[["1", "2"], ValueError("Kinesis down")],
+        )
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._update_stale_records",
+            side_effect=Exception("Redshift down"),
+        )
+
+        with pytest.raises(ValueError, match="Kinesis down"):
+            test_instance._recover_data(
+                [("aa", date(2023, 12, 1)), ("bb", date(2023, 12, 1))],
+                _TEST_KNOWN_DATA_INDEX,
+            )
+
+        assert "Failed to update 2 stale records: Redshift down" in caplog.text
+
+    def test_recover_data_async_error_keeps_original_error(
+        self, test_instance, mocker, caplog
+    ):
+        test_instance.shoppertrak_api_client.query = mocker.AsyncMock(
+            return_value=_TEST_XML_ROOT
+        )
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            side_effect=[["1", "2"], ValueError("Kinesis down")],
+        )
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._update_stale_records",
+            side_effect=Exception("Redshift down"),
+        )
+
+        with pytest.raises(ValueError, match="Kinesis down"):
+            asyncio.run(
+                test_instance._recover_data_async(
+                    [("aa", date(2023, 12, 1)), ("bb", date(2023, 12, 1))],
+                    _TEST_KNOWN_DATA_INDEX,
+                )
+            )
+
+        assert "Failed to update 2 stale records: Redshift down" in caplog.text
+
+    def test_recover_data_update_error(self, test_instance, mock_logger, mocker):
+        test_instance.shoppertrak_api_client.query.return_value = _TEST_XML_ROOT
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            return_value=["1"],
+        )
+        mocker.patch(
+            "lib.pipeline_controller.PipelineController._update_stale_records",
+            side_effect=Exception("Redshift down"),
+        )
+
+        # Errors updating stale records after a successful pass are still thrown
+        with pytest.raises(Exception, match="Redshift down"):
+            test_instance._recover_data(
+                [("aa", date(2023, 12, 1))], _TEST_KNOWN_DATA_INDEX
+            )
+
+    def test_recover_data_concurrent(self, test_instance, mock_logger, mocker):
+        test_instance.recovery_workers = 3
+        site_dates = [
+            ("aa", date(2023, 12, 1)),
+            ("bb", date(2023, 12, 1)),
+            ("cc", date(2023, 12, 1)),
+            ("aa", date(2023, 12, 2)),
+            ("bb", date(2023, 12, 2)),
+        ]
+        test_instance.shoppertrak_api_client.query.side_effect = (
+            lambda endpoint, visits_date: (
+                APIStatus.ERROR if endpoint == "site/cc" else (endpoint, visits_date)
+            )
+        )
+        test_instance.shoppertrak_api_client.parse_response.side_effect = (
+            lambda response, visits_date, is_recovery_mode: [response]
+        )
+        mocked_process_recovered_data_method = mocker.patch(
+            "lib.pipeline_controller.PipelineController._process_recovered_data",
+            return_value=[],
+        )
+
+        test_instance._recover_data(site_dates, _TEST_KNOWN_DATA_INDEX)
+
+        assert test_instance.shoppertrak_api_client.query.call_count == 5
+        assert mocked_process_recovered_data_method.call_args_list == [
+            mocker.call([("site/aa", date(2023, 12, 1))], _TEST_KNOWN_DATA_INDEX),
+            mocker.call([("site/bb", date(2023, 12, 1))], _TEST_KNOWN_DATA_INDEX),
+            mocker.call([("site/aa", date(2023, 12, 2))], _TEST_KNOWN_DATA_INDEX),
+            mocker.call([("site/bb", date(2023, 12, 2))], _TEST_KNOWN_DATA_INDEX),
+        ]
+
+    def _set_up_async_client(self, test_instance, mocker, query):
+        test_instance.shoppertrak_api_client.query = mocker.AsyncMock(side_effect=query)
+        test_instance.shoppertrak_api_client.get_response_text.return_value = "xml"
+        test_instance.shoppertrak_api_client.parse_response.return_value = (
+            _build_test_api_data("2023-12-01", True)
+        )
+        test_instance.avro_encoder.encode_rows.return_value = _TEST_ENCODED_RECORDS
+        test_instance.redshift_client.execute_query.return_value = (
+            _build_discovery_rows(
+                "found",
+                [(site_id, date(2023, 12, 1)) for site_id in ("aa", "cc", "dd", "ee")],
+            )
+            + _build_discovery_rows("unhealthy", [("aa", date(2023, 12, 1))])
+            + _TEST_KNOWN_DATA_ROWS
+        )
+
+    def test_process_all_data_async(self, test_instance, mock_logger, mocker):
+        self._set_up_async_client(
+            test_instance, mocker, lambda endpoint, visits_date: _TEST_XML_ROOT
+        )
+
+        asyncio.run(
+            test_instance._process_all_data_async(
+                date(2023, 12, 1), date(2023, 12, 3), date(2023, 12, 1)
+            )
+        )
+
+        # All sites data and recovered data are queried on the same event loop
+        assert sorted(
+            call.args
+            for call in test_instance.shoppertrak_api_client.query.call_args_list
+        ) == [
+            ("allsites", date(2023, 12, 2)),
+            ("allsites", date(2023, 12, 3)),
+            ("site/aa", date(2023, 12, 1)),
+            ("site/bb", date(2023, 12, 1)),
+        ]
+        test_instance.shoppertrak_api_client.__aenter__.assert_awaited_once()
+        test_instance.shoppertrak_api_client.__aexit__.assert_awaited_once()
+        assert test_instance.kinesis_sender.send_records.call_count == 4
+        assert test_instance.data_lake_s3_client.put_object.call_count == 2
+        test_instance.s3_client.set_cache.assert_called_with(
+            {"last_poll_date": "2023-12-03"}
+        )
+        test_instance.redshift_client.connect.assert_called_once()
+        test_instance.redshift_client.execute_transaction.assert_called_once()
+        test_instance.redshift_client.close_connection.assert_called_once()
+
+    def test_process_all_data_async_skip_recovery(
+        self, test_instance, mock_logger, mocker
+    ):
+        test_instance.skip_recovery = True
+        self._set_up_async_client(
+            test_instance, mocker, lambda endpoint, visits_date: _TEST_XML_ROOT
+        )
+
+        asyncio.run(
+            test_instance._process_all_data_async(
+                date(2023, 12, 1), date(2023, 12, 3), date(2023, 12, 1)
+            )
         )
+
+        assert [
+            call.args
+            for call in test_instance.shoppertrak_api_client.query.call_args_list
+        ] == [("allsites", date(2023, 12, 2)), ("allsites", date(2023, 12, 3))]
+        test_instance.redshift_client.connect.assert_not_called()
+
+    def test_process_all_data_async_error(self, test_instance, mock_logger, mocker):
+        def query(endpoint, visits_date):
+            if endpoint == "allsites":
+                raise ShopperTrakApiClientError("Failed to retrieve response")
+            return _TEST_XML_ROOT
+
+        self._set_up_async_client(test_instance, mocker, query)
+
+        with pytest.raises(ShopperTrakApiClientError):
+            asyncio.run(
+                test_instance._process_all_data_async(
+                    date(2023, 12, 1), date(2023, 12, 3), date(2023, 12, 1)
+                )
+            )
+
+        # Recovery still finishes even though polling all sites data failed
+        assert test_instance.kinesis_sender.send_records.call_count == 2
+        test_instance.s3_client.set_cache.assert_not_called()
+        test_instance.redshift_client.execute_transaction.assert_called_once()
+        test_instance.shoppertrak_api_client.__aexit__.assert_awaited_once()
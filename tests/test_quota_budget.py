@@ -0,0 +1,58 @@
+import pytest
+
+from freezegun import freeze_time
+from lib.quota_budget import QuotaBudget
+
+
+class TestQuotaBudget:
+
+    @pytest.fixture
+    def test_instance(self):
+        return QuotaBudget(10, reserve=2)
+
+    def test_load_same_day(self, test_instance):
+        # 2024-01-01 23:00 in New York is already 2024-01-02 in UTC
+        test_instance.load({"day": "2024-01-02", "used": 5})
+
+        assert test_instance.used == 5
+        assert test_instance.remaining == 3
+        assert test_instance.to_state() == {"day": "2024-01-02", "used": 5}
+
+    def test_load_previous_day(self, test_instance):
+        test_instance.load({"day": "2024-01-01", "used": 5})
+
+        assert test_instance.used == 0
+        assert test_instance.remaining == 8
+
+    def test_load_empty(self, test_instance):
+        test_instance.load(None)
+
+        assert test_instance.to_state() == {"day": "2024-01-02", "used": 0}
+
+    def test_try_acquire(self, test_instance):
+        assert all(test_instance.try_acquire() for _ in range(8))
+        assert not test_instance.try_acquire()
+        assert test_instance.used == 8
+        assert test_instance.remaining == 0
+
+    def test_exhaust(self, test_instance):
+        test_instance.exhaust()
+
+        assert test_instance.remaining == 0
+        assert not test_instance.try_acquire()
+
+    def test_roll_over(self, test_instance):
+        test_instance.exhaust()
+
+        with freeze_time("2024-01-03 01:00:00"):
+            assert test_instance.try_acquire()
+            assert test_instance.to_state() == {"day": "2024-01-03", "used": 1}
+
+    def test_plan(self, test_instance):
+        test_instance.load({"day": "2024-01-02", "used": 1})
+
+        assert test_instance.plan([("a", 3), ("b", 5), ("c", 2)]) == {
+            "a": 3,
+            "b": 4,
+            "c": 0,
+        }
@@ -0,0 +1,113 @@
+import pytest
+
+from datetime import date
+from freezegun import freeze_time
+from lib.blob_store import LocalBlobStore, S3BlobStore
+from lib.response_cache import (
+    build_response_cache,
+    DEFAULT_IMMUTABLE_AFTER_DAYS,
+    ResponseCache,
+)
+
+_TEST_PARAMS = {"date": "20231231", "detail": "entrance"}
+
+
+class TestResponseCache:
+
+    @pytest.fixture
+    def test_instance(self, tmp_path):
+        return build_response_cache(str(tmp_path), 12, 7)
+
+    def test_build_response_cache(self, tmp_path, mocker):
+        mocker.patch("lib.blob_store.boto3")
+
+        local_cache = build_response_cache(str(tmp_path), 12, 7)
+        assert type(local_cache) == ResponseCache
+        assert type(local_cache.store) == LocalBlobStore
+        assert local_cache.store.directory == str(tmp_path)
+
+        s3_cache = build_response_cache("s3://test_bucket/test/prefix/", 12, 7)
+        assert type(s3_cache.store) == S3BlobStore
+        assert s3_cache.store.bucket == "test_bucket"
+        assert s3_cache.store.prefix == "test/prefix/"
+
+    def test_get_miss(self, test_instance):
+        assert (
+            test_instance.get("service/site/aa", date(2023, 12, 31), _TEST_PARAMS)
+            is None
+        )
+        assert test_instance.hits == 0
+        assert test_instance.misses == 1
+
+    def test_set_and_get(self, test_instance):
+        test_instance.set("service/site/aa", date(2023, 12, 31), _TEST_PARAMS, "xml")
+
+        assert (
+            test_instance.get("service/site/aa", date(2023, 12, 31), _TEST_PARAMS)
+            == "xml"
+        )
+        assert (
+            test_instance.get("service/site/bb", date(2023, 12, 31), _TEST_PARAMS)
+            is None
+        )
+        assert (
+            test_instance.get("service/site/aa", date(2023, 12, 30), _TEST_PARAMS)
+            is None
+        )
+        assert (
+            test_instance.get(
+                "service/site/aa", date(2023, 12, 31), {"date": "20231231"}
+            )
+            is None
+        )
+        assert test_instance.hits == 1
+        assert test_instance.misses == 3
+
+    def test_get_expired(self, test_instance):
+        with freeze_time("2023-12-31 12:00:00"):
+            test_instance.set(
+                "service/site/aa", date(2023, 12, 30), _TEST_PARAMS, "xml"
+            )
+
+        assert (
+            test_instance.get("service/site/aa", date(2023, 12, 30), _TEST_PARAMS)
+            is None
+        )
+
+    def test_get_immutable(self, test_instance):
+        with freeze_time("2023-12-20 12:00:00"):
+            test_instance.set(
+                "service/site/aa", date(2023, 12, 19), _TEST_PARAMS, "xml"
+            )
+
+        assert (
+            test_instance.get("service/site/aa", date(2023, 12, 19), _TEST_PARAMS)
+            == "xml"
+        )
+
+    def test_get_recoverable_date_expires(self, tmp_path):
+        test_instance = build_response_cache(
+            str(tmp_path), 12, DEFAULT_IMMUTABLE_AFTER_DAYS
+        )
+        with freeze_time("2023-12-03 12:00:00"):
+            test_instance.set("service/site/aa", date(2023, 12, 2), _TEST_PARAMS, "xml")
+
+        assert (
+            test_instance.get("service/site/aa", date(2023, 12, 2), _TEST_PARAMS)
+            is None
+        )
+
+    def test_get_key(self, mocker):
+        mock_store = mocker.MagicMock()
+        mock_store.read.return_value = {
+            "fetched_at": "2024-01-02T03:00:00+00:00",
+            "response_text": "xml",
+        }
+        test_instance = ResponseCache(mock_store, 12, 7)
+
+        assert (
+            test_instance.get("service/site/aa", date(2023, 12, 31), _TEST_PARAMS)
+            == "xml"
+        )
+        key = mock_store.read.call_args.args[0]
+        assert key.startswith("service%2Fsite%2Faa/2023-12-31/")
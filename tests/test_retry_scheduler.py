@@ -0,0 +1,201 @@
+import asyncio
+import pytest
+import threading
+
+from lib.retry_scheduler import RetryScheduler
+
+
+class TestRetryScheduler:
+
+    @pytest.fixture
+    def test_instance(self):
+        return RetryScheduler(10, 100, 3)
+
+    def test_get_delay(self, test_instance):
+        for _ in range(20):
+            assert test_instance.get_delay(1) == 10
+            assert 20 <= test_instance.get_delay(3) <= 40
+            assert 50 <= test_instance.get_delay(10) <= 100
+
+    def test_back_off(self, test_instance, mocker):
+        mock_sleep = mocker.patch("time.sleep")
+
+        test_instance.back_off(1)
+        test_instance.back_off(2)
+
+        assert mock_sleep.call_args_list[0] == mocker.call(10)
+        assert 10 <= mock_sleep.call_args_list[1].args[0] <= 20
+        assert test_instance.metrics()["retry_attempts"] == 2
+        assert test_instance.metrics()["total_wait_seconds"] == pytest.approx(
+            sum(call.args[0] for call in mock_sleep.call_args_list), abs=0.001
+        )
+        assert test_instance.breaker_state == "closed"
+
+    def test_back_off_does_not_block_other_requests(self, test_instance, mocker):
+        def check_unlocked(seconds):
+            assert test_instance._lock.acquire(blocking=False)
+            test_instance._lock.release()
+
+        mocker.patch("time.sleep", side_effect=check_unlocked)
+
+        test_instance.back_off(1)
+
+    def test_wait_for_breaker_closed(self, test_instance, mocker):
+        mock_sleep = mocker.patch("time.sleep")
+
+        test_instance.back_off(1)
+        test_instance.wait_for_breaker()
+
+        assert mock_sleep.call_count == 1
+
+    def test_breaker_opens(self, test_instance, mocker, caplog):
+        mock_sleep = mocker.patch("time.sleep")
+
+        for attempt in range(1, 4):
+            test_instance.back_off(attempt)
+
+        assert test_instance.breaker_state == "open"
+        assert test_instance.breaker_opens == 1
+        assert "ShopperTrak turned away 3 requests in a row" in caplog.text
+
+        # Other requests wait for the rest of the backoff, then one probe is allowed
+        test_instance.wait_for_breaker()
+        assert mock_sleep.call_count == 4
+        assert test_instance.breaker_state == "half_open"
+
+    def test_breaker_reopens_after_failed_probe(self, test_instance, mocker):
+        mocker.patch("time.sleep")
+        for attempt in range(1, 4):
+            test_instance.back_off(attempt)
+        test_instance.wait_for_breaker()
+
+        test_instance.back_off(1)
+
+        assert test_instance.breaker_state == "open"
+        assert test_instance.breaker_opens == 2
+
+    def test_breaker_closes_after_success(self, test_instance, mocker):
+        mocker.patch("time.sleep")
+        for attempt in range(1, 4):
+            test_instance.back_off(attempt)
+        test_instance.wait_for_breaker()
+
+        test_instance.record_success()
+
+        assert test_instance.metrics() == {
+            "retry_attempts": 3,
+            "total_wait_seconds": pytest.approx(
+                test_instance.total_wait_seconds, abs=0.001
+            ),
+            "breaker_state": "closed",
+            "breaker_opens": 1,
+        }
+
+        # Busy responses must be consecutive for the breaker to open
+        test_instance.back_off(1)
+        test_instance.back_off(2)
+        assert test_instance.breaker_state == "closed"
+
+    def _start_waiters(self, test_instance, count):
+        sent = []
+        waiters = [
+            threading.Thread(
+                target=lambda: sent.append(test_instance.wait_for_breaker())
+            )
+            for _ in range(count)
+        ]
+        for waiter in waiters:
+            waiter.start()
+        return waiters, sent
+
+    def test_breaker_sends_single_probe(self, test_instance, mocker):
+        mocker.patch("time.sleep")
+        for attempt in range(1, 4):
+            test_instance.back_off(attempt)
+        test_instance.wait_for_breaker()
+
+        waiters, sent = self._start_waiters(test_instance, 3)
+        waiters[0].join(0.2)
+        assert sent == []
+        assert test_instance.breaker_state == "half_open"
+
+        test_instance.record_success()
+        for waiter in waiters:
+            waiter.join(5)
+        assert len(sent) == 3
+
+    def test_breaker_sends_single_probe_after_failed_probe(self, test_instance, mocker):
+        mocker.patch("time.sleep")
+        for attempt in range(1, 4):
+            test_instance.back_off(attempt)
+        test_instance.wait_for_breaker()
+        waiters, sent = self._start_waiters(test_instance, 3)
+
+        # The waiters wait out the new backoff, then exactly one of them is the probe
+        test_instance.back_off(1)
+        for _ in range(50):
+            if sent:
+                break
+            waiters[0].join(0.1)
+        waiters[0].join(0.2)
+        assert len(sent) == 1
+        assert test_instance.breaker_state == "half_open"
+
+        test_instance.record_success()
+        for waiter in waiters:
+            waiter.join(5)
+        assert len(sent) == 3
+
+    def test_breaker_replaces_unfinished_probe(self, test_instance, mocker, caplog):
+        mocker.patch("time.sleep")
+        mock_monotonic = mocker.patch("time.monotonic", return_value=1000)
+        for attempt in range(1, 4):
+            test_instance.back_off(attempt)
+        test_instance.wait_for_breaker()
+
+        mock_monotonic.return_value = 1100
+        test_instance.wait_for_breaker()
+
+        assert "Probe request never finished: sending another" in caplog.text
+        assert test_instance.breaker_state == "half_open"
+
+    def test_breaker_threshold_of_one(self, mocker):
+        mocker.patch("time.sleep")
+        test_instance = RetryScheduler(10, 100, 1)
+
+        test_instance.back_off(1)
+
+        assert test_instance.breaker_state == "open"
+
+    def test_wait_for_probe_async(self, test_instance, mocker):
+        mocker.patch("time.sleep")
+        for attempt in range(1, 4):
+            test_instance.back_off(attempt)
+        test_instance.wait_for_breaker()
+
+        async def finish_probe(seconds):
+            test_instance.record_success()
+
+        mock_sleep = mocker.patch(
+            "lib.retry_scheduler.asyncio.sleep", side_effect=finish_probe
+        )
+
+        asyncio.run(test_instance.wait_for_breaker_async())
+
+        mock_sleep.assert_called_once_with(1)
+        assert test_instance.breaker_state == "closed"
+
+    def test_back_off_async(self, test_instance, mocker):
+        mock_sleep = mocker.patch("lib.retry_scheduler.asyncio.sleep")
+
+        async def back_off_and_wait():
+            for attempt in range(1, 4):
+                await test_instance.back_off_async(attempt)
+            await test_instance.wait_for_breaker_async()
+
+        asyncio.run(back_off_and_wait())
+
+        assert mock_sleep.call_count == 4
+        assert mock_sleep.call_args_list[0] == mocker.call(10)
+        assert test_instance.breaker_state == "half_open"
+        assert test_instance.metrics()["retry_attempts"] == 3
@@ -0,0 +1,90 @@
+import pstats
+import pytest
+import tracemalloc
+
+from lib.run_profiler import RunProfiler, RunProfilerError
+
+
+def _parse_sites(num_sites):
+    return [{"site_id": f"aa{i}", "enters": i} for i in range(num_sites)]
+
+
+class TestRunProfiler:
+
+    @pytest.fixture
+    def test_instance(self, tmp_path):
+        return RunProfiler("cpu", str(tmp_path / "profiles"))
+
+    def test_init_bad_mode(self, tmp_path):
+        with pytest.raises(RunProfilerError):
+            RunProfiler("wall", str(tmp_path))
+
+    def test_cpu_profile(self, test_instance, tmp_path):
+        with test_instance.profile("all_sites"):
+            _parse_sites(10)
+        with test_instance.profile("unhealthy_recovery"):
+            sorted(range(10))
+        test_instance.save()
+
+        output_dir = tmp_path / "profiles" / "20240102T040000"
+        assert sorted(path.name for path in output_dir.iterdir()) == [
+            "cpu_all_sites.pstats",
+            "cpu_report.txt",
+            "cpu_run.pstats",
+            "cpu_unhealthy_recovery.pstats",
+        ]
+        stage_functions = {
+            function[2]
+            for function in pstats.Stats(str(output_dir / "cpu_all_sites.pstats")).stats
+        }
+        run_functions = {
+            function[2]
+            for function in pstats.Stats(str(output_dir / "cpu_run.pstats")).stats
+        }
+        assert "_parse_sites" in stage_functions
+        assert "<built-in method builtins.sorted>" not in stage_functions
+        assert {"_parse_sites", "<built-in method builtins.sorted>"} <= run_functions
+
+        report = (output_dir / "cpu_report.txt").read_text()
+        assert "==== all_sites ====" in report
+        assert "==== unhealthy_recovery ====" in report
+        assert "==== run ====" in report
+
+    def test_cpu_profile_records_errors(self, test_instance, tmp_path):
+        with pytest.raises(ValueError):
+            with test_instance.profile("missing_recovery"):
+                raise ValueError("bad response")
+
+        assert list(test_instance.stage_stats) == ["missing_recovery"]
+
+    def test_alloc_profile(self, tmp_path):
+        test_instance = RunProfiler("alloc", str(tmp_path))
+        assert tracemalloc.is_tracing()
+
+        with test_instance.profile("missing_recovery"):
+            sites = _parse_sites(1000)
+        test_instance.save()
+
+        assert not tracemalloc.is_tracing()
+        report = (tmp_path / "20240102T040000" / "alloc_report.txt").read_text()
+        assert report.startswith("Current traced memory: ")
+        assert "Peak traced memory: " in report
+        assert "==== missing_recovery: top net allocations ====" in report
+        assert "test_run_profiler.py" in report
+        assert len(sites) == 1000
+
+    def test_save_to_s3(self, mocker):
+        mock_boto3 = mocker.patch("lib.run_profiler.boto3")
+        test_instance = RunProfiler("cpu", "s3://test_bucket/test/profiles/")
+
+        with test_instance.profile("all_sites"):
+            _parse_sites(10)
+        test_instance.save()
+
+        mock_boto3.client.assert_called_once_with("s3", region_name="test_aws_region")
+        uploads = mock_boto3.client.return_value.upload_file.call_args_list
+        assert [upload.args[1:] for upload in uploads] == [
+            ("test_bucket", "test/profiles/20240102T040000/cpu_all_sites.pstats"),
+            ("test_bucket", "test/profiles/20240102T040000/cpu_run.pstats"),
+            ("test_bucket", "test/profiles/20240102T040000/cpu_report.txt"),
+        ]
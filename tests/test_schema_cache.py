@@ -0,0 +1,48 @@
+import pytest
+
+from lib.blob_store import LocalBlobStore, S3BlobStore
+from lib.schema_cache import build_schema_cache, SchemaCache
+
+_TEST_ENTRY = {
+    "schema": '{"type": "string"}',
+    "etag": '"v1"',
+    "fetched_at": "2024-01-02T03:00:00+00:00",
+}
+
+
+class TestSchemaCache:
+
+    @pytest.fixture
+    def test_instance(self, tmp_path):
+        return build_schema_cache(str(tmp_path / "avro" / "schema.json"))
+
+    def test_build_schema_cache(self, tmp_path, mocker):
+        mocker.patch("lib.blob_store.boto3")
+
+        local_cache = build_schema_cache(str(tmp_path / "schema.json"))
+        assert type(local_cache) == SchemaCache
+        assert type(local_cache.store) == LocalBlobStore
+        assert local_cache.store.directory == f"{tmp_path}/"
+        assert local_cache.key == "schema.json"
+
+        s3_cache = build_schema_cache("s3://test_bucket/test/schema.json")
+        assert type(s3_cache.store) == S3BlobStore
+        assert s3_cache.store.bucket == "test_bucket"
+        assert s3_cache.store.prefix == "test/"
+        assert s3_cache.key == "schema.json"
+
+    def test_read_missing(self, test_instance):
+        assert test_instance.read() is None
+
+    def test_write_and_read(self, test_instance, tmp_path):
+        test_instance.write(_TEST_ENTRY)
+
+        assert test_instance.read() == _TEST_ENTRY
+        assert (tmp_path / "avro" / "schema.json").exists()
+
+    def test_read_malformed(self, test_instance):
+        test_instance.write({"etag": '"v1"'})
+        assert test_instance.read() is None
+
+        test_instance.write(["not", "an", "entry"])
+        assert test_instance.read() is None
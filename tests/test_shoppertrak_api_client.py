@@ -1,11 +1,16 @@
 import logging
+import math
 import os
 import pytest
 import xml.etree.ElementTree as ET
 
 from copy import deepcopy
 from datetime import date, time
-from lib import APIStatus, ShopperTrakApiClient, ShopperTrakApiClientError
+from freezegun import freeze_time
+from lib import (
+    APIStatus, LocationVisitsRow, ShopperTrakApiClient, ShopperTrakApiClientError,
+    XMLResponseStream)
+from lib.quota_budget import QuotaBudget, QuotaExhaustedError
 from requests.exceptions import ConnectTimeout
 
 
@@ -48,7 +53,7 @@ _TEST_LOCATION_HOURS_DICT = {
     ("cc", "Sunday"): (None, None), ("cc", "Wednesday"): (time(12, 30), time(20, 30)), 
 }
 
-_PARSED_RESULT = [
+_PARSED_RESULT = [LocationVisitsRow(**row) for row in [
     {"shoppertrak_site_id": "aa", "orbit": 1, "increment_start": "2023-12-31 00:00:00",
      "enters": 0, "exits": 0, "is_healthy_data": True, "is_missing_data": False,
      "is_fresh": True, "poll_date": "2024-01-01"},
@@ -89,7 +94,7 @@ _PARSED_RESULT = [
      "increment_start": "2023-12-31 03:00:00", "enters": 0, "exits": 0,
      "is_healthy_data": False, "is_missing_data": False, "is_fresh": True,
      "poll_date": "2024-01-01"},
-]
+]]
 
 
 class TestPipelineController:
@@ -103,6 +108,15 @@ class TestPipelineController:
             [],
         )
 
+    @pytest.fixture
+    def mock_sleep(self, mocker):
+        # Like time.sleep, sleeping moves the clock forward by at least as long as
+        # was asked, so that backoffs end
+        with freeze_time("2024-01-01 23:00:00-05:00") as frozen_time:
+            yield mocker.patch(
+                "time.sleep",
+                side_effect=lambda seconds: frozen_time.tick(math.ceil(seconds)))
+
     def test_query(self, test_instance, requests_mock, mocker):
         requests_mock.get(
             "https://test_shoppertrak_url/service/test%20-%20endpoint%3B%20one"
@@ -118,6 +132,9 @@ class TestPipelineController:
 
         assert test_instance.query("test - endpoint; one", date(2023, 12, 31)) == xml_root
         mocked_check_response_method.assert_called_once_with(_TEST_API_RESPONSE, date(2023, 12, 31))
+        timers = test_instance.metrics.summary()["timers"]
+        assert timers["shoppertrak.request"]["calls"] == 1
+        assert timers["shoppertrak.check_response"]["calls"] == 1
 
     def test_query_request_exception(self, test_instance, requests_mock, mocker, caplog):
         requests_mock.get(
@@ -145,9 +162,8 @@ class TestPipelineController:
         assert test_instance.query(
             "test_endpoint", date(2023, 12, 31)) == APIStatus.ERROR
 
-    def test_query_retry_success(self, test_instance, requests_mock, mocker):
+    def test_query_retry_success(self, test_instance, requests_mock, mocker, mock_sleep):
         test_date = date(2023, 12, 31)
-        mock_sleep = mocker.patch("time.sleep")
         requests_mock.get(
             "https://test_shoppertrak_url/service/test_endpoint"
             "?date=20231231&increment=15&total_property_only=false&detail=entrance",
@@ -170,8 +186,9 @@ class TestPipelineController:
         )
         assert mock_sleep.call_count == 2
 
-    def test_query_retry_fail(self, test_instance, requests_mock, mocker, caplog):
-        mock_sleep = mocker.patch("time.sleep")
+    def test_query_retry_fail(
+        self, test_instance, requests_mock, mocker, mock_sleep, caplog
+    ):
         requests_mock.get(
             "https://test_shoppertrak_url/service/test_endpoint"
             "?date=20231231&increment=15&total_property_only=false&detail=entrance",
@@ -181,6 +198,7 @@ class TestPipelineController:
             "lib.ShopperTrakApiClient._check_response",
             return_value=(APIStatus.RETRY, None),
         )
+        test_instance.retry_budget_seconds = 0
 
         with pytest.raises(ShopperTrakApiClientError):
             test_instance.query("test_endpoint", date(2023, 12, 31))
@@ -189,6 +207,31 @@ class TestPipelineController:
         assert mocked_check_response_method.call_count == 3
         assert mock_sleep.call_count == 2
 
+    def test_query_retry_budget(
+        self, test_instance, requests_mock, mocker, mock_sleep, caplog
+    ):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text="error",
+        )
+        mocker.patch(
+            "lib.ShopperTrakApiClient._check_response",
+            return_value=(APIStatus.RETRY, None),
+        )
+        # The shortest possible delay is chosen for every retry
+        mocker.patch("lib.retry_scheduler.random.uniform", side_effect=min)
+
+        with pytest.raises(ShopperTrakApiClientError):
+            test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        waits = [call.args[0] for call in mock_sleep.call_args_list]
+        assert waits == [15, 15, 30, 60, 120, 150, 150, 150]
+        assert sum(waits) >= 600
+        assert "Hit retry limit: sent 9 queries with no response over 690 seconds" in (
+            caplog.text
+        )
+
     def test_query_bad_status(self, test_instance, requests_mock, mocker, caplog):
         requests_mock.get(
             "https://test_shoppertrak_url/service/test_endpoint"
@@ -225,6 +268,32 @@ class TestPipelineController:
                 mocker.MagicMock())
         assert "API limit exceeded" in caplog.text
 
+    def test_check_response_api_limit_with_budget(self, test_instance, mocker):
+        test_instance.quota_budget = QuotaBudget(100)
+
+        with pytest.raises(QuotaExhaustedError):
+            test_instance._check_response(
+                '<?xml version="1.0" ?><message><error>E107</error><description>'
+                'Customer has exceeded the maximum number of requests allowed in a 24 '
+                'hour period.</description></message>',
+                mocker.MagicMock())
+        assert test_instance.quota_budget.remaining == 0
+
+    def test_query_quota_exhausted(self, test_instance, requests_mock):
+        test_instance.quota_budget = QuotaBudget(1)
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE,
+        )
+
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+        with pytest.raises(QuotaExhaustedError):
+            test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        assert requests_mock.call_count == 1
+        assert test_instance.request_count == 1
+
     def test_check_response_down(self, test_instance, mocker, caplog):
         with caplog.at_level(logging.WARNING):
             status, root = test_instance._check_response(
@@ -294,6 +363,9 @@ class TestPipelineController:
                 ET.fromstring(_TEST_API_RESPONSE), date(2023, 12, 31)) == _PARSED_RESULT
 
         assert caplog.text == ""
+        summary = test_instance.metrics.summary()
+        assert summary["timers"]["shoppertrak.parse_response"]["calls"] == 1
+        assert summary["counters"]["shoppertrak.rows_parsed"] == 12
 
     def test_parse_response_recovery_mode(self, test_instance, caplog):
         _TEST_RESULT = _PARSED_RESULT[:6]
@@ -307,8 +379,8 @@ class TestPipelineController:
     
     def test_parse_response_closed_branch(self, test_instance, caplog):
         _TEST_RESULT = deepcopy(_PARSED_RESULT)
-        _TEST_RESULT[9]["is_missing_data"] = False
-        _TEST_RESULT[10]["is_missing_data"] = False
+        _TEST_RESULT[9] = _TEST_RESULT[9]._replace(is_missing_data=False)
+        _TEST_RESULT[10] = _TEST_RESULT[10]._replace(is_missing_data=False)
 
         _MODIFIED_LOCATION_HOURS_DICT = deepcopy(_TEST_LOCATION_HOURS_DICT)
         _MODIFIED_LOCATION_HOURS_DICT[("bb", "Sunday")] = (None, None)
@@ -340,7 +412,8 @@ class TestPipelineController:
             'enters="4" startTime="020000"', 'enters="4" startTime="010000"'
         )
         _TEST_RESULT = deepcopy(_PARSED_RESULT)
-        _TEST_RESULT[2]["increment_start"] = "2023-12-31 01:00:00"
+        _TEST_RESULT[2] = _TEST_RESULT[2]._replace(
+            increment_start="2023-12-31 01:00:00")
 
         with caplog.at_level(logging.WARNING):
             assert test_instance.parse_response(
@@ -348,17 +421,17 @@ class TestPipelineController:
 
         assert (
             "Received multiple results from the API for the same site/date/orbit/"
-            "timestamp combination: {'shoppertrak_site_id': 'aa', 'orbit': 1, "
-            "'increment_start': '2023-12-31 01:00:00', 'enters': 4, 'exits': 3, "
-            "'is_healthy_data': True, 'is_missing_data': False, 'is_fresh': True, "
-            "'poll_date': '2024-01-01'}"
+            "timestamp combination: LocationVisitsRow(shoppertrak_site_id='aa', "
+            "orbit=1, increment_start='2023-12-31 01:00:00', enters=4, exits=3, "
+            "is_healthy_data=True, is_missing_data=False, is_fresh=True, "
+            "poll_date='2024-01-01')"
         ) in caplog.text
     
     def test_parse_response_unknown_hours(self, test_instance, caplog):
         _TEST_RESULT = deepcopy(_PARSED_RESULT)
-        _TEST_RESULT[9]["is_missing_data"] = True
-        _TEST_RESULT[10]["is_missing_data"] = True
-        _TEST_RESULT[11]["is_missing_data"] = True
+        _TEST_RESULT[9] = _TEST_RESULT[9]._replace(is_missing_data=True)
+        _TEST_RESULT[10] = _TEST_RESULT[10]._replace(is_missing_data=True)
+        _TEST_RESULT[11] = _TEST_RESULT[11]._replace(is_missing_data=True)
 
         _MODIFIED_LOCATION_HOURS_DICT = deepcopy(_TEST_LOCATION_HOURS_DICT)
         del _MODIFIED_LOCATION_HOURS_DICT[("bb", "Sunday")]
@@ -386,8 +459,8 @@ class TestPipelineController:
         _MODIFIED_RESPONSE = _TEST_API_RESPONSE.replace('enters="6"', 'enters="bad"')
         _MODIFIED_RESPONSE = _MODIFIED_RESPONSE.replace('exits="3" ', "")
         _TEST_RESULT = deepcopy(_PARSED_RESULT)
-        _TEST_RESULT[4]["enters"] = None
-        _TEST_RESULT[2]["exits"] = None
+        _TEST_RESULT[4] = _TEST_RESULT[4]._replace(enters=None)
+        _TEST_RESULT[2] = _TEST_RESULT[2]._replace(exits=None)
 
         with caplog.at_level(logging.WARNING):
             assert test_instance.parse_response(
@@ -395,3 +468,332 @@ class TestPipelineController:
 
         assert "Input string 'bad' cannot be cast to an int" in caplog.text
         assert "Found blank 'exits'" in caplog.text
+
+    def test_query_stream_parse(self, test_instance, requests_mock, mocker):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE,
+        )
+        response_stream = mocker.MagicMock()
+        mocked_check_response_method = mocker.patch(
+            "lib.ShopperTrakApiClient._check_response")
+        mocked_check_streamed_response_method = mocker.patch(
+            "lib.ShopperTrakApiClient._check_streamed_response",
+            return_value=(APIStatus.SUCCESS, response_stream),
+        )
+        test_instance.stream_parse = True
+
+        assert test_instance.query("test_endpoint", date(2023, 12, 31)) == response_stream
+        mocked_check_streamed_response_method.assert_called_once_with(
+            _TEST_API_RESPONSE, date(2023, 12, 31))
+        mocked_check_response_method.assert_not_called()
+
+    def test_check_streamed_response(self, test_instance, mocker):
+        status, response_stream = test_instance._check_streamed_response(
+            _TEST_API_RESPONSE, mocker.MagicMock())
+        assert status == APIStatus.SUCCESS
+        assert type(response_stream) == XMLResponseStream
+
+    def test_check_streamed_response_unparsable(self, test_instance, caplog):
+        with caplog.at_level(logging.ERROR):
+            status, response_stream = test_instance._check_streamed_response(
+                "bad xml", date(2023, 12, 31))
+
+        assert "Could not parse XML response bad xml" in caplog.text
+        assert status == APIStatus.ERROR
+        assert response_stream is None
+
+    def test_check_streamed_response_truncated(self, test_instance, caplog):
+        _TRUNCATED_RESPONSE = _TEST_API_RESPONSE[: _TEST_API_RESPONSE.rindex("<traffic")]
+        with caplog.at_level(logging.ERROR):
+            status, response_stream = test_instance._check_streamed_response(
+                _TRUNCATED_RESPONSE, date(2023, 12, 31))
+
+        assert "Could not parse XML response" in caplog.text
+        assert status == APIStatus.ERROR
+        assert response_stream is None
+
+    def test_query_stream_parse_truncated(self, test_instance, requests_mock):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE[:-20],
+        )
+        test_instance.stream_parse = True
+
+        assert test_instance.query(
+            "test_endpoint", date(2023, 12, 31)) == APIStatus.ERROR
+
+    def test_check_streamed_response_api_limit(self, test_instance, mocker, caplog):
+        with pytest.raises(ShopperTrakApiClientError):
+            test_instance._check_streamed_response(
+                '<?xml version="1.0" ?><message><error>E107</error><description>'
+                'Customer has exceeded the maximum number of requests allowed in a 24 '
+                'hour period.</description></message>',
+                mocker.MagicMock())
+        assert "API limit exceeded" in caplog.text
+
+    def test_check_streamed_response_busy(self, test_instance, mocker, caplog):
+        with caplog.at_level(logging.WARNING):
+            status, response_stream = test_instance._check_streamed_response(
+                '<?xml version="1.0" ?><message><error>E108</error>'
+                '<description>Server is busy</description></message>',
+                mocker.MagicMock())
+
+        assert caplog.text == ""
+        assert status == APIStatus.RETRY
+        assert response_stream is None
+
+    def test_check_streamed_response_xml_error(self, test_instance, caplog):
+        with caplog.at_level(logging.ERROR):
+            status, response_stream = test_instance._check_streamed_response(
+                '<?xml version="1.0" ?><message><error>E999</error>'
+                '<description>Error!</description></message>',
+                date(2023, 12, 31))
+
+        assert "Error code E999 found in XML response:" in caplog.text
+        assert status == APIStatus.ERROR
+        assert response_stream is None
+
+    def test_check_streamed_response_no_traffic(self, test_instance, caplog):
+        with caplog.at_level(logging.ERROR):
+            status, response_stream = test_instance._check_streamed_response(
+                '<?xml version="1.0" ?><sites><site siteID="site1">'
+                '<date dateValue="20231231"><entrance name="EP 01">'
+                '</entrance></date></site></sites>',
+                date(2023, 12, 31))
+
+        assert "No traffic found in XML response:" in caplog.text
+        assert status == APIStatus.ERROR
+        assert response_stream is None
+
+    def test_parse_streamed_response(self, test_instance, caplog):
+        _, response_stream = test_instance._check_streamed_response(
+            _TEST_API_RESPONSE, date(2023, 12, 31))
+
+        with caplog.at_level(logging.WARNING):
+            assert test_instance.parse_response(
+                response_stream, date(2023, 12, 31)) == _PARSED_RESULT
+
+        assert caplog.text == ""
+
+    def test_parse_streamed_response_small_chunks(self, test_instance):
+        response_stream = XMLResponseStream(_TEST_API_RESPONSE, chunk_size=7)
+
+        assert test_instance.parse_response(
+            response_stream, date(2023, 12, 31)) == _PARSED_RESULT
+
+    def test_parse_streamed_response_recovery_mode(self, test_instance):
+        _, response_stream = test_instance._check_streamed_response(
+            _TEST_API_RESPONSE, date(2023, 12, 31))
+
+        assert test_instance.parse_response(
+            response_stream, date(2023, 12, 31), True) == _PARSED_RESULT[:6]
+
+    def test_xml_response_stream(self):
+        response_stream = XMLResponseStream(_TEST_API_RESPONSE)
+
+        assert response_stream.error_code is None
+        assert response_stream.has_traffic
+        assert [
+            (site["siteID"], date["dateValue"], entrance["entranceName"], len(traffic))
+            for site, date, entrance, traffic in response_stream.entrances
+        ] == [
+            ("aa", "20231231", "EP 01", 4),
+            ("aa", "20231231", " EP02 ", 4),
+            ("bb - test sublocation", "20231231", "EP 1", 4),
+        ]
+
+    def test_parse_streamed_response_single_pass(self, test_instance, mocker):
+        parser_spy = mocker.patch(
+            "lib.shoppertrak_api_client.ET.XMLParser", wraps=ET.XMLParser)
+
+        _, response_stream = test_instance._check_streamed_response(
+            _TEST_API_RESPONSE, date(2023, 12, 31))
+        rows = test_instance.parse_response(response_stream, date(2023, 12, 31))
+
+        assert rows == _PARSED_RESULT
+        parser_spy.assert_called_once()
+
+    def test_parse_streamed_response_bad_date(self, test_instance):
+        _MODIFIED_RESPONSE = _TEST_API_RESPONSE.replace("20231231", "20000101")
+        _, response_stream = test_instance._check_streamed_response(
+            _MODIFIED_RESPONSE, date(2023, 12, 31))
+
+        with pytest.raises(ShopperTrakApiClientError):
+            test_instance.parse_response(response_stream, date(2023, 12, 31))
+
+    def test_parse_streamed_response_bad_date_bad_poll_date(self, test_instance):
+        test_instance.bad_poll_dates = [date(2023, 12, 31)]
+        _MODIFIED_RESPONSE = _TEST_API_RESPONSE.replace("20231231", "20000101")
+        _, response_stream = test_instance._check_streamed_response(
+            _MODIFIED_RESPONSE, date(2023, 12, 31))
+
+        assert test_instance.parse_response(response_stream, date(2023, 12, 31)) == []
+
+    def test_xml_response_stream_truncated(self):
+        with pytest.raises(ET.ParseError):
+            XMLResponseStream(_TEST_API_RESPONSE[:-20])
+
+    def test_parse_response_irregular_start_time(self, test_instance):
+        _MODIFIED_RESPONSE = _TEST_API_RESPONSE.replace(
+            'enters="2" startTime="010000"', 'enters="2" startTime="010730"'
+        )
+        _TEST_RESULT = deepcopy(_PARSED_RESULT)
+        _TEST_RESULT[1] = _TEST_RESULT[1]._replace(
+            increment_start="2023-12-31 01:07:30")
+
+        assert test_instance.parse_response(
+            ET.fromstring(_MODIFIED_RESPONSE), date(2023, 12, 31)) == _TEST_RESULT
+
+    def test_location_hours_reset(self, test_instance):
+        assert test_instance._get_site_hours("bb - test", "Sunday") == (
+            time(1), time(3))
+
+        test_instance.location_hours_dict = {("bb", "Sunday"): (None, None)}
+        assert test_instance._get_site_hours("bb - test", "Sunday") == (None, None)
+        assert test_instance._get_site_hours("bb - test", "Monday") is None
+
+    def test_query_retry_metrics(self, test_instance, requests_mock, mocker, mock_sleep):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE,
+        )
+        mocker.patch(
+            "lib.ShopperTrakApiClient._check_response",
+            side_effect=[
+                (APIStatus.RETRY, None),
+                (APIStatus.SUCCESS, ET.fromstring(_TEST_API_RESPONSE)),
+            ],
+        )
+
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        metrics = test_instance.retry_scheduler.metrics()
+        assert metrics["retry_attempts"] == 1
+        assert metrics["total_wait_seconds"] == 15
+        assert metrics["breaker_state"] == "closed"
+        # A single busy response pauses every request
+        assert metrics["breaker_opens"] == 1
+
+    def test_query_session(self, test_instance, requests_mock):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE,
+        )
+
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        assert requests_mock.call_count == 2
+        for request in requests_mock.request_history:
+            assert request.headers["Authorization"].startswith("Basic ")
+            assert request.headers["Accept-Encoding"] == "gzip"
+            assert request.headers["Content-Type"] == "application/xml"
+            assert request.timeout == (10.0, 300.0)
+
+    def test_close(self, test_instance, mocker):
+        test_instance.session = mocker.MagicMock()
+        test_instance.close()
+        test_instance.session.close.assert_called_once()
+
+    def test_request_count(self, test_instance, requests_mock):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE,
+        )
+
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        assert test_instance.request_count == 2
+
+    def test_get_response_text(self, test_instance, requests_mock):
+        response_stream = XMLResponseStream(_TEST_API_RESPONSE)
+        assert test_instance.get_response_text(response_stream) == _TEST_API_RESPONSE
+        assert not test_instance.is_cached_response(response_stream)
+
+        # The exact text sent by ShopperTrak is kept, not a re-serialized tree
+        raw_response = _TEST_API_RESPONSE.replace("<sites>", "<sites >\n", 1)
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=raw_response,
+        )
+        root = test_instance.query("test_endpoint", date(2023, 12, 31))
+        assert test_instance.get_response_text(root) == raw_response
+        assert not test_instance.is_cached_response(root)
+
+    def test_query_cache_hit(self, test_instance, requests_mock, mocker):
+        test_instance.response_cache = mocker.MagicMock()
+        test_instance.response_cache.get.return_value = _TEST_API_RESPONSE
+
+        root = test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        assert root.tag == "sites"
+        assert test_instance.is_cached_response(root)
+        assert requests_mock.call_count == 0
+        assert test_instance.request_count == 0
+        test_instance.response_cache.set.assert_not_called()
+
+    def test_query_cache_hit_stream(self, test_instance, requests_mock, mocker):
+        test_instance.stream_parse = True
+        test_instance.response_cache = mocker.MagicMock()
+        test_instance.response_cache.get.return_value = _TEST_API_RESPONSE
+
+        response_stream = test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        assert test_instance.is_cached_response(response_stream)
+        assert requests_mock.call_count == 0
+
+    def test_query_cache_miss(self, test_instance, requests_mock, mocker):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE,
+        )
+        test_instance.response_cache = mocker.MagicMock()
+        test_instance.response_cache.get.return_value = None
+        params = {"date": "20231231", "increment": "15",
+                  "total_property_only": "false", "detail": "entrance"}
+
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        test_instance.response_cache.get.assert_called_once_with(
+            "service/test_endpoint", date(2023, 12, 31), params)
+        test_instance.response_cache.set.assert_called_once_with(
+            "service/test_endpoint", date(2023, 12, 31), params, _TEST_API_RESPONSE)
+
+    def test_query_cache_error_not_cached(self, test_instance, requests_mock, mocker):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text="error",
+        )
+        mocker.patch("lib.ShopperTrakApiClient._check_response",
+                     return_value=(APIStatus.ERROR, None))
+        test_instance.response_cache = mocker.MagicMock()
+        test_instance.response_cache.get.return_value = None
+
+        test_instance.query("test_endpoint", date(2023, 12, 31))
+
+        test_instance.response_cache.set.assert_not_called()
+
+    def test_query_cache_truncated_stream_not_cached(
+            self, test_instance, requests_mock, mocker):
+        requests_mock.get(
+            "https://test_shoppertrak_url/service/test_endpoint"
+            "?date=20231231&increment=15&total_property_only=false&detail=entrance",
+            text=_TEST_API_RESPONSE[:-20],
+        )
+        test_instance.stream_parse = True
+        test_instance.response_cache = mocker.MagicMock()
+        test_instance.response_cache.get.return_value = None
+
+        assert test_instance.query(
+            "test_endpoint", date(2023, 12, 31)) == APIStatus.ERROR
+        test_instance.response_cache.set.assert_not_called()
@@ -0,0 +1,118 @@
+import pytest
+import threading
+import time
+
+from lib.staged_pipeline import StagedPipeline
+
+
+class TestStagedPipeline:
+
+    @pytest.fixture
+    def test_instance(self):
+        return StagedPipeline(
+            [
+                ("double", lambda x: x * 2, 3),
+                ("add", lambda x: x + 1, 1),
+            ],
+            queue_size=2,
+        )
+
+    def test_run(self, test_instance):
+        assert list(test_instance.run(range(20))) == [n * 2 + 1 for n in range(20)]
+
+        summary = test_instance.summary()
+        assert summary["double"]["items"] == 20
+        assert summary["add"]["items"] == 20
+        assert summary["double"]["queue_size"] == 2
+        assert summary["double"]["max_queue_occupancy"] <= 2
+        assert summary["add"]["max_queue_occupancy"] <= 2
+
+    def test_run_empty(self, test_instance):
+        assert list(test_instance.run([])) == []
+
+    def test_run_in_order(self):
+        def slow_early(x):
+            time.sleep(0.05 if x < 3 else 0)
+            return x
+
+        test_instance = StagedPipeline([("slow", slow_early, 4)])
+        assert list(test_instance.run(range(10))) == list(range(10))
+
+    def test_run_overlaps_stages(self):
+        first_started = threading.Event()
+        second_started = threading.Event()
+
+        def first(x):
+            first_started.set()
+            return x
+
+        def second(x):
+            # The first stage should be free to pick up the next item while the
+            # second stage is still working on this one
+            second_started.set()
+            time.sleep(0.05)
+            return x
+
+        test_instance = StagedPipeline([("first", first, 1), ("second", second, 1)])
+        assert list(test_instance.run(range(5))) == list(range(5))
+        assert first_started.is_set() and second_started.is_set()
+        assert test_instance.summary()["second"]["busy_seconds"] >= 0.25
+
+    def test_run_skips_none(self):
+        calls = []
+
+        def second(x):
+            calls.append(x)
+            return x
+
+        test_instance = StagedPipeline(
+            [("first", lambda x: None if x == 2 else x, 1), ("second", second, 1)]
+        )
+        assert list(test_instance.run(range(4))) == [0, 1, None, 3]
+        assert calls == [0, 1, 3]
+
+    def test_run_error(self):
+        def fail_on_three(x):
+            if x == 3:
+                raise ValueError("bad item")
+            return x
+
+        results = []
+        test_instance = StagedPipeline([("fail", fail_on_three, 2)])
+        with pytest.raises(ValueError):
+            for result in test_instance.run(range(10)):
+                results.append(result)
+
+        assert results == [0, 1, 2]
+
+    def test_run_bounded(self):
+        started = []
+
+        def record(x):
+            started.append(x)
+            return x
+
+        test_instance = StagedPipeline([("record", record, 1)], queue_size=1)
+        results = test_instance.run(range(1000))
+        assert next(results) == 0
+        time.sleep(0.05)
+
+        # Only a few items can be in flight while the consumer is not reading
+        assert len(started) <= 3
+        results.close()
+
+    def test_run_stops_early(self, test_instance):
+        results = test_instance.run(range(1000))
+        assert [next(results) for _ in range(3)] == [1, 3, 5]
+        results.close()
+
+        assert test_instance.summary()["double"]["items"] < 1000
+
+    def test_timed(self, test_instance):
+        for _ in test_instance.run(range(3)):
+            with test_instance.timed("send"):
+                pass
+
+        summary = test_instance.summary()["send"]
+        assert summary["items"] == 3
+        assert "queue_size" not in summary